@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+图片标注工具的异步（ASGI）服务器入口
+与 server.py 提供相同的路由：请求在线程池中交给Flask应用处理，响应体（图片文件、流式的图片列表）
+逐块在线程池中读取后异步发送。慢速存储上的一次读取或慢速的客户端只占用事件循环中的一个协程，
+线程只在实际读取一块数据时被占用，不会因为少数慢请求耗尽所有工作线程。
+
+HTTP协议由 uvicorn 处理（见 requirements.txt），未安装 uvicorn 时拒绝启动:
+    python async_server.py --port 5000
+    uvicorn async_server:app --port 5000
+"""
+
+import argparse
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wsgi import FileWrapper
+
+from server import (
+    CSV_FILE,
+    SUPPORTED_FORMATS,
+    WAL_FILE,
+    app as flask_app,
+    configure_logging,
+    get_annotation_store,
+)
+
+# uvicorn 只在运行异步服务器时需要，导入本模块（如基准测试）不要求安装
+try:
+    import uvicorn
+
+    UVICORN_AVAILABLE = True
+except ImportError:
+    UVICORN_AVAILABLE = False
+
+
+# 执行Flask请求和文件读取的线程数
+ASYNC_IO_WORKERS = 64
+# 流式发送图片时每块的大小
+IMAGE_CHUNK_SIZE = 256 * 1024
+
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 5000
+
+
+def file_wrapper(file, buffer_size=8192):
+    """按 IMAGE_CHUNK_SIZE 分块读取文件（send_file 通过 wsgi.file_wrapper 使用）"""
+    return FileWrapper(file, max(buffer_size, IMAGE_CHUNK_SIZE))
+
+
+def build_environ(scope, body):
+    """把ASGI的HTTP scope转换为WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(client[0]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "wsgi.file_wrapper": file_wrapper,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WSGIBridge:
+    """在线程池中运行WSGI应用的ASGI应用
+
+    同一请求的各步骤在同一个contextvars上下文中依次执行，
+    因此 stream_with_context 等依赖请求上下文的流式响应可以在不同线程中继续迭代。
+    """
+
+    def __init__(self, wsgi_app, max_workers=ASYNC_IO_WORKERS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="asgi-io"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        environ = build_environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        def run(func, *args):
+            return loop.run_in_executor(self.executor, context.run, func, *args)
+
+        iterable = await run(self.wsgi_app, environ, start_response)
+        try:
+            if isinstance(iterable, (list, tuple)):
+                chunks = list(iterable)
+                iterator = None
+            else:
+                # 生成器形式的响应在第一次迭代时才调用start_response
+                iterator = iter(iterable)
+                first = await run(next, iterator, None)
+                chunks = [] if first is None else [first]
+
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response["status"],
+                    "headers": response["headers"],
+                }
+            )
+            for chunk in chunks:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            while iterator is not None:
+                chunk = await run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await run(close)
+
+    async def _lifespan(self, receive, send):
+        """uvicorn async_server:app 不经过 main()，日志和标注存储在启动事件中初始化"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(self.executor, startup)
+                except RuntimeError as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def startup():
+    """配置日志并创建标注存储；另一个服务器进程持有预写日志的文件锁时抛出RuntimeError"""
+    configure_logging()
+    get_annotation_store()
+
+
+app = WSGIBridge(flask_app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片标注工具异步服务器")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"监听地址 (默认: {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"端口 (默认: {SERVER_PORT})")
+    args = parser.parse_args()
+    if not UVICORN_AVAILABLE:
+        print("错误: 未安装uvicorn，请运行 pip install -r requirements.txt，或使用 python server.py")
+        sys.exit(1)
+    try:
+        startup()
+    except RuntimeError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    print("图片标注工具异步服务器启动中...")
+    print(f"请在浏览器中访问: http://localhost:{args.port}")
+    print("支持的图片格式:", ", ".join(SUPPORTED_FORMATS))
+    print("标注结果将保存到:", CSV_FILE)
+    print("标注预写日志:", WAL_FILE)
+    print("\n按 Ctrl+C 停止服务器")
+
+    try:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+异步服务器延迟基准测试
+分别启动 server.py（Flask）和 async_server.py（ASGI），用默认200个并发的keep-alive连接
+混合请求原图（/api/image/）、/api/status 和 /api/save，比较两者的p50/p99延迟和吞吐量
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    "flask": os.path.join(ROOT, "server.py"),
+    "async": os.path.join(ROOT, "async_server.py"),
+}
+
+
+def build_images(image_dir, count, width, height):
+    """生成随机噪声JPEG（几乎不可压缩，文件较大）"""
+    import numpy as np
+    from PIL import Image
+
+    os.makedirs(image_dir, exist_ok=True)
+    paths = []
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        path = os.path.join(image_dir, f"bench_{i}.jpg")
+        if not os.path.exists(path):
+            pixels = (rng.random((height, width, 3)) * 255).astype("uint8")
+            Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            status, _ = await http_request(reader, writer, "GET", "/api/status")
+            writer.close()
+            if status == 200:
+                return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def http_request(reader, writer, method, path, body=None):
+    """发送一个HTTP/1.1请求并读完响应，返回 (状态码, 服务器是否要求关闭连接)"""
+    head = f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+    if body is not None:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("连接已关闭")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return status, True
+    return status, headers.get("connection") == "close"
+
+
+async def run_load(port, images, connections, requests_per_connection):
+    """每个连接依次发送请求；返回每类请求的延迟列表、失败次数和总耗时"""
+    latencies = {"image": [], "status": [], "save": []}
+    failures = [0]
+
+    async def connection(conn_no):
+        reader = writer = None
+        for i in range(requests_per_connection):
+            kind = "status" if i % 10 == 8 else "save" if i % 10 == 9 else "image"
+            if kind == "image":
+                image_path = images[(conn_no + i) % len(images)]
+                method, path, body = "GET", f"/api/image/?path={quote(image_path)}", None
+            elif kind == "status":
+                method, path, body = "GET", "/api/status", None
+            else:
+                changes = {
+                    f"/bench/conn_{conn_no}/img_{i}.jpg": {
+                        "quality": "Good",
+                        "timestamp": "2025-08-18T02:03:32.457000",
+                    }
+                }
+                payload = {"client_id": f"conn-{conn_no}", "seq": i, "changes": changes}
+                method, path, body = "POST", "/api/save", json.dumps(payload).encode("utf-8")
+
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                status, close = await http_request(reader, writer, method, path, body)
+                if status != 200:
+                    failures[0] += 1
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                failures[0] += 1
+                close = True
+            latencies[kind].append(time.perf_counter() - start)
+            if close and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection(i) for i in range(connections)))
+    return latencies, failures[0], time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def bench_server(name, work_dir, images, args):
+    port = free_port()
+    server_dir = os.path.join(work_dir, name)
+    os.makedirs(server_dir, exist_ok=True)
+    command = [sys.executable, SERVERS[name], "--host", "127.0.0.1", "--port", str(port)]
+    process = subprocess.Popen(
+        command, cwd=server_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not asyncio.run(wait_ready(port)):
+            print(f"错误: {name} 服务器没有启动")
+            sys.exit(1)
+        # 预热：每张图片读一次，使两种服务器都从页缓存读取
+        asyncio.run(run_load(port, images, len(images), 1))
+        return asyncio.run(
+            run_load(port, images, args.connections, args.requests)
+        )
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask与异步服务器的延迟对比")
+    parser.add_argument("--connections", type=int, default=200, help="并发连接数")
+    parser.add_argument("--requests", type=int, default=30, help="每个连接发送的请求数")
+    parser.add_argument("--images", type=int, default=20, help="测试图片数量")
+    parser.add_argument("--width", type=int, default=1600, help="测试图片宽度")
+    parser.add_argument("--height", type=int, default=1200, help="测试图片高度")
+    parser.add_argument("--work-dir", help="图片和服务器数据目录 (默认: 临时目录)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="annotation_async_bench_")
+    images = build_images(os.path.join(work_dir, "images"), args.images, args.width, args.height)
+    size_mb = sum(os.path.getsize(p) for p in images) / len(images) / 1024 / 1024
+    print(f"{len(images)} 张图片，平均 {size_mb:.1f} MB；{args.connections} 个并发连接，"
+          f"每个连接 {args.requests} 个请求（80% 原图，10% status，10% save）")
+
+    print(f"\n{'服务器':<8} {'请求':<7} {'p50(ms)':>9} {'p99(ms)':>9} {'请求/秒':>9} {'失败':>6}")
+    for name in SERVERS:
+        if name == "async" and importlib.util.find_spec("uvicorn") is None:
+            print(f"{name:<8} 跳过：异步服务器需要uvicorn（pip install -r requirements.txt）")
+            continue
+        latencies, failures, elapsed = bench_server(name, work_dir, images, args)
+        total = sum(len(v) for v in latencies.values())
+        for kind, values in latencies.items():
+            print(
+                f"{name:<8} {kind:<7} {percentile(values, 0.5):>9.1f} "
+                f"{percentile(values, 0.99):>9.1f} {len(values) / elapsed:>9.1f}"
+            )
+        print(f"{name:<8} {'全部':<7} {'':>9} {'':>9} {total / elapsed:>9.1f} {failures:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+CSV图片列表解析基准测试
+比较 /api/images_from_csv 原始的逐行实现（Python列表掩码、iterrows、逐个路径清洗）
+与路由实际调用的 server.select_csv_images：清单缓存未命中（新建FrameManifest，先按列筛选，
+只解析通过筛选的行）和缓存清单更换筛选条件后的重新筛选，默认在500万行的合成CSV上运行
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+def legacy_select(df, path_col, applicable_filters):
+    """原始实现（不含文件存在性检查，两种实现都跳过该步骤）"""
+    raw_quality_map = {}
+    if applicable_filters:
+        mask = pd.Series([True] * len(df))
+        for k, values in applicable_filters.items():
+            mask = mask & df[k].astype(str).isin(values)
+        df = df[mask]
+
+    image_paths = df[path_col].dropna().astype(str).tolist()
+    if "quality" in df.columns:
+        for _, row in df.iterrows():
+            raw_path = row.get(path_col)
+            if pd.isna(raw_path):
+                continue
+            p = str(raw_path).strip().strip('"').strip("'")
+            q = row.get("quality")
+            if not pd.isna(q):
+                raw_quality_map[p] = str(q)
+
+    valid_images = []
+    invalid_entries = 0
+    for p in image_paths:
+        candidate = p.strip().strip('"').strip("'")
+        if not os.path.isabs(candidate):
+            candidate = os.path.normpath(os.path.join(server.PROJECT_ROOT, candidate))
+        if server.is_image_file(candidate):
+            valid_images.append(candidate)
+        else:
+            invalid_entries += 1
+
+    qualities = {}
+    for raw_key, q in raw_quality_map.items():
+        k = (raw_key or "").strip().strip('"').strip("'")
+        if not os.path.isabs(k):
+            k = os.path.normpath(os.path.join(server.PROJECT_ROOT, k))
+        qualities[k] = q
+    qualities = {vp: qualities[vp] for vp in valid_images if vp in qualities}
+    return valid_images, qualities, invalid_entries
+
+
+def served_select(manifest, applicable_filters):
+    """路由使用的实现（不含文件存在性检查，两种实现都跳过该步骤）"""
+    return server.select_csv_images(manifest, applicable_filters, validate="lazy")
+
+
+def build_csv(csv_path, rows):
+    """生成合成清单：混合绝对/相对/带引号/带 .. 的路径，以及非图片和空路径"""
+    if os.path.exists(csv_path):
+        print(f"复用已有CSV: {csv_path}")
+        return
+
+    print(f"正在生成 {rows} 行CSV到 {csv_path} ...")
+    chunk = 500_000
+    for start in range(0, rows, chunk):
+        ids = range(start, min(rows, start + chunk))
+        paths = []
+        for i in ids:
+            kind = i % 10
+            if kind < 5:
+                paths.append(f"/data/images/d{i % 997}/img_{i}.jpg")
+            elif kind < 7:
+                paths.append(f"images/d{i % 997}/img_{i}.PNG")
+            elif kind == 7:
+                paths.append(f'"images/../images/d{i % 997}/img_{i}.webp"')
+            elif kind == 8:
+                paths.append(f" /data/docs/d{i % 997}/file_{i}.txt ")
+            else:
+                paths.append("" if i % 20 == 9 else f"./images/img_{i}.jpeg")
+        frame = pd.DataFrame(
+            {
+                "path": paths,
+                "quality": ["Good" if i % 3 else ("Bad" if i % 2 else None) for i in ids],
+                "cid": [str(i % 50) for i in ids],
+            }
+        )
+        frame.to_csv(csv_path, mode="a", header=start == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV图片列表解析基准测试")
+    parser.add_argument("--csv", help="合成CSV位置 (默认: 临时目录)")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="CSV行数")
+    args = parser.parse_args()
+
+    csv_path = args.csv or os.path.join(
+        tempfile.gettempdir(), f"image_manifest_bench_{args.rows}.csv"
+    )
+    build_csv(csv_path, args.rows)
+
+    start = time.perf_counter()
+    df = pd.read_csv(csv_path)
+    print(f"pd.read_csv: {time.perf_counter() - start:.2f}s ({len(df)} 行，两种实现共用)")
+
+    start = time.perf_counter()
+    manifest = server.FrameManifest(df, "path")
+    print(f"构建缓存清单: {time.perf_counter() - start:.2f}s")
+
+    cases = [
+        ("无筛选", {}),
+        ("cid筛选（50%的行）", {"cid": [str(i) for i in range(0, 50, 2)]}),
+        # cid 与路径类型无关联的取值组合，保持与全表相同的路径混合比例
+        ("cid筛选（20%的行）", {"cid": [str(i) for i in range(10)]}),
+    ]
+    for label, applicable_filters in cases:
+        print(f"\n[{label}]")
+        start = time.perf_counter()
+        legacy = legacy_select(df, "path", applicable_filters)
+        legacy_time = time.perf_counter() - start
+        print(f"  原始实现:   {legacy_time:8.2f}s  ({len(legacy[0])} 张图片)")
+
+        start = time.perf_counter()
+        vectorized = served_select(server.FrameManifest(df, "path"), applicable_filters)
+        vectorized_time = time.perf_counter() - start
+        print(f"  缓存未命中: {vectorized_time:8.2f}s  ({len(vectorized[0])} 张图片)")
+
+        # 缓存清单中的路径在首次选中时解析，先预热一次再计时
+        served_select(manifest, applicable_filters)
+        start = time.perf_counter()
+        cached = served_select(manifest, applicable_filters)
+        cached_time = time.perf_counter() - start
+        print(f"  缓存清单:   {cached_time:8.2f}s  ({len(cached[0])} 张图片)")
+
+        if not (legacy == vectorized == cached):
+            print("错误: 几种实现的结果不一致")
+            sys.exit(1)
+        print(f"  加速比: {legacy_time / vectorized_time:.1f}x (缓存未命中), "
+              f"{legacy_time / cached_time:.1f}x (缓存清单)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+并发保存压力测试
+在临时目录中启动 server.py，分别用 1、8、32 个并发客户端调用 /api/save（增量模式），
+统计每秒保存次数和延迟；结束后停止服务器，检查会话CSV和预写日志中每一行都完整、
+没有交错，且所有变更都已写入
+"""
+
+import argparse
+import csv
+import glob
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py"
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/status")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class Client:
+    """保持连接的HTTP客户端，连接被服务器关闭时重新连接"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def post(self, path, payload):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            try:
+                self.conn.request("POST", path, body, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    self.conn.close()
+                    self.conn = None
+                return json.loads(data)
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def run_level(port, clients, saves, changes, level):
+    """clients 个线程各保存 saves 次，每次 changes 张图片；返回 (耗时, 延迟列表, 失败次数)"""
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(client_no):
+        client = Client(port)
+        client_id = f"bench-{level}-{client_no}"
+        local = []
+        barrier.wait()
+        for seq in range(saves):
+            payload = {
+                "client_id": client_id,
+                "seq": seq,
+                "changes": {
+                    f"/bench/{client_id}/img_{seq}_{k}.jpg": {
+                        "quality": "Good" if k % 2 else "Bad",
+                        "timestamp": "2025-08-18T02:03:32.457000",
+                    }
+                    for k in range(changes)
+                },
+            }
+            start = time.perf_counter()
+            result = client.post("/api/save", payload)
+            local.append(time.perf_counter() - start)
+            if not result.get("success") or result.get("written") != changes:
+                with lock:
+                    failures[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), failures[0]
+
+
+def verify(work_dir, expected_rows):
+    """检查CSV和预写日志的每一行都完整，返回错误信息列表"""
+    errors = []
+    csv_files = glob.glob(os.path.join(work_dir, "data", "annotations_*.csv"))
+    if len(csv_files) != 1:
+        return [f"应有1个会话CSV，实际 {len(csv_files)} 个"]
+
+    with open(csv_files[0], "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        paths = set()
+        rows = 0
+        for row in reader:
+            rows += 1
+            if len(row) != len(header) or not row[0].startswith("/bench/"):
+                errors.append(f"CSV第 {rows} 行不完整: {row!r}")
+            paths.add(row[0])
+    if rows != expected_rows or len(paths) != expected_rows:
+        errors.append(f"CSV应有 {expected_rows} 行，实际 {rows} 行（{len(paths)} 张不同的图片）")
+
+    wal_rows = 0
+    with open(os.path.join(work_dir, "data", "annotations.wal"), encoding="utf-8") as f:
+        for line in f:
+            try:
+                json.loads(line)
+                wal_rows += 1
+            except ValueError:
+                errors.append(f"预写日志中有不完整的行: {line[:80]!r}")
+    if wal_rows != expected_rows:
+        errors.append(f"预写日志应有 {expected_rows} 行，实际 {wal_rows} 行")
+    return errors[:20]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发保存压力测试")
+    parser.add_argument("--clients", default="1,8,32", help="并发客户端数，逗号分隔")
+    parser.add_argument("--saves", type=int, default=200, help="每个客户端的保存次数")
+    parser.add_argument("--changes", type=int, default=5, help="每次保存的图片数")
+    parser.add_argument(
+        "--server-args", default="", help="传给 server.py 的额外参数，如 \"--server waitress\""
+    )
+    args = parser.parse_args()
+    levels = [int(c) for c in args.clients.split(",")]
+
+    work_dir = tempfile.mkdtemp(prefix="annotation_bench_")
+    port = free_port()
+    command = [sys.executable, SERVER_PATH, "--host", "127.0.0.1", "--port", str(port)]
+    command += args.server_args.split()
+    print(f"启动服务器: {' '.join(command)} (工作目录 {work_dir})")
+    server = subprocess.Popen(
+        command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    expected_rows = 0
+    try:
+        if not wait_ready(port):
+            print("错误: 服务器没有启动")
+            sys.exit(1)
+
+        print(f"\n{'客户端':>6} {'保存/秒':>10} {'行/秒':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'失败':>6}")
+        for level in levels:
+            elapsed, latencies, failures = run_level(
+                port, level, args.saves, args.changes, level
+            )
+            total = level * args.saves
+            expected_rows += total * args.changes
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(
+                f"{level:>6} {total / elapsed:>10.1f} {total * args.changes / elapsed:>10.1f} "
+                f"{p50:>9.2f} {p99:>9.2f} {failures:>6}"
+            )
+    finally:
+        # SIGINT 让服务器正常退出，写出所有待写入的变更
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    errors = verify(work_dir, expected_rows)
+    if errors:
+        print("\n错误: 数据检查失败")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print(f"\n数据检查通过: CSV和预写日志各 {expected_rows} 行，全部完整")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+目录扫描基准测试
+在合成目录树上比较原始的 os.walk + sorted 实现、并行 os.scandir 冷扫描，
+以及服务器实际使用的 FolderIndex（冷扫描和按目录mtime的增量扫描）
+"""
+
+import argparse
+import heapq
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+def legacy_get_image_files(folder_path):
+    """原始实现：os.walk + 每个文件构造Path + 全局排序"""
+    if not os.path.exists(folder_path):
+        return []
+
+    image_files = []
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if Path(file_path).suffix.lower() in server.SUPPORTED_FORMATS:
+                image_files.append(file_path)
+
+    return sorted(image_files)
+
+
+def parallel_scan(folder_path, max_workers):
+    """不带索引的并行冷扫描（与FolderIndex使用同一个 server.parallel_walk），合并各目录已排序的结果"""
+    chunks = {}
+
+    def visit(dir_path):
+        files, subdirs = server.list_image_dir(dir_path)
+        if files:
+            chunks[dir_path] = [os.path.join(dir_path, name) for name in files]
+        return subdirs
+
+    server.parallel_walk(folder_path, visit, max_workers)
+    return list(heapq.merge(*chunks.values()))
+
+
+def build_tree(root, total_files, files_per_dir, dirs_per_level):
+    """生成合成目录树：两级目录，每个叶子目录 files_per_dir 个文件（约1/10为非图片）"""
+    marker = os.path.join(root, f".tree_{total_files}_{files_per_dir}")
+    if os.path.exists(marker):
+        print(f"复用已有目录树: {root}")
+        return
+
+    print(f"正在生成 {total_files} 个文件到 {root} ...")
+    leaf_count = max(1, total_files // files_per_dir)
+    created = 0
+    for leaf in range(leaf_count):
+        leaf_dir = os.path.join(
+            root, f"g{leaf // dirs_per_level:04d}", f"d{leaf % dirs_per_level:04d}"
+        )
+        os.makedirs(leaf_dir, exist_ok=True)
+        for i in range(files_per_dir):
+            ext = ".txt" if i % 10 == 0 else ".jpg"
+            open(os.path.join(leaf_dir, f"{i:06d}{ext}"), "wb").close()
+            created += 1
+    open(marker, "w").close()
+    print(f"生成完成: {created} 个文件, {leaf_count} 个叶子目录")
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:8.3f}s  ({len(result)} 张图片)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="目录扫描基准测试")
+    parser.add_argument("--root", help="合成目录树位置 (默认: 临时目录)")
+    parser.add_argument("--files", type=int, default=1_000_000, help="文件总数")
+    parser.add_argument("--files-per-dir", type=int, default=1000)
+    parser.add_argument("--dirs-per-level", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=server.SCAN_WORKERS)
+    args = parser.parse_args()
+
+    root = args.root or os.path.join(tempfile.gettempdir(), "image_scan_bench")
+    os.makedirs(root, exist_ok=True)
+    build_tree(root, args.files, args.files_per_dir, args.dirs_per_level)
+
+    print(f"\n扫描 {root} (线程数: {args.workers})")
+    legacy, legacy_time = timed("os.walk + sorted", legacy_get_image_files, root)
+    scanned, scan_time = timed(
+        "parallel scandir", parallel_scan, root, args.workers
+    )
+    if scanned != legacy:
+        print("错误: 两种实现的结果不一致")
+        sys.exit(1)
+
+    index_file = os.path.join(root, ".folder_index.json")
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    index = server.FolderIndex(index_file, ttl=0)
+    timed("FolderIndex (冷)", index.get_image_files, root)
+    timed("FolderIndex (增量)", index.get_image_files, root)
+    os.remove(index_file)
+
+    print(f"\n加速比: {legacy_time / scan_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
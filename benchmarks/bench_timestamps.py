@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+时间戳解析基准测试
+在默认1000万个ISO 8601时间戳（与服务器写入的格式相同，混入少量无法解析的值）上比较：
+不指定格式的 pd.to_datetime、逐行 datetime.fromisoformat，以及 timestamp_utils.parse_column
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timestamp_utils  # noqa: E402
+
+
+def build_timestamps(rows, bad_every):
+    """生成 YYYY-MM-DDTHH:MM:SS.ffffff 格式的时间戳，每 bad_every 行放一个无法解析的值"""
+    rng = np.random.default_rng(0)
+    start = np.datetime64("2025-01-01T00:00:00", "us")
+    offsets = np.sort(rng.integers(0, 180 * 24 * 3600 * 10**6, rows)).astype("timedelta64[us]")
+    values = np.datetime_as_string(start + offsets, unit="us").astype(object)
+    if bad_every:
+        values[::bad_every] = "not a timestamp"
+    return pd.Series(values)
+
+
+def legacy_to_datetime(values):
+    """原始实现：不指定格式，解析失败时整列报错"""
+    return pd.to_datetime(values, errors="coerce")
+
+
+def legacy_fromisoformat(values):
+    """原始的标准库去重：逐行 fromisoformat"""
+    parsed = []
+    for value in values:
+        try:
+            parsed.append(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            parsed.append(None)
+    return parsed
+
+
+def timed(label, rows, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:8.2f}s  {rows / elapsed / 1e6:6.2f} M行/秒")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="时间戳解析基准测试")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="时间戳数量")
+    parser.add_argument(
+        "--bad-every", type=int, default=100_000, help="每隔多少行放一个无法解析的值 (0表示不放)"
+    )
+    parser.add_argument(
+        "--stdlib-rows", type=int, default=1_000_000, help="逐行解析只测试前若干行，再按比例换算"
+    )
+    args = parser.parse_args()
+
+    print(f"正在生成 {args.rows} 个时间戳...")
+    values = build_timestamps(args.rows, args.bad_every)
+
+    print("\n解析:")
+    legacy, legacy_time = timed("pd.to_datetime (无格式)", args.rows, legacy_to_datetime, values)
+
+    sample = values.head(args.stdlib_rows)
+    _, stdlib_time = timed(
+        f"fromisoformat (前{len(sample)}行)", len(sample), legacy_fromisoformat, sample
+    )
+
+    (parsed, report), parse_time = timed(
+        "parse_column", args.rows, timestamp_utils.parse_column, values
+    )
+
+    print(f"\n识别的格式: {report['format']}")
+    print(f"无法解析的行数: {report['unparseable']}")
+    if not parsed.equals(legacy):
+        print("错误: parse_column 与 pd.to_datetime 的结果不一致")
+        sys.exit(1)
+
+    print(f"\n加速比: {legacy_time / parse_time:.1f}x (对比 pd.to_datetime), "
+          f"{stdlib_time * args.rows / len(sample) / parse_time:.1f}x (对比逐行 fromisoformat)")
+
+
+if __name__ == "__main__":
+    main()
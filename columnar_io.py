@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+列式文件读写工具
+图片清单和标注结果除CSV外还支持 Parquet、Feather 和 Arrow IPC 格式。
+读取时使用内存映射并只读取需要的列，quality 和目录列以字典编码保存，
+百万行级别的清单可以直接载入而不必重新解析文本和时间戳。
+
+命令行用法（按扩展名判断格式，可用于CSV与列式格式互相转换）:
+    python columnar_io.py annotations.csv annotations.parquet
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+try:
+    import pandas as pd
+
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from timestamp_utils import parse_column
+
+
+# 扩展名 -> 格式；Feather v2 与 Arrow IPC 文件格式相同
+COLUMNAR_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "arrow",
+    ".ipc": "arrow",
+}
+
+# 取值重复度高的列，写入时使用字典编码
+DICTIONARY_COLUMNS = ("quality", "image_dir", "dir", "directory")
+
+# 写入时尝试转换为时间类型的列
+TIMESTAMP_COLUMNS = ("timestamp",)
+
+
+def columnar_format(file_path):
+    """返回列式文件的格式名，不是列式文件时返回None"""
+    return COLUMNAR_FORMATS.get(os.path.splitext(file_path)[1].lower())
+
+
+def is_table_file(file_path):
+    """是否为支持的表格文件（CSV或列式格式）"""
+    return file_path.lower().endswith(".csv") or columnar_format(file_path) is not None
+
+
+def require_columnar():
+    """列式格式需要pandas和pyarrow，缺少时抛出ImportError"""
+    if not (PANDAS_AVAILABLE and PYARROW_AVAILABLE):
+        raise ImportError("读写Parquet/Feather/Arrow文件需要安装pandas和pyarrow")
+
+
+def _open_ipc(file_path):
+    """以内存映射方式打开Feather/Arrow IPC文件；无压缩时读取的列直接引用映射的内存"""
+    return pa.ipc.open_file(pa.memory_map(file_path, "r"))
+
+
+def read_columns(file_path):
+    """只读取文件的列名"""
+    if columnar_format(file_path) is None:
+        with open(file_path, "r", encoding="utf-8", newline="") as f:
+            return next(csv.reader(f), [])
+
+    require_columnar()
+    if columnar_format(file_path) == "parquet":
+        return pq.read_schema(file_path, memory_map=True).names
+    return _open_ipc(file_path).schema.names
+
+
+def read_arrow(file_path, columns=None):
+    """读取列式文件为pyarrow.Table，只读取columns中的列（None表示全部）"""
+    require_columnar()
+    if columnar_format(file_path) == "parquet":
+        return pq.read_table(file_path, columns=columns, memory_map=True)
+
+    table = _open_ipc(file_path).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def read_table(file_path, columns=None):
+    """读取CSV或列式文件为DataFrame
+
+    Args:
+        file_path (str): 文件路径，按扩展名判断格式
+        columns (list): 只读取这些列（None表示全部）
+    """
+    if columnar_format(file_path) is None:
+        return pd.read_csv(file_path, usecols=columns)
+
+    # 字典编码的列转换为pandas的Categorical，不会为每行复制一份字符串
+    return read_arrow(file_path, columns).to_pandas()
+
+
+def iter_chunks(file_path, stats_column=None, skip=None):
+    """逐块读取列式文件为DataFrame（Parquet按行组，Feather/Arrow按记录批次）
+
+    Args:
+        file_path (str): 列式文件路径
+        stats_column (str): Parquet行组统计信息所用的列
+        skip (callable): skip(min, max) 返回True时跳过该行组而不读取（谓词下推）
+    """
+    require_columnar()
+    if columnar_format(file_path) != "parquet":
+        reader = _open_ipc(file_path)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).to_pandas()
+        return
+
+    parquet_file = pq.ParquetFile(file_path, memory_map=True)
+    index = None
+    if stats_column is not None and stats_column in parquet_file.schema_arrow.names:
+        index = parquet_file.schema_arrow.get_field_index(stats_column)
+
+    for i in range(parquet_file.num_row_groups):
+        if index is not None and skip is not None:
+            stats = parquet_file.metadata.row_group(i).column(index).statistics
+            if stats is not None and stats.has_min_max and skip(stats.min, stats.max):
+                continue
+        yield parquet_file.read_row_group(i).to_pandas()
+
+
+def _typed_timestamps(df):
+    """能完整解析的时间戳列转换为时间类型，读取时无需再次解析"""
+    for column in TIMESTAMP_COLUMNS:
+        if column not in df.columns or df[column].dtype != object:
+            continue
+        parsed, report = parse_column(df[column])
+        if not report["unparseable"]:
+            df = df.assign(**{column: parsed})
+    return df
+
+
+def to_arrow(df, dictionary_columns=DICTIONARY_COLUMNS):
+    """DataFrame转换为pyarrow.Table，对指定的列做字典编码"""
+    require_columnar()
+    table = pa.Table.from_pandas(_typed_timestamps(df), preserve_index=False)
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        if name in dictionary_columns and not pa.types.is_dictionary(column.type):
+            table = table.set_column(i, name, pc.dictionary_encode(column))
+    return table
+
+
+def write_table(df, file_path, dictionary_columns=DICTIONARY_COLUMNS):
+    """按扩展名把DataFrame写为CSV或列式文件（先写临时文件再替换）"""
+    fmt = columnar_format(file_path)
+    tmp_path = f"{file_path}.tmp"
+    if fmt is None:
+        df.to_csv(tmp_path, index=False)
+    else:
+        table = to_arrow(df, dictionary_columns)
+        if fmt == "parquet":
+            pq.write_table(table, tmp_path, compression="zstd")
+        else:
+            # 不压缩，读取时可以直接使用内存映射
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, file_path)
+
+
+class TableWriter:
+    """按块写出DataFrame（CSV或列式格式），先写临时文件，close时再替换目标文件
+
+    列式格式的后续块转换为第一块的schema。Arrow IPC文件格式不允许各块使用不同的字典，
+    因此Feather/Arrow输出不做字典编码。
+    """
+
+    def __init__(self, file_path, columns, dictionary_columns=DICTIONARY_COLUMNS):
+        self.file_path = file_path
+        self.columns = list(columns)
+        self.fmt = columnar_format(file_path)
+        self.tmp_path = f"{file_path}.tmp"
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+        if self.fmt is not None:
+            require_columnar()
+        self.dictionary_columns = dictionary_columns if self.fmt == "parquet" else ()
+
+    def write(self, df):
+        if self.fmt is None:
+            if self._file is None:
+                self._file = open(self.tmp_path, "w", encoding="utf-8", newline="")
+                csv.writer(self._file).writerow(self.columns)
+            df.to_csv(self._file, index=False, header=False)
+        else:
+            table = to_arrow(df, self.dictionary_columns)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.fmt == "parquet":
+                    self._writer = pq.ParquetWriter(
+                        self.tmp_path, self._schema, compression="zstd"
+                    )
+                else:
+                    self._writer = pa.ipc.new_file(self.tmp_path, self._schema)
+            else:
+                table = table.cast(self._schema)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        """写完所有块后替换目标文件；一块都没有写时输出只有列名的空文件"""
+        if self._file is None and self._writer is None:
+            self.write(pd.DataFrame(columns=self.columns))
+        if self._file is not None:
+            self._file.close()
+        if self._writer is not None:
+            self._writer.close()
+        os.replace(self.tmp_path, self.file_path)
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        for handle in (self._file, self._writer):
+            if handle is not None:
+                handle.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def convert(input_file, output_file, columns=None):
+    """CSV与列式格式互相转换，返回写入的行数"""
+    df = read_table(input_file, columns)
+    write_table(df, output_file)
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV与Parquet/Feather/Arrow文件互相转换")
+    parser.add_argument("input_file", help="输入文件路径")
+    parser.add_argument("output_file", help="输出文件路径（按扩展名决定格式）")
+    parser.add_argument("--columns", nargs="+", help="只转换这些列")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"错误: 输入文件不存在: {args.input_file}")
+        sys.exit(1)
+
+    for path in (args.input_file, args.output_file):
+        if not is_table_file(path):
+            print(f"错误: 不支持的文件格式: {path}")
+            sys.exit(1)
+
+    try:
+        rows = convert(args.input_file, args.output_file, args.columns)
+    except Exception as e:
+        print(f"转换失败: {e}")
+        sys.exit(1)
+
+    print(f"已写入 {rows} 行到: {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
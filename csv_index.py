@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+标注CSV的旁路索引
+与CSV放在一起的 <CSV文件名>.idx，记录：
+- 稀疏时间索引：每 SPARSE_INTERVAL 行一项 (此前所有行的最大时间戳, 字节偏移)，
+  查询某时间点之后的行时可直接跳到对应偏移（CSV不是按时间排序时同样正确，只是跳过的行更少）
+- 最新行表：图片路径哈希 -> (时间戳排序键, 最新一行的字节偏移)，按哈希排序，二分查找
+
+CSV只追加写入，索引记录已覆盖的字节数，文件变长后只需读取新增的部分即可跟上；
+文件被重写（开头或已覆盖部分末尾的内容变化、变短）时索引视为失效。
+服务器写会话CSV时维护索引，去重和过滤工具发现可用的索引时自动使用。
+
+命令行用法:
+    python csv_index.py build data/annotations.csv
+    python csv_index.py latest data/annotations.csv /path/to/image.jpg
+    python csv_index.py offset data/annotations.csv "2025-08-18 09:00:00"
+"""
+
+import argparse
+import bisect
+import csv
+import hashlib
+import json
+import os
+import sys
+import zlib
+from array import array
+
+from timestamp_utils import parse_timestamp, timestamp_sort_key
+
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+# 稀疏时间索引的间隔（行）
+SPARSE_INTERVAL = 1024
+# 校验文件开头和已覆盖部分末尾时使用的字节数
+CHECK_BYTES = 4096
+# 建立索引需要的列
+REQUIRED_COLUMNS = ("image_path", "timestamp")
+
+
+def index_path(csv_file):
+    """CSV文件对应的索引文件路径"""
+    return csv_file + INDEX_SUFFIX
+
+
+def path_hash(image_path):
+    """图片路径的64位哈希（跨进程稳定）"""
+    digest = hashlib.blake2b(image_path.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _iter_records(f, offset):
+    """从 offset 开始逐条读取CSV记录，返回 (起始偏移, 原始字节)
+
+    引号内的换行会合并为一条记录；末尾没有换行的不完整记录（可能正在写入）不返回。
+    """
+    f.seek(offset)
+    pending = b""
+    start = offset
+    for line in iter(f.readline, b""):
+        if not pending:
+            start = offset
+        pending += line
+        offset += len(line)
+        if pending.endswith(b"\n") and pending.count(b'"') % 2 == 0:
+            yield start, pending
+            pending = b""
+
+
+def _parse_record(record, width):
+    row = next(csv.reader([record.decode("utf-8")]), [])
+    if len(row) < width:
+        row = row + [""] * (width - len(row))
+    return row
+
+
+def _crc(f, start, end):
+    f.seek(start)
+    return zlib.crc32(f.read(end - start))
+
+
+class CsvIndex:
+    """一个CSV文件的旁路索引
+
+    路径哈希为64位，不同路径哈希冲突的概率可以忽略；latest() 会核对读出的路径。
+    """
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.columns = None
+        self.header_end = 0
+        # 已建立索引的字节数（总在记录边界上）和行数
+        self.covered = 0
+        self.row_count = 0
+        self._max_key = float("-inf")
+        self._head_crc = None
+        # 稀疏时间索引
+        self.sparse_keys = array("d")
+        self.sparse_offsets = array("Q")
+        # 最新行表（按哈希排序），以及上次保存后新增或更新的条目
+        self._hashes = array("Q")
+        self._keys = array("d")
+        self._offsets = array("Q")
+        self._recent = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, csv_file):
+        """读取索引文件，不存在、损坏或与CSV不匹配时返回None（不读取CSV的新增部分）"""
+        try:
+            with open(index_path(csv_file), "rb") as f:
+                meta = json.loads(f.readline())
+                if meta.get("version") != INDEX_VERSION:
+                    return None
+                if any(c not in meta["columns"] for c in REQUIRED_COLUMNS):
+                    return None
+                index = cls(csv_file)
+                index.columns = meta["columns"]
+                index.header_end = meta["header_end"]
+                index.covered = meta["covered"]
+                index.row_count = meta["row_count"]
+                index._max_key = meta["max_key"]
+                index._head_crc = meta["head_crc"]
+                for name, count in (
+                    ("sparse_keys", meta["sparse"]),
+                    ("sparse_offsets", meta["sparse"]),
+                    ("_hashes", meta["latest"]),
+                    ("_keys", meta["latest"]),
+                    ("_offsets", meta["latest"]),
+                ):
+                    values = getattr(index, name)
+                    values.fromfile(f, count)
+            tail_crc = meta["tail_crc"]
+        except (OSError, EOFError, ValueError, KeyError):
+            return None
+
+        try:
+            with open(csv_file, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < index.covered:
+                    return None
+                if _crc(f, 0, min(CHECK_BYTES, index.covered)) != index._head_crc:
+                    return None
+                if _crc(f, max(0, index.covered - CHECK_BYTES), index.covered) != tail_crc:
+                    return None
+        except OSError:
+            return None
+        return index
+
+    @classmethod
+    def open(cls, csv_file):
+        """读取可用的索引并跟上CSV新增的部分；没有可用的索引时返回None"""
+        index = cls.load(csv_file)
+        if index is not None:
+            index.refresh()
+        return index
+
+    @classmethod
+    def build(cls, csv_file):
+        """从头为CSV建立索引"""
+        index = cls(csv_file)
+        index.refresh()
+        return index
+
+    def is_complete(self):
+        """索引是否覆盖了CSV的全部内容"""
+        try:
+            return os.path.getsize(self.csv_file) == self.covered
+        except OSError:
+            return False
+
+    def refresh(self):
+        """读取CSV中尚未建立索引的部分，返回新增的行数"""
+        if not os.path.exists(self.csv_file):
+            return 0
+
+        added = 0
+        with open(self.csv_file, "rb") as f:
+            if self.columns is None:
+                records = _iter_records(f, 0)
+                header = next(records, None)
+                if header is None:
+                    return 0
+                self.columns = _parse_record(header[1], 0)
+                self.header_end = self.covered = len(header[1])
+                self._head_crc = _crc(f, 0, min(CHECK_BYTES, self.covered))
+            if any(c not in self.columns for c in REQUIRED_COLUMNS):
+                return 0
+
+            width = len(self.columns)
+            path_index = self.columns.index("image_path")
+            ts_index = self.columns.index("timestamp")
+            for offset, record in _iter_records(f, self.covered):
+                row = _parse_record(record, width)
+                key = timestamp_sort_key(row[ts_index])
+                if self.row_count % SPARSE_INTERVAL == 0:
+                    self.sparse_keys.append(self._max_key)
+                    self.sparse_offsets.append(offset)
+                self._max_key = max(self._max_key, key)
+
+                h = path_hash(row[path_index])
+                current = self._lookup(h)
+                if current is None or key >= current[0]:
+                    self._recent[h] = (key, offset)
+
+                self.covered = offset + len(record)
+                self.row_count += 1
+                added += 1
+
+            if added:
+                self._head_crc = _crc(f, 0, min(CHECK_BYTES, self.covered))
+                self.dirty = True
+        return added
+
+    def _lookup(self, h):
+        entry = self._recent.get(h)
+        if entry is not None:
+            return entry
+        i = bisect.bisect_left(self._hashes, h)
+        if i < len(self._hashes) and self._hashes[i] == h:
+            return self._keys[i], self._offsets[i]
+        return None
+
+    def _merge_recent(self):
+        """把新增的条目合并到按哈希排序的数组中（线性合并）"""
+        if not self._recent:
+            return
+        hashes, keys, offsets = array("Q"), array("d"), array("Q")
+        i, n = 0, len(self._hashes)
+        for h, (key, offset) in sorted(self._recent.items()):
+            j = bisect.bisect_left(self._hashes, h, i)
+            hashes.extend(self._hashes[i:j])
+            keys.extend(self._keys[i:j])
+            offsets.extend(self._offsets[i:j])
+            hashes.append(h)
+            keys.append(key)
+            offsets.append(offset)
+            i = j + 1 if j < n and self._hashes[j] == h else j
+        hashes.extend(self._hashes[i:])
+        keys.extend(self._keys[i:])
+        offsets.extend(self._offsets[i:])
+        self._hashes, self._keys, self._offsets = hashes, keys, offsets
+        self._recent = {}
+
+    def save(self):
+        """写入索引文件（先写临时文件再替换）"""
+        if self.columns is None:
+            return
+        self._merge_recent()
+        with open(self.csv_file, "rb") as f:
+            tail_crc = _crc(f, max(0, self.covered - CHECK_BYTES), self.covered)
+        meta = {
+            "version": INDEX_VERSION,
+            "columns": self.columns,
+            "header_end": self.header_end,
+            "covered": self.covered,
+            "row_count": self.row_count,
+            "max_key": self._max_key,
+            "head_crc": self._head_crc,
+            "tail_crc": tail_crc,
+            "sparse": len(self.sparse_keys),
+            "latest": len(self._hashes),
+        }
+        tmp_path = f"{index_path(self.csv_file)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            for values in (
+                self.sparse_keys,
+                self.sparse_offsets,
+                self._hashes,
+                self._keys,
+                self._offsets,
+            ):
+                values.tofile(f)
+        os.replace(tmp_path, index_path(self.csv_file))
+        self.dirty = False
+
+    def __len__(self):
+        """索引中的图片数"""
+        self._merge_recent()
+        return len(self._hashes)
+
+    def offset_for_time(self, start):
+        """返回一个字节偏移，该偏移之前的行时间戳都早于 start（datetime或时间戳字符串）"""
+        start_key = timestamp_sort_key(start.isoformat() if hasattr(start, "isoformat") else start)
+        i = bisect.bisect_left(self.sparse_keys, start_key) - 1
+        if i < 0:
+            return self.header_end
+        return self.sparse_offsets[i]
+
+    def latest_offsets(self):
+        """所有图片最新一行的字节偏移（升序）"""
+        self._merge_recent()
+        return sorted(self._offsets)
+
+    def read_rows(self, offsets):
+        """按偏移读取行（偏移应为升序），返回解析后的行列表"""
+        width = len(self.columns)
+        rows = []
+        with open(self.csv_file, "rb") as f:
+            for offset in offsets:
+                records = _iter_records(f, offset)
+                rows.append(_parse_record(next(records)[1], width))
+        return rows
+
+    def latest(self, image_path):
+        """图片最新一行的内容（列名 -> 值），不在索引中时返回None"""
+        entry = self._lookup(path_hash(image_path))
+        if entry is None:
+            return None
+        row = dict(zip(self.columns, self.read_rows([entry[1]])[0]))
+        if row.get("image_path") != image_path:
+            return None
+        return row
+
+    def get_stats(self):
+        self._merge_recent()
+        return {
+            "csv_file": self.csv_file,
+            "rows": self.row_count,
+            "images": len(self._hashes),
+            "covered_bytes": self.covered,
+            "sparse_entries": len(self.sparse_keys),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注CSV的旁路索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="建立或更新索引")
+    build_parser.add_argument("csv_file", help="CSV文件路径")
+    build_parser.add_argument("--rebuild", action="store_true", help="忽略已有的索引，从头建立")
+
+    latest_parser = subparsers.add_parser("latest", help="查询图片的最新标注")
+    latest_parser.add_argument("csv_file", help="CSV文件路径")
+    latest_parser.add_argument("image_path", nargs="+", help="图片路径")
+
+    offset_parser = subparsers.add_parser("offset", help="查询某时间点之后的行的起始偏移")
+    offset_parser.add_argument("csv_file", help="CSV文件路径")
+    offset_parser.add_argument("timestamp", help="时间点")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_file):
+        print(f"错误: 文件不存在: {args.csv_file}")
+        sys.exit(1)
+
+    index = None if getattr(args, "rebuild", False) else CsvIndex.open(args.csv_file)
+    if index is None:
+        print("正在建立索引...")
+        index = CsvIndex.build(args.csv_file)
+    if index.dirty:
+        index.save()
+        print(f"索引已写入: {index_path(args.csv_file)}")
+
+    if args.command == "build":
+        stats = index.get_stats()
+        print(f"行数: {stats['rows']}, 图片数: {stats['images']}, 稀疏索引项: {stats['sparse_entries']}")
+    elif args.command == "latest":
+        for image_path in args.image_path:
+            row = index.latest(image_path)
+            if row is None:
+                print(f"{image_path}: 没有标注")
+            else:
+                print(f"{image_path}: {row.get('quality')} ({row.get('timestamp')})")
+    else:
+        try:
+            start = parse_timestamp(args.timestamp)
+        except ValueError as e:
+            print(f"错误: {e}")
+            sys.exit(1)
+        offset = index.offset_for_time(start)
+        print(f"从字节偏移 {offset} 开始读取 (文件大小 {os.path.getsize(args.csv_file)} 字节)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,479 @@
 """
 CSV文件去重工具
 对图片标注CSV文件进行去重，保留每个图片的最后一次标签
+大于内存的CSV可以使用 --streaming 流式去重（只在内存中保留每张图片的最新一行，必要时分区到磁盘）
+--merge 合并一个目录或通配符匹配的多个会话CSV: python deduplicate_csv.py --merge "data/*.csv" merged.csv
+输入和输出也可以是 Parquet/Feather/Arrow 文件（按扩展名判断，需要安装pyarrow），
+因此也可用于CSV与列式格式之间的转换
 """
 
-import pandas as pd
+import argparse
+import csv
+import glob
+import heapq
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+try:
+    import pandas as pd
+
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+from columnar_io import columnar_format, read_table, write_table
+from csv_index import CsvIndex
+from timestamp_utils import format_report, parse_column, timestamp_sort_key
+
+
+# 流式去重时内存中 image_path -> 最新行 映射的大小上限（按字符串长度估算），超过后按哈希分区到磁盘
+STREAMING_MEMORY_BUDGET = 512 * 1024 * 1024
+# 每条映射的额外内存开销估算（字典项、元组、字符串对象头）
+ENTRY_OVERHEAD = 200
+# 分区数量，以及过大的分区最多再分区的层数
+PARTITION_COUNT = 64
+MAX_SPILL_DEPTH = 4
+# 输入CSV超过该大小时自动使用流式去重
+STREAMING_THRESHOLD_BYTES = 1024 * 1024 * 1024
+# 合并多个会话文件时标记每行来源的列
+SOURCE_COLUMN = "source_file"
+# 按目录合并时跳过的去重/合并结果文件（文件名中包含这些片段）
+DERIVED_FILE_MARKERS = ("_deduplicated_", "_merged_")
+# 合并时工作进程的启动方式：服务器在请求线程中调用合并，fork 会复制持有中的锁和已打开的WAL。
+# spawn 的子进程会把父进程的主模块（如 server.py）作为 __mp_main__ 重新执行一遍，
+# 因此 server.py 在导入时不读写任何服务器状态（见 server.LazySingleton，test_merge_worker.py 检查这一点）
+MERGE_START_METHOD = "spawn"
+
+
+def default_output_file(input_file):
+    base_name, ext = os.path.splitext(input_file)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{base_name}_deduplicated_{timestamp}{ext}"
+
+
+class LatestRows:
+    """image_path -> (时间戳排序键, 行号, 行) 的最新行映射
+
+    保留时间戳最新的一行；时间戳相同时保留后出现的行（行号更大），与服务器预写日志
+    “后写入的为准”一致。这是对原有行为的修改：原来的标准库实现用严格的 > 比较，
+    时间戳相同时保留先出现的行，pandas实现用不稳定排序，保留哪一行不确定。
+    test_deduplicate_csv.py 固定了这条规则。
+    """
+
+    def __init__(self, path_index, ts_index):
+        self.path_index = path_index
+        self.ts_index = ts_index
+        self.rows = {}
+        self.nbytes = 0
+
+    def add(self, key, row_no, row):
+        image_path = row[self.path_index]
+        previous = self.rows.get(image_path)
+        if previous is not None and (key, row_no) < (previous[0], previous[1]):
+            return
+        if previous is None:
+            self.nbytes += ENTRY_OVERHEAD + len(image_path)
+        else:
+            self.nbytes -= sum(len(v) for v in previous[2])
+        self.rows[image_path] = (key, row_no, row)
+        self.nbytes += sum(len(v) for v in row)
+
+    def sorted_rows(self):
+        """按image_path排序的 (image_path, 行) 序列"""
+        for image_path in sorted(self.rows):
+            yield image_path, self.rows[image_path][2]
+
+
+def _partition_of(image_path, depth):
+    # 每一层的哈希不同，过大的分区再次分区时会被打散（同一进程内哈希值稳定）
+    return hash((depth, image_path)) % PARTITION_COUNT
+
+
+def _iter_rows(reader, width, ts_index, row_no):
+    """把CSV行转换为 (时间戳排序键, 行号, 行)，行号从 row_no 开始"""
+    for row in reader:
+        if len(row) < width:
+            row = row + [""] * (width - len(row))
+        yield timestamp_sort_key(row[ts_index]), row_no, row
+        row_no += 1
+
+
+def _iter_partition(part_path):
+    with open(part_path, "r", newline="", encoding="utf-8") as f:
+        for record in csv.reader(f):
+            yield float(record[0]), int(record[1]), record[2:]
+
+
+def _spill(latest, records, work_dir, budget, depth=0):
+    """内存映射超过上限：把已有映射和剩余记录按image_path哈希写入分区文件，
+    逐个分区去重后写成按路径排序的有序段；仍然超过上限的分区递归再分区
+
+    Returns:
+        list: 有序段文件路径
+    """
+    spill_dir = tempfile.mkdtemp(prefix=f"spill{depth}_", dir=work_dir)
+    paths = [os.path.join(spill_dir, f"part_{i}.csv") for i in range(PARTITION_COUNT)]
+    handles = [open(p, "w", newline="", encoding="utf-8") for p in paths]
+    writers = [csv.writer(h) for h in handles]
+    try:
+        # 分区行格式：时间戳排序键, 全局行号, 原始各列
+        for image_path, (key, no, row) in latest.rows.items():
+            writers[_partition_of(image_path, depth)].writerow([repr(key), no, *row])
+        latest.rows.clear()
+        for key, no, row in records:
+            writers[_partition_of(row[latest.path_index], depth)].writerow(
+                [repr(key), no, *row]
+            )
+    finally:
+        for h in handles:
+            h.close()
+
+    runs = []
+    for part_path in paths:
+        part = LatestRows(latest.path_index, latest.ts_index)
+        part_records = _iter_partition(part_path)
+        for key, no, row in part_records:
+            part.add(key, no, row)
+            if part.nbytes > budget and depth < MAX_SPILL_DEPTH:
+                runs.extend(_spill(part, part_records, work_dir, budget, depth + 1))
+                break
+        else:
+            if part.rows:
+                run_path = f"{part_path}.run"
+                with open(run_path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    for _, row in part.sorted_rows():
+                        writer.writerow(row)
+                runs.append(run_path)
+        part_records.close()
+        os.remove(part_path)
+    return runs
+
+
+def _read_run(run_path):
+    with open(run_path, "r", newline="", encoding="utf-8") as f:
+        yield from csv.reader(f)
+
+
+def _write_deduplicated(header, rows, output_file):
+    """逐行写出去重结果（先写临时文件再替换），返回 (写出的行数, 质量分布)"""
+    quality_index = header.index("quality") if "quality" in header else None
+    quality_counts = {}
+    deduplicated_count = 0
+    tmp_path = f"{output_file}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            deduplicated_count += 1
+            if quality_index is not None:
+                quality = row[quality_index]
+                quality_counts[quality] = quality_counts.get(quality, 0) + 1
+    os.replace(tmp_path, output_file)
+    return deduplicated_count, quality_counts
+
+
+def _deduplicate_from_index(index, output_file):
+    """用旁路索引去重：只读取每张图片最新一行所在的位置，不扫描整个文件"""
+    rows = index.read_rows(index.latest_offsets())
+    path_index = index.columns.index("image_path")
+    rows.sort(key=lambda row: row[path_index])
+    deduplicated_count, quality_counts = _write_deduplicated(index.columns, rows, output_file)
+    return {
+        "original_count": index.row_count,
+        "deduplicated_count": deduplicated_count,
+        "removed_count": index.row_count - deduplicated_count,
+        "quality_counts": quality_counts,
+        "spilled": False,
+    }
+
+
+def stream_deduplicate(input_file, output_file, memory_budget=STREAMING_MEMORY_BUDGET):
+    """流式去重：逐行读取CSV，内存中只保留每张图片的最新一行
+
+    映射超过 memory_budget 时按image_path哈希分区到临时目录，分区去重后得到多个按路径排序的
+    有序段，再用 heapq.merge 归并写出。输出按image_path排序，逐行写入，时间戳保持原文。
+    CSV有覆盖全部内容的旁路索引（csv_index.py）且结果放得进内存时，直接按索引读取最新行。
+
+    Returns:
+        dict: original_count、deduplicated_count、removed_count、quality_counts、spilled
+    """
+    index = CsvIndex.open(input_file)
+    if (
+        index is not None
+        and index.is_complete()
+        and len(index) * ENTRY_OVERHEAD <= memory_budget
+    ):
+        return _deduplicate_from_index(index, output_file)
+
+    with open(input_file, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("CSV文件为空")
+        missing_columns = [c for c in ("image_path", "timestamp") if c not in header]
+        if missing_columns:
+            raise ValueError(f"CSV文件缺少必要的列: {missing_columns}")
+
+        latest = LatestRows(header.index("image_path"), header.index("timestamp"))
+        counter = {"rows": 0}
+
+        def counted(records):
+            for record in records:
+                counter["rows"] += 1
+                yield record
+
+        records = counted(_iter_rows(reader, len(header), latest.ts_index, 0))
+        runs = None
+        work_dir = None
+        for key, no, row in records:
+            latest.add(key, no, row)
+            if latest.nbytes > memory_budget:
+                work_dir = tempfile.mkdtemp(
+                    prefix="dedup_", dir=os.path.dirname(os.path.abspath(output_file))
+                )
+                runs = _spill(latest, records, work_dir, memory_budget)
+                break
+        row_no = counter["rows"]
+
+    try:
+        if runs is None:
+            rows = (row for _, row in latest.sorted_rows())
+        else:
+            path_index = latest.path_index
+            rows = heapq.merge(
+                *(_read_run(p) for p in runs), key=lambda row: row[path_index]
+            )
+        deduplicated_count, quality_counts = _write_deduplicated(header, rows, output_file)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "original_count": row_no,
+        "deduplicated_count": deduplicated_count,
+        "removed_count": row_no - deduplicated_count,
+        "quality_counts": quality_counts,
+        "spilled": runs is not None,
+    }
+
+
+def deduplicate_streaming(input_file, output_file=None, memory_budget=STREAMING_MEMORY_BUDGET):
+    """流式去重CSV文件并打印统计信息，参数同 deduplicate_annotations"""
+    if not os.path.exists(input_file):
+        print(f"错误: 输入文件不存在: {input_file}")
+        return False
+
+    try:
+        if output_file is None:
+            output_file = default_output_file(input_file)
+        print(f"正在流式去重: {input_file}")
+        result = stream_deduplicate(input_file, output_file, memory_budget)
+        if result["spilled"]:
+            print("去重映射超过内存上限，已按哈希分区到磁盘处理")
+        print(f"去重后的数据已保存到: {output_file}")
+
+        print("\n去重统计:")
+        print(f"  原始记录数: {result['original_count']}")
+        print(f"  去重后记录数: {result['deduplicated_count']}")
+        print(f"  删除的重复记录数: {result['removed_count']}")
+
+        print("\n质量分布:")
+        for quality, count in sorted(
+            result["quality_counts"].items(), key=lambda item: -item[1]
+        ):
+            print(f"  {quality}: {count}")
+        return True
+
+    except Exception as e:
+        print(f"处理过程中出现错误: {e}")
+        return False
+
+
+def expand_inputs(source):
+    """把目录或通配符展开为按文件名排序的CSV列表
+
+    目录会展开为其中的所有 .csv 文件，并跳过之前生成的去重/合并结果和空文件。
+    """
+    if os.path.isdir(source):
+        files = [
+            p
+            for p in glob.glob(os.path.join(source, "*.csv"))
+            if not any(marker in os.path.basename(p) for marker in DERIVED_FILE_MARKERS)
+        ]
+    else:
+        files = [p for p in glob.glob(source) if os.path.isfile(p)]
+    # 空文件（如尚未写入的会话CSV）没有表头，直接跳过
+    return sorted(p for p in files if os.path.getsize(p) > 0)
+
+
+def _deduplicate_to_run(input_file, run_file, memory_budget):
+    """在子进程中对单个文件去重，写成按image_path排序的有序段"""
+    return stream_deduplicate(input_file, run_file, memory_budget)
+
+
+def _read_run_with_header(run_path, file_index):
+    """逐行读取有序段，产出 (image_path, 时间戳排序键, 文件序号, 行字典)"""
+    with open(run_path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield row["image_path"], timestamp_sort_key(row["timestamp"]), file_index, row
+
+
+def merge_deduplicate(
+    input_files,
+    output_file,
+    max_workers=None,
+    memory_budget=STREAMING_MEMORY_BUDGET,
+):
+    """合并多个标注CSV并去重
+
+    每个文件先在独立进程中流式去重为按image_path排序的有序段，再对所有有序段做k路归并：
+    同一路径保留时间戳最新的一行，时间戳相同时保留文件列表中靠后的文件（会话文件名按时间排序）。
+    输出增加 source_file 列记录每行来自哪个文件，整个过程不会把所有文件同时读入内存。
+
+    Returns:
+        dict: files、original_count、deduplicated_count、removed_count、quality_counts、
+        source_counts（每个文件贡献的行数）
+    """
+    if not input_files:
+        raise ValueError("没有找到要合并的CSV文件")
+
+    max_workers = max_workers or min(len(input_files), os.cpu_count() or 1)
+    work_dir = tempfile.mkdtemp(
+        prefix="merge_", dir=os.path.dirname(os.path.abspath(output_file))
+    )
+    try:
+        run_files = [
+            os.path.join(work_dir, f"run_{i}.csv") for i in range(len(input_files))
+        ]
+        # 每个进程只分到一部分内存预算
+        budget = max(1, memory_budget // max_workers)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context(MERGE_START_METHOD),
+        ) as pool:
+            results = list(
+                pool.map(
+                    _deduplicate_to_run,
+                    input_files,
+                    run_files,
+                    [budget] * len(input_files),
+                )
+            )
+
+        # 输出列：各文件列的并集（保持首次出现的顺序）再加来源列
+        header = []
+        for run_file in run_files:
+            with open(run_file, "r", newline="", encoding="utf-8") as f:
+                for column in next(csv.reader(f), []):
+                    if column not in header and column != SOURCE_COLUMN:
+                        header.append(column)
+        header.append(SOURCE_COLUMN)
+
+        streams = [
+            _read_run_with_header(run_file, i) for i, run_file in enumerate(run_files)
+        ]
+        merged = heapq.merge(*streams, key=lambda item: item[0])
+
+        quality_counts = {}
+        source_counts = {p: 0 for p in input_files}
+        deduplicated_count = 0
+        tmp_path = f"{output_file}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as out:
+            writer = csv.DictWriter(out, fieldnames=header, restval="")
+            writer.writeheader()
+
+            best = None
+            for item in merged:
+                if best is not None and item[0] != best[0]:
+                    deduplicated_count += _write_merged(
+                        writer, best, input_files, quality_counts, source_counts
+                    )
+                    best = None
+                if best is None or (item[1], item[2]) >= (best[1], best[2]):
+                    best = item
+            if best is not None:
+                deduplicated_count += _write_merged(
+                    writer, best, input_files, quality_counts, source_counts
+                )
+        os.replace(tmp_path, output_file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    original_count = sum(r["original_count"] for r in results)
+    return {
+        "files": len(input_files),
+        "original_count": original_count,
+        "deduplicated_count": deduplicated_count,
+        "removed_count": original_count - deduplicated_count,
+        "quality_counts": quality_counts,
+        "source_counts": source_counts,
+    }
+
+
+def _write_merged(writer, item, input_files, quality_counts, source_counts):
+    _, _, file_index, row = item
+    source = input_files[file_index]
+    row[SOURCE_COLUMN] = source
+    writer.writerow(row)
+    quality = row.get("quality")
+    if quality is not None:
+        quality_counts[quality] = quality_counts.get(quality, 0) + 1
+    source_counts[source] += 1
+    return 1
+
+
+def merge_annotations(source, output_file=None, memory_budget=STREAMING_MEMORY_BUDGET):
+    """合并目录或通配符匹配的多个CSV并去重，打印统计信息"""
+    input_files = expand_inputs(source)
+    if not input_files:
+        print(f"错误: 没有找到要合并的CSV文件: {source}")
+        return False
+
+    try:
+        if output_file is None:
+            directory = source if os.path.isdir(source) else os.path.dirname(input_files[0])
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_file = os.path.join(directory, f"annotations_merged_{timestamp}.csv")
+
+        print(f"正在合并 {len(input_files)} 个文件...")
+        result = merge_deduplicate(input_files, output_file, memory_budget=memory_budget)
+        print(f"合并后的数据已保存到: {output_file}")
+
+        print("\n合并统计:")
+        print(f"  原始记录数: {result['original_count']}")
+        print(f"  去重后记录数: {result['deduplicated_count']}")
+        print(f"  删除的重复记录数: {result['removed_count']}")
+
+        print("\n各文件保留的记录数:")
+        for source_file, count in result["source_counts"].items():
+            print(f"  {source_file}: {count}")
+
+        print("\n质量分布:")
+        for quality, count in sorted(
+            result["quality_counts"].items(), key=lambda item: -item[1]
+        ):
+            print(f"  {quality}: {count}")
+        return True
+
+    except Exception as e:
+        print(f"处理过程中出现错误: {e}")
+        return False
+
 
 def deduplicate_annotations(input_file, output_file=None):
     """
     对CSV文件进行去重处理
 
     Args:
-        input_file (str): 输入的CSV文件路径
-        output_file (str): 输出的CSV文件路径，如果为None则自动生成
+        input_file (str): 输入的CSV（或Parquet/Feather/Arrow）文件路径
+        output_file (str): 输出文件路径，按扩展名决定格式；如果为None则自动生成，格式与输入相同
     """
 
     # 检查输入文件是否存在
@@ -27,7 +485,7 @@ def deduplicate_annotations(input_file, output_file=None):
     try:
         # 读取CSV文件
         print(f"正在读取文件: {input_file}")
-        df = pd.read_csv(input_file)
+        df = read_table(input_file)
 
         # 检查必要的列是否存在
         required_columns = ["image_path", "image_name", "quality", "timestamp"]
@@ -42,12 +500,15 @@ def deduplicate_annotations(input_file, output_file=None):
         # 按图片路径分组，保留最后一次标注（最新的timestamp）
         print("正在进行去重处理...")
 
-        # 将timestamp转换为datetime以便排序
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        # 将timestamp转换为datetime以便排序（无法解析的为NaT）
+        df["timestamp"], report = parse_column(df["timestamp"])
+        if report["unparseable"]:
+            print(format_report(report))
 
-        # 按image_path分组，保留最新的记录
+        # 按image_path分组，保留最新的记录；与流式去重规则相同：
+        # 稳定排序使时间戳相同时保留后出现的行，NaT排在最前因而不会覆盖可解析的时间戳
         df_deduplicated = (
-            df.sort_values("timestamp")
+            df.sort_values("timestamp", kind="stable", na_position="first")
             .groupby("image_path")
             .tail(1)
             .reset_index(drop=True)
@@ -63,12 +524,10 @@ def deduplicate_annotations(input_file, output_file=None):
 
         # 生成输出文件名
         if output_file is None:
-            base_name = os.path.splitext(input_file)[0]
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"{base_name}_deduplicated_{timestamp}.csv"
+            output_file = default_output_file(input_file)
 
         # 保存去重后的数据
-        df_deduplicated.to_csv(output_file, index=False)
+        write_table(df_deduplicated, output_file)
         print(f"去重后的数据已保存到: {output_file}")
 
         # 显示去重统计信息
@@ -96,10 +555,32 @@ def main():
     print("CSV文件去重工具")
     print("=" * 50)
 
-    # 检查命令行参数
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
-        output_file = sys.argv[2] if len(sys.argv) > 2 else None
+    parser = argparse.ArgumentParser(description="CSV文件去重工具")
+    parser.add_argument(
+        "input_file", nargs="?", help="输入文件路径（--merge 时为目录或通配符）"
+    )
+    parser.add_argument("output_file", nargs="?", help="输出文件路径（留空自动生成）")
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="流式去重，适用于大于内存的CSV（输入超过1GB时自动启用）",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="合并目录或通配符匹配的多个会话CSV，输出增加 source_file 列",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=STREAMING_MEMORY_BUDGET // (1024 * 1024),
+        help="流式去重的内存上限 (MB)，超过后分区到磁盘",
+    )
+    args = parser.parse_args()
+
+    if args.input_file:
+        input_file = args.input_file
+        output_file = args.output_file
     else:
         # 交互式输入
         input_file = input("请输入CSV文件路径 (默认: annotations.csv): ").strip()
@@ -110,8 +591,29 @@ def main():
         if not output_file:
             output_file = None
 
-    # 执行去重
-    success = deduplicate_annotations(input_file, output_file)
+    if args.merge:
+        success = merge_annotations(
+            input_file, output_file, args.memory_budget * 1024 * 1024
+        )
+        print("\n合并处理完成！" if success else "\n合并处理失败！")
+        if not success:
+            sys.exit(1)
+        return
+
+    # 流式去重只处理CSV到CSV；其余情况（列式格式）整表读入内存
+    streaming = args.streaming or (
+        os.path.exists(input_file)
+        and os.path.getsize(input_file) > STREAMING_THRESHOLD_BYTES
+    )
+    csv_only = columnar_format(input_file) is None and (
+        output_file is None or columnar_format(output_file) is None
+    )
+    if (streaming and csv_only) or not PANDAS_AVAILABLE:
+        success = deduplicate_streaming(
+            input_file, output_file, args.memory_budget * 1024 * 1024
+        )
+    else:
+        success = deduplicate_annotations(input_file, output_file)
 
     if success:
         print("\n去重处理完成！")
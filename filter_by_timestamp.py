@@ -2,36 +2,45 @@
 """
 CSV时间戳过滤程序
 根据指定的时间点过滤CSV文件中的行，将时间戳在该时间点之后的行保存到新文件
+输入和输出也可以是 Parquet/Feather/Arrow 文件（按扩展名判断，需要安装pyarrow）
+
+--streaming 按块读取并按时间窗口 [start, end) 过滤，内存占用与文件大小无关；
+--sorted 表示输入按时间戳升序追加（如服务器写出的标注CSV），此时先二分查找起始位置，
+读到超过 end 的行即停止，查询大文件的最近一段时间只需读取文件末尾；
+CSV有旁路索引（csv_index.py）时直接从索引中查找起始位置
 """
 
 import pandas as pd
 import argparse
+import csv
 from datetime import datetime
 import os
 import sys
 
+from columnar_io import (
+    TableWriter,
+    columnar_format,
+    iter_chunks,
+    read_columns,
+    read_table,
+    write_table,
+)
+from csv_index import CsvIndex
+from timestamp_utils import (
+    comparable,
+    format_report,
+    parse_column,
+    parse_timestamp,
+    timestamp_sort_key,
+)
 
-def parse_timestamp(timestamp_str):
-    """
-    解析时间戳字符串，支持多种格式
-    """
-    # 尝试多种时间格式
-    formats = [
-        "%Y-%m-%d %H:%M:%S.%f%z",  # 2025-08-18 02:03:32.457000+00:00
-        "%Y-%m-%d %H:%M:%S%z",  # 2025-08-18 02:03:32+00:00
-        "%Y-%m-%d %H:%M:%S",  # 2025-08-18 02:03:32
-        "%Y-%m-%d",  # 2025-08-18
-        "%Y/%m/%d %H:%M:%S",  # 2025/08/18 02:03:32
-        "%Y/%m/%d",  # 2025/08/18
-    ]
-
-    for fmt in formats:
-        try:
-            return datetime.strptime(timestamp_str, fmt)
-        except ValueError:
-            continue
 
-    raise ValueError(f"无法解析时间戳格式: {timestamp_str}")
+# 流式过滤时每块读取的行数
+CHUNK_ROWS = 200_000
+# 二分查找缩小到该范围（字节）后改为顺序读取
+SEEK_BLOCK_BYTES = 64 * 1024
+# 二分查找时每个探测点最多向后查看的行数（跳过空行和无法解析的行）
+MAX_PROBE_LINES = 100
 
 
 def filter_csv_by_timestamp(
@@ -41,15 +50,15 @@ def filter_csv_by_timestamp(
     根据时间戳过滤CSV文件
 
     Args:
-        input_file (str): 输入CSV文件路径
-        output_file (str): 输出CSV文件路径
+        input_file (str): 输入CSV（或Parquet/Feather/Arrow）文件路径
+        output_file (str): 输出文件路径，按扩展名决定格式
         cutoff_timestamp (str): 截止时间点（字符串格式）
         timestamp_column (str): 时间戳列名，默认为'timestamp'
     """
     try:
         # 读取CSV文件
         print(f"正在读取文件: {input_file}")
-        df = pd.read_csv(input_file)
+        df = read_table(input_file)
 
         # 检查时间戳列是否存在
         if timestamp_column not in df.columns:
@@ -62,17 +71,21 @@ def filter_csv_by_timestamp(
         cutoff_dt = parse_timestamp(cutoff_timestamp)
         print(f"截止时间点: {cutoff_dt}")
 
-        # 将时间戳列转换为datetime类型
+        # 将时间戳列转换为datetime类型（先从样本识别格式，再按固定格式整列解析）
         print("正在转换时间戳列...")
-        df[timestamp_column] = pd.to_datetime(df[timestamp_column])
+        df[timestamp_column], report = parse_column(df[timestamp_column])
+        if report["format"]:
+            print(f"时间戳格式: {report['format']}")
+        if report["unparseable"]:
+            print(format_report(report, timestamp_column))
 
-        # 过滤数据
+        # 过滤数据（无法解析的行为NaT，不会被保留）
         print("正在过滤数据...")
-        filtered_df = df[df[timestamp_column] > cutoff_dt]
+        filtered_df = df[df[timestamp_column] > comparable(cutoff_dt, df[timestamp_column])]
 
         # 保存结果
         print(f"正在保存结果到: {output_file}")
-        filtered_df.to_csv(output_file, index=False)
+        write_table(filtered_df, output_file)
 
         print(f"过滤完成!")
         print(f"原始数据行数: {len(df)}")
@@ -86,28 +99,245 @@ def filter_csv_by_timestamp(
         return False
 
 
+def _utc_key(dt):
+    """时间点的排序键，与 timestamp_sort_key 一致（不带时区的按UTC处理）"""
+    return timestamp_sort_key(dt.isoformat())
+
+
+def _probe_key(f, offset, header_end, column_index):
+    """offset之后第一个完整行的时间戳排序键，到文件末尾或一直无法解析时返回None"""
+    f.seek(offset)
+    if offset > header_end:
+        f.readline()  # 跳过不完整的行
+    for _ in range(MAX_PROBE_LINES):
+        line = f.readline()
+        if not line:
+            return None
+        row = next(csv.reader([line.decode("utf-8", errors="replace")]), [])
+        if len(row) > column_index:
+            key = timestamp_sort_key(row[column_index])
+            if key != float("-inf"):
+                return key
+    return None
+
+
+def find_start_offset(input_file, start, timestamp_column="timestamp"):
+    """
+    在按时间戳升序追加的CSV中二分查找字节偏移，从该偏移开始读取不会遗漏时间戳不早于start的行
+
+    假设字段中没有换行符（服务器写出的CSV满足这一点）
+
+    Returns:
+        (offset, columns): 起始行的字节偏移，以及表头中的列名
+    """
+    with open(input_file, "rb") as f:
+        header = f.readline()
+        header_end = f.tell()
+        columns = next(csv.reader([header.decode("utf-8-sig")]), [])
+        if timestamp_column not in columns:
+            return header_end, columns
+        column_index = columns.index(timestamp_column)
+
+        # 不变式：lo之后第一个完整行早于start（或lo为表头末尾），hi之后的行都不早于start
+        start_key = _utc_key(start)
+        lo, hi = header_end, os.fstat(f.fileno()).st_size
+        while hi - lo > SEEK_BLOCK_BYTES:
+            mid = (lo + hi) // 2
+            key = _probe_key(f, mid, header_end, column_index)
+            if key is None or key >= start_key:
+                hi = mid
+            else:
+                lo = mid
+
+        f.seek(lo)
+        if lo > header_end:
+            f.readline()
+        return f.tell(), columns
+
+
+def _iter_csv_chunks(input_file, chunk_rows, offset=None, columns=None):
+    """按块读取CSV，所有列按原样读为字符串，写出时不改变内容"""
+    options = {"chunksize": chunk_rows, "dtype": str, "keep_default_na": False}
+    if offset is None:
+        yield from pd.read_csv(input_file, **options)
+        return
+
+    with open(input_file, "rb") as f:
+        f.seek(offset)
+        if f.read(1) == b"":
+            return
+        f.seek(offset)
+        yield from pd.read_csv(f, header=None, names=columns, encoding="utf-8", **options)
+
+
+def filter_by_window(
+    input_file,
+    output_file,
+    start=None,
+    end=None,
+    timestamp_column="timestamp",
+    sorted_input=False,
+    start_inclusive=True,
+    chunk_rows=CHUNK_ROWS,
+):
+    """
+    流式按时间窗口过滤，内存中只保留一个数据块
+
+    Args:
+        input_file (str): 输入CSV（或Parquet/Feather/Arrow）文件路径
+        output_file (str): 输出文件路径，按扩展名决定格式
+        start (str): 起始时间点（包含），None表示不限
+        end (str): 结束时间点（不包含），None表示不限
+        timestamp_column (str): 时间戳列名
+        sorted_input (bool): 输入是否按时间戳升序，是则二分查找起始位置并在超过end后停止读取
+        start_inclusive (bool): 为False时只保留晚于start的行（与单个截止时间点的语义一致）
+        chunk_rows (int): CSV每块读取的行数
+    """
+    try:
+        start_dt = parse_timestamp(start) if start else None
+        end_dt = parse_timestamp(end) if end else None
+        print(f"时间窗口: [{start_dt or '-∞'}, {end_dt or '+∞'})")
+
+        is_csv = columnar_format(input_file) is None
+        columns = None
+        if is_csv:
+            offset = None
+            index = CsvIndex.open(input_file) if start_dt is not None else None
+            if index is not None and timestamp_column == "timestamp":
+                # 旁路索引的稀疏时间索引，输入不按时间排序时同样可用
+                offset, columns = index.offset_for_time(start_dt), index.columns
+                print("使用旁路索引定位起始位置")
+            elif sorted_input and start_dt is not None:
+                offset, columns = find_start_offset(input_file, start_dt, timestamp_column)
+            if offset is not None:
+                size = os.path.getsize(input_file)
+                print(f"从字节偏移 {offset} 开始读取 (文件大小 {size} 字节)")
+            chunks = _iter_csv_chunks(input_file, chunk_rows, offset, columns)
+        else:
+            start_key = _utc_key(start_dt) if start_dt else None
+            end_key = _utc_key(end_dt) if end_dt else None
+
+            def skip_row_group(low, high):
+                """行组的时间范围与窗口不相交时跳过"""
+                if not isinstance(low, datetime):
+                    return False
+                low, high = _utc_key(low), _utc_key(high)
+                return (start_key is not None and high < start_key) or (
+                    end_key is not None and low >= end_key
+                )
+
+            chunks = iter_chunks(input_file, timestamp_column, skip_row_group)
+
+        writer = None
+        total_rows = 0
+        unparseable = 0
+        try:
+            for chunk in chunks:
+                if timestamp_column not in chunk.columns:
+                    print(f"错误: 列 '{timestamp_column}' 不存在于CSV文件中")
+                    print(f"可用的列: {list(chunk.columns)}")
+                    if writer is not None:
+                        writer.abort()
+                    return False
+                if writer is None:
+                    writer = TableWriter(output_file, chunk.columns)
+
+                parsed, report = parse_column(chunk[timestamp_column])
+                unparseable += report["unparseable"]
+                if report["unparseable"]:
+                    print(format_report(report, timestamp_column))
+
+                mask = parsed.notna()
+                if start_dt is not None:
+                    lower = comparable(start_dt, parsed)
+                    mask &= parsed >= lower if start_inclusive else parsed > lower
+                past_end = False
+                if end_dt is not None:
+                    upper = parsed < comparable(end_dt, parsed)
+                    past_end = sorted_input and not upper[parsed.notna()].all()
+                    mask &= upper
+
+                total_rows += len(chunk)
+                if mask.any():
+                    writer.write(chunk[mask.to_numpy()])
+                if past_end:
+                    print("已读到结束时间点之后的行，停止读取")
+                    break
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+
+        if writer is None:
+            # 输入为空（或按偏移读取时已没有数据行），输出只有列名
+            writer = TableWriter(output_file, columns or read_columns(input_file))
+        kept = writer.rows
+        writer.close()
+
+        print(f"过滤完成!")
+        print(f"读取的行数: {total_rows}")
+        if unparseable:
+            print(f"无法解析时间戳的行数: {unparseable}")
+        print(f"保留的行数: {kept}")
+        return True
+
+    except Exception as e:
+        print(f"处理过程中出现错误: {str(e)}")
+        return False
+
+
 def main():
     parser = argparse.ArgumentParser(description="根据时间戳过滤CSV文件")
-    parser.add_argument("input_file", help="输入CSV文件路径")
-    parser.add_argument("output_file", help="输出CSV文件路径")
+    parser.add_argument("input_file", help="输入CSV/Parquet/Feather文件路径")
+    parser.add_argument("output_file", help="输出文件路径（按扩展名决定格式）")
     parser.add_argument(
-        "cutoff_timestamp", help="截止时间点 (格式: YYYY-MM-DD HH:MM:SS 或 YYYY-MM-DD)"
+        "cutoff_timestamp",
+        nargs="?",
+        help="截止时间点，保留晚于该时间点的行 (格式: YYYY-MM-DD HH:MM:SS 或 YYYY-MM-DD)",
     )
     parser.add_argument(
         "--timestamp-column", default="timestamp", help="时间戳列名 (默认: timestamp)"
     )
+    parser.add_argument("--start", help="时间窗口起点（包含），隐含 --streaming")
+    parser.add_argument("--end", help="时间窗口终点（不包含），隐含 --streaming")
+    parser.add_argument("--streaming", action="store_true", help="按块流式过滤，内存占用固定")
+    parser.add_argument(
+        "--sorted",
+        action="store_true",
+        help="输入按时间戳升序追加：二分查找起始位置，超过 --end 后停止读取（隐含 --streaming）",
+    )
+    parser.add_argument(
+        "--chunk-rows", type=int, default=CHUNK_ROWS, help=f"每块读取的行数 (默认: {CHUNK_ROWS})"
+    )
 
     args = parser.parse_args()
 
+    if args.cutoff_timestamp and args.start:
+        parser.error("截止时间点与 --start 不能同时使用")
+    if not (args.cutoff_timestamp or args.start or args.end):
+        parser.error("需要截止时间点，或 --start/--end 中的至少一个")
+
     # 检查输入文件是否存在
     if not os.path.exists(args.input_file):
         print(f"错误: 输入文件不存在: {args.input_file}")
         sys.exit(1)
 
     # 执行过滤
-    success = filter_csv_by_timestamp(
-        args.input_file, args.output_file, args.cutoff_timestamp, args.timestamp_column
-    )
+    if args.streaming or args.sorted or args.start or args.end:
+        success = filter_by_window(
+            args.input_file,
+            args.output_file,
+            start=args.start or args.cutoff_timestamp,
+            end=args.end,
+            timestamp_column=args.timestamp_column,
+            sorted_input=args.sorted,
+            start_inclusive=args.cutoff_timestamp is None,
+            chunk_rows=args.chunk_rows,
+        )
+    else:
+        success = filter_csv_by_timestamp(
+            args.input_file, args.output_file, args.cutoff_timestamp, args.timestamp_column
+        )
 
     if success:
         print("程序执行成功!")
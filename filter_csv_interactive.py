@@ -5,32 +5,10 @@
 """
 
 import pandas as pd
-from datetime import datetime
 import os
 import sys
 
-
-def parse_timestamp(timestamp_str):
-    """
-    解析时间戳字符串，支持多种格式
-    """
-    # 尝试多种时间格式
-    formats = [
-        "%Y-%m-%d %H:%M:%S.%f%z",  # 2025-08-18 02:03:32.457000+00:00
-        "%Y-%m-%d %H:%M:%S%z",  # 2025-08-18 02:03:32+00:00
-        "%Y-%m-%d %H:%M:%S",  # 2025-08-18 02:03:32
-        "%Y-%m-%d",  # 2025-08-18
-        "%Y/%m/%d %H:%M:%S",  # 2025/08/18 02:03:32
-        "%Y/%m/%d",  # 2025/08/18
-    ]
-
-    for fmt in formats:
-        try:
-            return datetime.strptime(timestamp_str, fmt)
-        except ValueError:
-            continue
-
-    raise ValueError(f"无法解析时间戳格式: {timestamp_str}")
+from timestamp_utils import comparable, format_report, parse_column, parse_timestamp
 
 
 def filter_csv_by_timestamp(
@@ -61,13 +39,17 @@ def filter_csv_by_timestamp(
         cutoff_dt = parse_timestamp(cutoff_timestamp)
         print(f"截止时间点: {cutoff_dt}")
 
-        # 将时间戳列转换为datetime类型
+        # 将时间戳列转换为datetime类型（先从样本识别格式，再按固定格式整列解析）
         print("正在转换时间戳列...")
-        df[timestamp_column] = pd.to_datetime(df[timestamp_column])
+        df[timestamp_column], report = parse_column(df[timestamp_column])
+        if report["format"]:
+            print(f"时间戳格式: {report['format']}")
+        if report["unparseable"]:
+            print(format_report(report, timestamp_column))
 
-        # 过滤数据
+        # 过滤数据（无法解析的行为NaT，不会被保留）
         print("正在过滤数据...")
-        filtered_df = df[df[timestamp_column] > cutoff_dt]
+        filtered_df = df[df[timestamp_column] > comparable(cutoff_dt, df[timestamp_column])]
 
         # 保存结果
         print(f"正在保存结果到: {output_file}")
@@ -124,9 +106,11 @@ def main():
 
     # 显示时间戳范围
     try:
-        df[timestamp_column] = pd.to_datetime(df[timestamp_column])
-        min_time = df[timestamp_column].min()
-        max_time = df[timestamp_column].max()
+        parsed, report = parse_column(df[timestamp_column])
+        if report["unparseable"]:
+            print(format_report(report, timestamp_column))
+        min_time = parsed.min()
+        max_time = parsed.max()
         print(f"\n时间戳范围:")
         print(f"最早时间: {min_time}")
         print(f"最晚时间: {max_time}")
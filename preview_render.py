@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+预览图生成
+把原图缩放到指定宽度并编码为 WebP/JPEG。本模块导入时没有副作用（不打开文件、不启动线程），
+server.py 的请求线程和后台预生成线程池都调用这里的 render_preview。
+"""
+
+import math
+import os
+import threading
+
+# 尝试导入Pillow，用于生成缩小的预览图；不可用时直接返回原图
+try:
+    from PIL import Image, ImageOps, features as pil_features
+
+    PIL_AVAILABLE = True
+    WEBP_AVAILABLE = pil_features.check("webp")
+except ImportError:
+    PIL_AVAILABLE = False
+    WEBP_AVAILABLE = False
+
+PREVIEW_QUALITY = 85
+# 这些格式的原图如果不比预览宽，直接返回原图而不重新编码
+PREVIEW_PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+
+
+def render_preview(image_path, output_path, width, fmt, quality=PREVIEW_QUALITY):
+    """把图片缩放到指定宽度并编码为 WebP/JPEG 写入 output_path
+
+    Returns:
+        int: 预览文件大小；原图不比预览宽且浏览器可直接显示时返回0，表示应直接使用原图
+    """
+    with Image.open(image_path) as im:
+        # EXIF方向为5-8时图片显示时会旋转90度，宽高互换
+        rotated = im.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        display_width, display_height = (
+            (im.height, im.width) if rotated else (im.width, im.height)
+        )
+        if display_width <= width and im.format in PREVIEW_PASSTHROUGH_FORMATS:
+            return 0
+
+        scale = width / display_width
+        # JPEG解码时直接按比例缩小（DCT缩放），大图可以少解码很多像素
+        im.draft(None, (math.ceil(im.width * scale), math.ceil(im.height * scale)))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail(
+            (width, max(1, math.ceil(display_height * scale))),
+            Image.LANCZOS,
+            reducing_gap=3.0,
+        )
+
+        if fmt == "jpeg":
+            if im.mode in ("RGBA", "LA", "P"):
+                im = im.convert("RGBA")
+                background = Image.new("RGB", im.size, (255, 255, 255))
+                background.paste(im, mask=im.getchannel("A"))
+                im = background
+            elif im.mode != "RGB":
+                im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        im.save(tmp_path, format=fmt.upper(), quality=quality)
+    os.replace(tmp_path, output_path)
+    return os.path.getsize(output_path)
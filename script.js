@@ -2,6 +2,32 @@
 let images = [];
 let currentIndex = 0;
 let annotations = {};
+// 服务器端图片总数（分页加载时 images 只包含已获取的部分）
+let totalImages = 0;
+// 每次加载新列表时递增，用于停止旧列表的后台分页请求
+let listGeneration = 0;
+const PAGE_SIZE = 2000;
+// 显示区域最宽约1000px，按该宽度请求服务器缩放后的预览图（兼顾高分屏）
+const PREVIEW_WIDTH = 1600;
+
+// 预加载环形缓冲：当前图片之后/之前各保留若干张已下载并解码的图片
+const PRELOAD_AHEAD = 5;
+const PRELOAD_BEHIND = 2;
+// 已解码图片的内存上限（按 宽×高×4 字节估算）
+const PRELOAD_MEMORY_LIMIT = 256 * 1024 * 1024;
+// 列表下标 -> { img, ready, failed, bytes }
+let preloadCache = new Map();
+const preloadStats = { hits: 0, misses: 0 };
+// 当前显示的图片元素，切换图片时解除其加载回调
+let displayedImage = null;
+// 尚未被服务器确认的标注变更（增量保存）
+let pendingChanges = {};
+let saveSeq = 0;
+let saveChain = Promise.resolve();
+const clientId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+// 分配模式：当前任务队列和租约（{ queueId, leaseId }），以及定时续约的计时器
+let workLease = null;
+let leaseRenewTimer = null;
 
 // DOM元素
 const statusElement = document.getElementById('status');
@@ -15,6 +41,9 @@ const csvPathInput = document.getElementById('csvPath');
 const csvFiltersInput = document.getElementById('csvFilters');
 const csvOrderSelect = document.getElementById('csvOrder');
 const singleImagePathInput = document.getElementById('singleImagePath');
+const assignModeInput = document.getElementById('assignMode');
+const annotatorNameInput = document.getElementById('annotatorName');
+const skipLabeledInput = document.getElementById('skipLabeled');
 
 // 简单HTML转义，避免路径/文件名中的特殊字符影响渲染
 function escapeHtml(text) {
@@ -58,8 +87,22 @@ document.addEventListener('DOMContentLoaded', function() {
     if (savedOrder && csvOrderSelect) {
         csvOrderSelect.value = savedOrder;
     }
+
+    const savedAnnotator = localStorage.getItem('lastAnnotatorName');
+    if (savedAnnotator && annotatorNameInput) {
+        annotatorNameInput.value = savedAnnotator;
+    }
+    if (assignModeInput) {
+        assignModeInput.checked = localStorage.getItem('lastAssignMode') === '1';
+    }
+    if (skipLabeledInput) {
+        skipLabeledInput.checked = localStorage.getItem('lastSkipLabeled') === '1';
+    }
 });
 
+// 关闭页面时归还租约，未完成的图片立即可以分配给其他人
+window.addEventListener('pagehide', releaseLease);
+
 // 键盘事件处理
 function handleKeyPress(event) {
     if (images.length === 0) return;
@@ -93,7 +136,11 @@ function showSingleImage() {
     }
     localStorage.setItem('lastSingleImagePath', path);
 
+    setWorkLease({});
+    resetPreloadCache();
     images = [path];
+    totalImages = 1;
+    listGeneration++;
     currentIndex = 0;
     annotations = {};
 
@@ -125,7 +172,7 @@ async function loadImagesFromCSV() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ csv_path: csvPath, order })
+            body: JSON.stringify({ csv_path: csvPath, order, limit: PAGE_SIZE, client_id: clientId, skip_labeled: skipLabeledOption(), ...assignOptions() })
         });
 
         if (!response.ok) {
@@ -135,23 +182,12 @@ async function loadImagesFromCSV() {
         const data = await response.json();
 
         if (data.success) {
-            images = data.images;
-            currentIndex = 0;
-            annotations = {};
-
-            // 预载入quality（如果返回了）
-            if (data.qualities && typeof data.qualities === 'object') {
-                for (const [imgPath, q] of Object.entries(data.qualities)) {
-                    annotations[imgPath] = {
-                        quality: q,
-                        timestamp: new Date().toISOString()
-                    };
-                }
-            }
+            // 预载入quality（如果返回了），并在后台获取后续页
+            startImageList(data);
 
             if (images.length > 0) {
                 const invalidInfo = (data.invalid && data.invalid > 0) ? `，忽略无效条目 ${data.invalid} 个` : '';
-                showStatus(`成功从CSV加载 ${images.length} 张图片${invalidInfo}`,'success');
+                showStatus(`成功从CSV加载 ${totalImages} 张图片${invalidInfo}`,'success');
                 showControls();
                 updateProgress();
                 displayCurrentImage();
@@ -168,6 +204,158 @@ async function loadImagesFromCSV() {
     }
 }
 
+// 应用服务器返回的第一页图片列表，并在后台继续获取后续页
+function startImageList(data) {
+    setWorkLease(data);
+    resetPreloadCache();
+    images = data.images;
+    totalImages = data.count || images.length;
+    currentIndex = 0;
+    annotations = {};
+    applyQualities(data.qualities);
+
+    const generation = ++listGeneration;
+    if (data.next_cursor) {
+        fetchRemainingPages(data.next_cursor, generation);
+    }
+}
+
+// 以前标注过的图片：勾选时从列表中去掉，否则保留并由服务器返回已有的标注
+function skipLabeledOption() {
+    const skip = skipLabeledInput && skipLabeledInput.checked;
+    localStorage.setItem('lastSkipLabeled', skip ? '1' : '0');
+    return skip ? 'exclude' : 'flag';
+}
+
+// 分配模式的请求参数；未勾选时为空
+function assignOptions() {
+    if (!assignModeInput || !assignModeInput.checked) {
+        localStorage.setItem('lastAssignMode', '0');
+        return {};
+    }
+    const annotator = (annotatorNameInput ? annotatorNameInput.value : '').trim();
+    localStorage.setItem('lastAssignMode', '1');
+    localStorage.setItem('lastAnnotatorName', annotator);
+    return { assign: true, annotator };
+}
+
+// 记录服务器分配的租约，并在有效期过半时续约
+function setWorkLease(data) {
+    if (workLease && workLease.leaseId && workLease.leaseId !== data.lease_id) {
+        releaseLease();
+    }
+    clearInterval(leaseRenewTimer);
+    leaseRenewTimer = null;
+    workLease = data.queue_id ? { queueId: data.queue_id, leaseId: data.lease_id } : null;
+    if (workLease && workLease.leaseId && data.expires_in) {
+        leaseRenewTimer = setInterval(renewLease, data.expires_in * 500);
+    }
+}
+
+async function renewLease() {
+    if (!workLease || !workLease.leaseId) return;
+    try {
+        const response = await fetch('/api/work/renew', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ queue_id: workLease.queueId, lease_id: workLease.leaseId, client_id: clientId })
+        });
+        if (response.status === 410) {
+            clearInterval(leaseRenewTimer);
+            showStatus('租约已过期，未完成的图片可能已分配给其他人，请领取新的任务', 'warning');
+        }
+    } catch (error) {
+        console.error('续约失败:', error);
+    }
+}
+
+function releaseLease() {
+    if (!workLease || !workLease.leaseId) return;
+    fetch('/api/work/release', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ queue_id: workLease.queueId, lease_id: workLease.leaseId, client_id: clientId }),
+        keepalive: true
+    });
+}
+
+// 当前租约的图片看完后领取下一个租约（等待标注保存完成，服务器才知道哪些已完成）
+async function fetchNextLease() {
+    await saveAnnotations();
+    showStatus('正在领取新的任务...', 'info');
+    try {
+        const response = await fetch('/api/work/lease', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ queue_id: workLease.queueId, client_id: clientId, ...assignOptions() })
+        });
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error);
+        }
+        if (data.finished) {
+            setWorkLease({});
+            showStatus(`全部任务已完成（${data.done} / ${data.total}）`, 'success');
+            return;
+        }
+        startImageList(data);
+        showStatus(`已领取 ${data.count} 张图片，队列剩余 ${data.pending} 张`, 'success');
+        updateProgress();
+        displayCurrentImage();
+    } catch (error) {
+        showStatus(`领取任务失败: ${error.message}`, 'warning');
+        console.error('Error acquiring lease:', error);
+    }
+}
+
+// 预载入服务器返回的quality
+function applyQualities(qualities) {
+    if (!qualities || typeof qualities !== 'object') return;
+    for (const [imgPath, q] of Object.entries(qualities)) {
+        if (!(imgPath in annotations)) {
+            annotations[imgPath] = {
+                quality: q,
+                timestamp: new Date().toISOString()
+            };
+        }
+    }
+}
+
+// 后台按游标获取剩余的图片列表
+async function fetchRemainingPages(cursor, generation) {
+    while (cursor && generation === listGeneration) {
+        try {
+            const response = await fetch(`/api/images/page?cursor=${encodeURIComponent(cursor)}&limit=${PAGE_SIZE}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const data = await response.json();
+            if (generation !== listGeneration) return;
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+
+            images.push(...data.images);
+            applyQualities(data.qualities);
+            cursor = data.next_cursor;
+            updateProgress();
+        } catch (error) {
+            console.error('获取后续图片列表失败:', error);
+            if (generation === listGeneration) {
+                showStatus(`获取后续图片列表失败: ${error.message}`, 'warning');
+            }
+            return;
+        }
+    }
+}
+
 // 解析筛选输入，如："quality=Good; cid1=123,456"
 function parseFiltersInput(text) {
     const filters = {};
@@ -190,6 +378,110 @@ function parseFiltersInput(text) {
     return filters;
 }
 
+// 把筛选条件写回输入框格式（parseFiltersInput 的逆操作）
+function serializeFilters(filters) {
+    return Object.entries(filters)
+        .map(([key, value]) => `${key}=${Array.isArray(value) ? value.join(',') : value}`)
+        .join('; ');
+}
+
+// 筛选项统计面板：显示各列在当前筛选下每个取值的行数，点击取值加入/移出筛选条件
+const facetPanel = document.getElementById('facetPanel');
+let facetRequestId = 0;
+let facetRefreshTimer = null;
+
+function toggleFacetPanel() {
+    if (facetPanel.style.display === 'none') {
+        facetPanel.style.display = 'block';
+        loadFacets();
+    } else {
+        facetPanel.style.display = 'none';
+    }
+}
+
+async function loadFacets() {
+    const csvPath = (csvPathInput ? csvPathInput.value : '').trim();
+    if (!csvPath) {
+        facetPanel.innerHTML = '<p>请输入CSV文件路径</p>';
+        return;
+    }
+
+    const requestId = ++facetRequestId;
+    const filters = parseFiltersInput((csvFiltersInput ? csvFiltersInput.value : '').trim());
+    try {
+        const response = await fetch('/api/facets', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ csv_path: csvPath, filters })
+        });
+        const data = await response.json();
+        // 输入变化较快时只显示最后一次请求的结果
+        if (requestId !== facetRequestId) return;
+        if (!data.success) {
+            facetPanel.innerHTML = `<p>${escapeHtml(data.error)}</p>`;
+            return;
+        }
+        renderFacets(data);
+    } catch (error) {
+        if (requestId === facetRequestId) {
+            facetPanel.innerHTML = `<p>获取筛选项失败: ${escapeHtml(error.message)}</p>`;
+        }
+    }
+}
+
+function renderFacets(data) {
+    let html = `<p>匹配 ${data.matched_rows} / ${data.total_rows} 行</p>`;
+    for (const [column, facet] of Object.entries(data.facets)) {
+        const selected = new Set(data.filters[column] || []);
+        html += `<div class="facet-column"><strong>${escapeHtml(column)}</strong>`;
+        for (const [value, count] of facet.values) {
+            const cls = selected.has(value) ? 'facet-value selected' : 'facet-value';
+            html += `<span class="${cls}" data-column="${escapeHtml(column)}" data-value="${escapeHtml(value)}">${escapeHtml(value)} (${count})</span>`;
+        }
+        if (facet.truncated) {
+            html += `<span>… 共 ${facet.distinct} 个取值</span>`;
+        }
+        html += '</div>';
+    }
+    facetPanel.innerHTML = html;
+}
+
+function toggleFacetValue(column, value) {
+    const filters = parseFiltersInput((csvFiltersInput ? csvFiltersInput.value : '').trim());
+    const values = new Set([].concat(filters[column] || []));
+    if (values.has(value)) {
+        values.delete(value);
+    } else {
+        values.add(value);
+    }
+    if (values.size > 0) {
+        filters[column] = Array.from(values);
+    } else {
+        delete filters[column];
+    }
+    csvFiltersInput.value = serializeFilters(filters);
+    loadFacets();
+}
+
+if (facetPanel) {
+    facetPanel.addEventListener('click', (event) => {
+        const target = event.target.closest('.facet-value');
+        if (target) {
+            toggleFacetValue(target.dataset.column, target.dataset.value);
+        }
+    });
+}
+
+if (csvFiltersInput) {
+    csvFiltersInput.addEventListener('input', () => {
+        if (facetPanel.style.display === 'none') return;
+        clearTimeout(facetRefreshTimer);
+        facetRefreshTimer = setTimeout(loadFacets, 300);
+    });
+}
+
 async function loadImagesFromCSVWithFilters() {
     const csvPath = (csvPathInput ? csvPathInput.value : '').trim();
     const filtersText = (csvFiltersInput ? csvFiltersInput.value : '').trim();
@@ -213,7 +505,7 @@ async function loadImagesFromCSVWithFilters() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ csv_path: csvPath, filters, order })
+            body: JSON.stringify({ csv_path: csvPath, filters, order, limit: PAGE_SIZE, client_id: clientId, skip_labeled: skipLabeledOption(), ...assignOptions() })
         });
 
         if (!response.ok) {
@@ -223,22 +515,11 @@ async function loadImagesFromCSVWithFilters() {
         const data = await response.json();
 
         if (data.success) {
-            images = data.images;
-            currentIndex = 0;
-            annotations = {};
-
-            if (data.qualities && typeof data.qualities === 'object') {
-                for (const [imgPath, q] of Object.entries(data.qualities)) {
-                    annotations[imgPath] = {
-                        quality: q,
-                        timestamp: new Date().toISOString()
-                    };
-                }
-            }
+            startImageList(data);
 
             if (images.length > 0) {
                 const invalidInfo = (data.invalid && data.invalid > 0) ? `，忽略无效条目 ${data.invalid} 个` : '';
-                showStatus(`成功从CSV加载 ${images.length} 张图片${invalidInfo}`,'success');
+                showStatus(`成功从CSV加载 ${totalImages} 张图片${invalidInfo}`,'success');
                 showControls();
                 updateProgress();
                 displayCurrentImage();
@@ -275,7 +556,7 @@ async function loadImages() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ folder_path: folderPath })
+            body: JSON.stringify({ folder_path: folderPath, limit: PAGE_SIZE, client_id: clientId, skip_labeled: skipLabeledOption(), ...assignOptions() })
         });
         
         if (!response.ok) {
@@ -285,12 +566,10 @@ async function loadImages() {
         const data = await response.json();
         
         if (data.success) {
-            images = data.images;
-            currentIndex = 0;
-            annotations = {};
+            startImageList(data);
             
             if (images.length > 0) {
-                showStatus(`成功加载 ${images.length} 张图片`, 'success');
+                showStatus(`成功加载 ${totalImages} 张图片`, 'success');
                 showControls();
                 updateProgress();
                 displayCurrentImage();
@@ -307,6 +586,86 @@ async function loadImages() {
     }
 }
 
+// 预览图地址
+function previewUrl(imagePath) {
+    return `/api/image/?path=${encodeURIComponent(imagePath)}&w=${PREVIEW_WIDTH}`;
+}
+
+// 开始下载并解码指定下标的图片，已在缓冲中则直接返回
+function preloadImage(index) {
+    let entry = preloadCache.get(index);
+    if (entry) return entry;
+
+    const img = new Image();
+    entry = { img, ready: false, failed: false, bytes: 0 };
+    img.src = previewUrl(images[index]);
+    img.decode()
+        .then(() => {
+            entry.ready = true;
+            entry.bytes = img.naturalWidth * img.naturalHeight * 4;
+            trimPreloadCache();
+        })
+        .catch(() => {
+            entry.failed = true;
+        });
+    preloadCache.set(index, entry);
+    return entry;
+}
+
+function dropPreloadEntry(index) {
+    const entry = preloadCache.get(index);
+    if (!entry) return;
+    entry.img.onload = null;
+    entry.img.onerror = null;
+    entry.img.removeAttribute('src');
+    preloadCache.delete(index);
+}
+
+// 清空预加载缓冲（加载新列表时调用）
+function resetPreloadCache() {
+    detachImageHandlers();
+    for (const index of Array.from(preloadCache.keys())) {
+        dropPreloadEntry(index);
+    }
+    preloadCache = new Map();
+    preloadStats.hits = 0;
+    preloadStats.misses = 0;
+}
+
+// 超出内存上限时，优先淘汰离当前图片最远的已解码图片
+function trimPreloadCache() {
+    let total = 0;
+    for (const entry of preloadCache.values()) total += entry.bytes;
+
+    while (total > PRELOAD_MEMORY_LIMIT) {
+        let farthest = null;
+        for (const [index, entry] of preloadCache) {
+            if (index === currentIndex || !entry.bytes) continue;
+            if (farthest === null || Math.abs(index - currentIndex) > Math.abs(farthest - currentIndex)) {
+                farthest = index;
+            }
+        }
+        if (farthest === null) break;
+        total -= preloadCache.get(farthest).bytes;
+        dropPreloadEntry(farthest);
+    }
+}
+
+// 以当前图片为中心移动预加载窗口：先加载后面的，再加载前面的
+function updatePreloadWindow() {
+    const first = Math.max(0, currentIndex - PRELOAD_BEHIND);
+    const last = Math.min(images.length - 1, currentIndex + PRELOAD_AHEAD);
+
+    for (const index of Array.from(preloadCache.keys())) {
+        if (index < first || index > last) {
+            dropPreloadEntry(index);
+        }
+    }
+
+    for (let i = currentIndex + 1; i <= last; i++) preloadImage(i);
+    for (let i = currentIndex - 1; i >= first; i--) preloadImage(i);
+}
+
 // 显示当前图片
 function displayCurrentImage() {
     if (images.length === 0) return;
@@ -316,35 +675,75 @@ function displayCurrentImage() {
     
     // 正确处理路径编码，确保反斜杠被正确编码
     const encodedPath = encodeURIComponent(imagePath);
+
+    const entry = preloadImage(currentIndex);
+    if (entry.ready) {
+        preloadStats.hits++;
+    } else {
+        preloadStats.misses++;
+    }
     
     imageContainer.innerHTML = `
         <div style="display:flex; flex-direction:column; align-items:center; width:100%">
-            <img src="/api/image/?path=${encodedPath}" alt="${escapeHtml(imageName)}" 
-                 onload="imageLoaded()" onerror="imageError()">
+            <div id="imageSlot"></div>
             <div style="margin-top:10px; color:#555; font-size:14px; width:100%; max-width:1000px;">
-                <div><strong>文件名</strong>: <span style="font-family:monospace">${escapeHtml(imageName)}</span></div>
+                <div><strong>文件名</strong>: <span style="font-family:monospace">${escapeHtml(imageName)}</span>
+                    <a href="/api/image/?path=${encodedPath}" target="_blank" style="margin-left:10px">查看原图</a></div>
                 <div style="word-break:break-all"><strong>路径</strong>: <span style="font-family:monospace">${escapeHtml(imagePath)}</span></div>
             </div>
         </div>
 `;
+
+    const img = entry.img;
+    img.alt = imageName;
+    detachImageHandlers();
+    if (entry.failed || (img.complete && img.naturalWidth === 0)) {
+        // 加载或解码在切换到这张图片之前就已失败
+        imageError(currentIndex);
+        return;
+    }
+    displayedImage = img;
+    if (!entry.ready && !img.complete) {
+        // 回调绑定到这张图片的下标，切换图片时解除，迟到的事件不会报告为其他图片
+        const index = currentIndex;
+        img.onload = () => imageLoaded(index);
+        img.onerror = () => imageError(index);
+    }
+    document.getElementById('imageSlot').appendChild(img);
     
     updateStatus();
+    updatePreloadWindow();
+}
+
+// 解除上一张显示的图片的加载回调
+function detachImageHandlers() {
+    if (displayedImage) {
+        displayedImage.onload = null;
+        displayedImage.onerror = null;
+        displayedImage = null;
+    }
 }
 
 // 图片加载成功
-function imageLoaded() {
-    // 可以在这里添加图片加载成功的逻辑
+function imageLoaded(index) {
+    if (index !== currentIndex) return;
+    detachImageHandlers();
 }
 
 // 图片加载失败
-function imageError() {
-    const imagePath = images[currentIndex];
+function imageError(index) {
+    if (index !== currentIndex) return;
+    detachImageHandlers();
+    const entry = preloadCache.get(index);
+    if (entry) entry.failed = true;
+
+    const imagePath = images[index];
     console.error(`图片加载失败: ${imagePath}`);
     
     imageContainer.innerHTML = `
         <div style="color: red; padding: 20px;">
             <h3>图片加载失败</h3>
-            <p>路径: ${imagePath}</p>
+            <p>路径: ${escapeHtml(imagePath)}</p>
             <p>请检查文件是否存在且可访问</p>
             <button onclick="retryLoadImage()" style="margin-top: 10px; padding: 5px 10px;">重试</button>
         </div>
@@ -353,6 +752,7 @@ function imageError() {
 
 // 重试加载图片
 function retryLoadImage() {
+    dropPreloadEntry(currentIndex);
     displayCurrentImage();
 }
 
@@ -415,6 +815,10 @@ function nextImage() {
         currentIndex++;
         displayCurrentImage();
         updateProgress();
+    } else if (images.length < totalImages) {
+        showStatus('正在加载更多图片，请稍候...', 'info');
+    } else if (workLease && workLease.leaseId) {
+        fetchNextLease();
     }
 }
 
@@ -440,6 +844,7 @@ async function markImage(quality) {
         quality: quality,
         timestamp: new Date().toISOString()
     };
+    pendingChanges[imagePath] = annotations[imagePath];
     
     // 显示状态
     showStatus(`已标记 "${imageName}" 为 ${quality}`, 'success');
@@ -447,23 +852,33 @@ async function markImage(quality) {
     // 自动保存到CSV
     await saveAnnotations();
     
-    // 自动跳转到下一张图片
+    // 自动跳转到下一张图片；分配模式下租约的最后一张标注后领取下一个租约
     setTimeout(() => {
-        if (currentIndex < images.length - 1) {
+        if (currentIndex < images.length - 1 || (workLease && workLease.leaseId)) {
             nextImage();
         }
     }, 500);
 }
 
-// 保存标注到CSV
-async function saveAnnotations() {
+// 保存标注到CSV：串行提交，每次只发送尚未确认的变更
+function saveAnnotations() {
+    saveChain = saveChain.then(flushPendingChanges);
+    return saveChain;
+}
+
+async function flushPendingChanges() {
+    const changes = pendingChanges;
+    if (Object.keys(changes).length === 0) return;
+    pendingChanges = {};
+    const seq = ++saveSeq;
+
     try {
         const response = await fetch('/api/save', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ annotations: annotations })
+            body: JSON.stringify({ client_id: clientId, seq: seq, changes: changes })
         });
         
         if (!response.ok) {
@@ -472,11 +887,24 @@ async function saveAnnotations() {
         
         const data = await response.json();
         
+        if (data.rejected) {
+            // 服务器拒绝的条目重发也不会成功，只重发其余变更
+            showStatus(`保存失败: ${data.error}`, 'warning');
+            for (const imgPath of data.rejected) {
+                delete changes[imgPath];
+            }
+        }
         if (!data.success) {
-            console.error('保存失败:', data.error);
+            throw new Error(data.error);
         }
     } catch (error) {
         console.error('保存标注时出错:', error);
+        // 未确认的变更放回队列，下次保存时重发（服务器按状态比对，重发不会重复写入）
+        for (const [imgPath, annotation] of Object.entries(changes)) {
+            if (!(imgPath in pendingChanges)) {
+                pendingChanges[imgPath] = annotation;
+            }
+        }
     }
 }
 
@@ -484,9 +912,10 @@ async function saveAnnotations() {
 function updateProgress() {
     if (images.length === 0) return;
     
-    const progress = ((currentIndex + 1) / images.length) * 100;
+    const total = Math.max(totalImages, images.length);
+    const progress = ((currentIndex + 1) / total) * 100;
     progressFill.style.width = `${progress}%`;
-    progressText.textContent = `${currentIndex + 1} / ${images.length}`;
+    progressText.textContent = `${currentIndex + 1} / ${total}`;
 }
 
 // 更新状态显示
@@ -501,6 +930,12 @@ function updateStatus() {
     if (annotation) {
         statusText += ` (已标记为: ${annotation.quality})`;
     }
+
+    const viewed = preloadStats.hits + preloadStats.misses;
+    if (viewed > 0) {
+        const hitRate = Math.round((preloadStats.hits / viewed) * 100);
+        statusText += ` | 预加载命中 ${preloadStats.hits}/${viewed} (${hitRate}%)`;
+    }
     
     showStatus(statusText, 'info');
 }
@@ -1,21 +1,144 @@
-from flask import Flask, request, jsonify, send_file, render_template_string, Response
+from flask import (
+    Flask,
+    request,
+    jsonify,
+    send_file,
+    render_template_string,
+    Response,
+    stream_with_context,
+    g,
+)
 import os
+import sys
+import argparse
 import csv
+import glob
 import json
+import base64
+import uuid
+import hashlib
+import logging
+import logging.handlers
+import queue
+import re
+from collections import OrderedDict, deque
 from datetime import datetime
-from pathlib import Path
 import mimetypes
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+import threading
+import time
+import atexit
+import heapq
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+
+import columnar_io
+from csv_index import CsvIndex
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from preview_render import PIL_AVAILABLE, WEBP_AVAILABLE, render_preview
+from deduplicate_csv import (
+    DERIVED_FILE_MARKERS,
+    default_output_file,
+    expand_inputs,
+    merge_deduplicate,
+    stream_deduplicate,
+)
+from timestamp_utils import timestamp_sort_key
 
 # 尝试导入pandas，如果不可用则使用标准库
 try:
+    import numpy as np
     import pandas as pd
 
     PANDAS_AVAILABLE = True
 except ImportError:
     PANDAS_AVAILABLE = False
 
+# 尝试导入waitress，作为多线程的生产环境WSGI服务器；不可用时使用Werkzeug的多线程模式
+try:
+    from waitress import serve as waitress_serve
+
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+# 文件锁（仅POSIX），阻止多个服务器进程同时写同一份预写日志
+try:
+    import fcntl
+
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
 app = Flask(__name__)
 
+# 日志级别（环境变量 ANNOTATION_LOG_LEVEL，如 DEBUG、INFO、WARNING），日志经队列由后台线程输出
+LOG_LEVEL = os.environ.get("ANNOTATION_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("annotation_server")
+
+
+_log_listener = None
+_log_listener_lock = threading.Lock()
+
+
+def configure_logging(level=LOG_LEVEL):
+    """日志（包括Werkzeug的访问日志）放入队列，由后台线程写到stderr，请求线程不做终端IO
+
+    重复调用（如命令行入口和ASGI的lifespan启动都会调用）只在第一次生效。
+    """
+    global _log_listener
+    with _log_listener_lock:
+        if _log_listener is None:
+            _log_listener = _start_log_listener(level)
+    return _log_listener
+
+
+def _start_log_listener(level):
+    log_queue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.setLevel(level)
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# 请求和热点路径的指标，由 /api/metrics 以Prometheus文本格式输出
+metrics = MetricsRegistry()
+request_count = metrics.counter(
+    "annotation_http_requests_total", "按路由、方法和状态码统计的请求数", ("route", "method", "status")
+)
+request_errors = metrics.counter(
+    "annotation_http_request_errors_total",
+    "失败的请求数（状态码不小于400，或JSON响应中success为false）",
+    ("route",),
+)
+request_latency = metrics.histogram(
+    "annotation_http_request_duration_seconds", "从收到请求到生成响应的耗时", ("route",)
+)
+response_bytes = metrics.counter(
+    "annotation_http_response_bytes_total", "已知长度的响应体字节数", ("route",)
+)
+directory_scan_seconds = metrics.histogram(
+    "annotation_directory_scan_seconds", "文件夹索引重新扫描的耗时"
+)
+manifest_parse_seconds = metrics.histogram(
+    "annotation_manifest_parse_seconds", "解析CSV/Parquet清单的耗时（清单缓存未命中时）"
+)
+existence_check_seconds = metrics.histogram(
+    "annotation_existence_check_seconds", "检查清单中图片是否存在的耗时"
+)
+
 # 支持的图片格式
 SUPPORTED_FORMATS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"}
 
@@ -26,200 +149,2291 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 CSV_FILE = f"data/annotations_{timestamp}.csv"
 
+# 标注预写日志（JSON Lines，每行一条变更），启动时回放以恢复每张图片的最新标注
+WAL_FILE = "data/annotations.wal"
+# 预写日志批量fsync：距上次同步超过该秒数，或累计未同步条数达到阈值时触发
+WAL_FSYNC_INTERVAL = 1.0
+WAL_FSYNC_RECORDS = 256
+# 会话CSV的旁路索引（<CSV文件名>.idx）随每批写入更新，最多每隔该秒数写一次索引文件
+CSV_INDEX_SAVE_INTERVAL = 5.0
+# 以前的会话CSV：启动时把其中每张图片的最新标注并入预写日志（已导入且未变化的文件会跳过），
+# skip_labeled 和分配模式据此判断图片是否已标注。去重/合并生成的 annotations_deduplicated_*、
+# annotations_merged_* 文件也匹配该模式，导入时会被排除
+SESSION_CSV_PATTERN = "data/annotations_*.csv"
+
+# 服务器监听地址和处理请求的线程数（waitress）
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 5000
+SERVER_THREADS = 32
+
+CSV_FIELDNAMES = ["image_path", "image_name", "quality", "timestamp"]
+
+# 文件夹索引持久化文件：记录每个目录的mtime、图片文件和子目录，重新扫描时只进入有变化的目录
+FOLDER_INDEX_FILE = "data/folder_index.json"
+# 同一文件夹的重复请求在该秒数内直接使用内存中的结果，不再检查目录mtime
+FOLDER_INDEX_TTL = 30.0
+FOLDER_MTIME_GRACE_NS = 2_000_000_000
+# 目录扫描线程数：网络文件系统上每个目录的延迟占主导，多线程并发列目录
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# CSV图片存在性检查：按目录批量列出文件并缓存结果的秒数
+EXISTENCE_CACHE_TTL = 60.0
+# 同一目录中待检查的文件少于该数量时逐个stat，避免为一两个文件列出整个大目录
+EXISTENCE_SCANDIR_MIN_FILES = 8
+
+# 解析后的CSV清单缓存（按路径、mtime和大小识别文件）的内存上限
+MANIFEST_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 分页列表：服务器保留最近加载的图片列表数量，以及单页最大条数
+IMAGE_LIST_CACHE_SIZE = 16
+MAX_PAGE_SIZE = 10000
+
+# 任务分配：每个租约包含的图片数、租约有效期（秒，期间保存标注或续约会延长），
+# 以及服务器保留的任务队列数量
+LEASE_SIZE = 50
+LEASE_TTL = 600.0
+WORK_QUEUE_CACHE_SIZE = 16
+
+# 图片响应允许浏览器直接复用的秒数，过期后凭ETag/Last-Modified重新验证
+IMAGE_CACHE_MAX_AGE = 600
+
+# 预览图缓存目录及总大小上限（超出后按最近最少使用淘汰）
+PREVIEW_CACHE_DIR = "data/preview_cache"
+PREVIEW_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# 预览宽度范围；请求的宽度向上取整到步长的倍数，避免缓存碎片
+PREVIEW_MIN_WIDTH = 64
+PREVIEW_MAX_WIDTH = 4096
+PREVIEW_WIDTH_STEP = 64
+# 页面请求的预览宽度，后台预生成时使用同一宽度
+DEFAULT_PREVIEW_WIDTH = 1600
+
+# 加载列表后在后台为前K张图片预生成预览图（0表示关闭）
+PREFETCH_AHEAD = 200
+# 预生成线程数（Pillow解码、缩放和编码时释放GIL），以及每个任务最多同时提交的图片数（限流）
+PREFETCH_WORKERS = os.cpu_count() or 1
+PREFETCH_IN_FLIGHT = PREFETCH_WORKERS * 2
+# 最多保留的客户端任务数，超出后淘汰（并取消）最久未加载列表的客户端的任务
+PREFETCH_JOB_HISTORY = 64
+
+
+# 小写的支持扩展名，用于 str.endswith
+IMAGE_EXTENSIONS = tuple(sorted(SUPPORTED_FORMATS))
+# 出现这些片段的路径需要normpath规整（. / .. 段、连续分隔符，Windows上还有正斜杠）
+UNNORMALIZED_PATH_PARTS = [os.sep + "." + os.sep, os.sep + ".." + os.sep, os.sep * 2]
+UNNORMALIZED_PATH_SUFFIXES = (os.sep, os.sep + ".", os.sep + "..")
+if os.altsep:
+    UNNORMALIZED_PATH_PARTS.append(os.altsep)
+
 
 def is_image_file(file_path):
     """检查文件是否为图片"""
-    return Path(file_path).suffix.lower() in SUPPORTED_FORMATS
+    return os.path.splitext(file_path)[1].lower() in SUPPORTED_FORMATS
 
 
-def get_image_files(folder_path):
-    """获取文件夹中的所有图片文件"""
-    if not os.path.exists(folder_path):
-        return []
+def list_image_dir(dir_path):
+    """列出目录中的图片文件名和子目录名（均已排序），直接用DirEntry.name判断扩展名"""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # 与os.walk一致：不进入指向目录的符号链接
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                elif is_image_file(entry.name):
+                    files.append(entry.name)
+    except OSError:
+        pass
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+
+def parallel_walk(root, visit, max_workers=SCAN_WORKERS):
+    """在有界线程池中并行遍历目录树
+
+    Args:
+        root (str): 起始目录
+        visit (callable): visit(dir_path) -> 子目录名列表，在工作线程中调用
+        max_workers (int): 最大线程数
+
+    Returns:
+        list: 遍历到的所有目录路径
+
+    Raises:
+        任务中出现的第一个异常（出错后不再提交新的子目录，等已提交的任务结束后抛出）
+    """
+    visited = []
+    lock = threading.Lock()
+    finished = threading.Event()
+    state = {"outstanding": 1, "error": None}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        def task(dir_path):
+            try:
+                subdirs = visit(dir_path)
+                with lock:
+                    visited.append(dir_path)
+                    if state["error"] is None:
+                        for name in subdirs:
+                            # 先计数再提交；提交失败（如解释器退出时）的任务不会运行，撤销计数
+                            state["outstanding"] += 1
+                            try:
+                                pool.submit(task, os.path.join(dir_path, name))
+                            except BaseException:
+                                state["outstanding"] -= 1
+                                raise
+            except BaseException as e:
+                with lock:
+                    state["error"] = state["error"] or e
+            finally:
+                # 无论成功与否都要减去本任务，否则调用方会一直等待
+                with lock:
+                    state["outstanding"] -= 1
+                    if state["outstanding"] == 0:
+                        finished.set()
+
+        pool.submit(task, root)
+        finished.wait()
+
+    if state["error"] is not None:
+        raise state["error"]
+    return visited
+
+
+def resolve_csv_path(value):
+    """清洗CSV中的路径（去掉多余空白和引号），相对路径按项目根目录解析"""
+    candidate = value.strip().strip('"').strip("'")
+    if not os.path.isabs(candidate):
+        candidate = os.path.normpath(os.path.join(PROJECT_ROOT, candidate))
+    return candidate
+
+
+if os.name == "nt":
+    is_absolute_csv_path = re.compile(r"(?:[A-Za-z]:)?[\\/]").match
+else:
+
+    def is_absolute_csv_path(path):
+        return path.startswith("/")
+
+
+def resolve_csv_paths(paths):
+    """批量清洗并解析CSV路径，结果与逐个调用 resolve_csv_path、is_image_file 相同
+
+    只有不规整的相对路径才调用normpath，扩展名用一次 str.endswith 判断；
+    在对象字符串上这比逐列的pandas字符串操作（每个操作都要遍历一遍整列）快约3倍。
+
+    Args:
+        paths: 非空的路径值（非字符串会先转为字符串）
+
+    Returns:
+        (resolved, is_image): 解析后的绝对路径列表、扩展名是否为支持的图片格式的列表
+    """
+    root = PROJECT_ROOT + os.sep
+    dotted_name = os.sep + "."
+    resolved = []
+    is_image = []
+    for path in paths:
+        path = str(path).strip().strip('"').strip("'")
+        if not is_absolute_csv_path(path):
+            path = root + path
+            if path.endswith(UNNORMALIZED_PATH_SUFFIXES) or any(
+                part in path for part in UNNORMALIZED_PATH_PARTS
+            ):
+                path = os.path.normpath(path)
+        image = path.lower().endswith(IMAGE_EXTENSIONS)
+        # 文件名以点开头时（如 ".jpg"）扩展名判断与os.path.splitext不同，这类少数路径单独检查
+        if image and dotted_name in path:
+            image = is_image_file(path)
+        resolved.append(path)
+        is_image.append(image)
+    return resolved, is_image
+
+
+def estimate_nbytes(values, sample_size=1000):
+    """估算数组（或Series）的内存占用：对象数组按抽样元素的平均大小估算，避免deep统计遍历所有字符串"""
+    values = np.asarray(values)
+    if values.dtype != object or len(values) == 0:
+        return int(values.nbytes)
+    step = max(1, len(values) // sample_size)
+    sample = values[::step]
+    return int(values.nbytes + len(values) * sum(map(sys.getsizeof, sample)) / len(sample))
+
+
+class ColumnIndex:
+    """单列的倒排索引
+
+    每个取值（按字符串比较）对应一段按行号升序排列的行号数组，
+    按值筛选时直接取出这些行，多列筛选是行号数组的求交。
+    """
+
+    def __init__(self, column):
+        if column.dtype.kind in "iub":
+            # 整数和布尔列先按原值编码，只把不同的取值转为字符串（与astype(str)结果相同）
+            codes, uniques = pd.factorize(column, sort=False, use_na_sentinel=False)
+            values = [str(v) for v in uniques]
+        else:
+            codes, uniques = pd.factorize(column.astype(str), sort=False)
+            values = uniques.tolist()
+        row_dtype = np.int32 if len(codes) < 2**31 else np.int64
+        self.codes = codes.astype(row_dtype)
+        self.values = values
+        self._code_of = {value: i for i, value in enumerate(self.values)}
+        self.counts = np.bincount(self.codes, minlength=len(self.values))
+        # 稳定排序后同一取值的行号连续且保持升序
+        self._rows = np.argsort(self.codes, kind="stable").astype(row_dtype)
+        self._offsets = np.concatenate(([0], np.cumsum(self.counts)))
+        self.nbytes = self.codes.nbytes + self._rows.nbytes + self._offsets.nbytes + sum(
+            sys.getsizeof(v) for v in self.values
+        )
 
-    image_files = []
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if is_image_file(file_path):
-                image_files.append(file_path)
+    def rows_for(self, values):
+        """取值为values之一的行号（升序）"""
+        parts = []
+        for value in set(values):
+            code = self._code_of.get(value)
+            if code is not None:
+                parts.append(self._rows[self._offsets[code]:self._offsets[code + 1]])
+        if not parts:
+            return self._rows[:0]
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts))
+
+    def value_counts(self, rows=None):
+        """rows（None表示全部行）中每个取值的行数，按取值编码排列"""
+        if rows is None:
+            return self.counts
+        return np.bincount(self.codes[rows], minlength=len(self.values))
+
+
+def intersect_sorted_rows(a, b):
+    """两个升序行号数组求交：在较长的数组中二分查找较短数组的每个元素"""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    return a[b[pos] == a]
+
+
+def top_facet_values(pairs, limit):
+    """按行数降序（同数按取值）取前limit个非零的(取值, 行数)"""
+    pairs = sorted((p for p in pairs if p[1] > 0), key=lambda p: (-p[1], p[0]))
+    return {
+        "values": [[value, int(count)] for value, count in pairs[:limit]],
+        "distinct": len(pairs),
+        "truncated": len(pairs) > limit,
+    }
+
+
+class FrameManifest:
+    """用pandas解析的CSV清单
+
+    路径在第一次被选中时才解析并检查扩展名，结果按行缓存：带筛选条件的首次请求只解析通过筛选的行。
+    用于筛选的列在首次使用时建立倒排索引，之后每次请求只需对索引中的行号数组求交。
+    """
+
+    def __init__(self, df, path_col, source=None, columns=None):
+        self.df = df
+        self.path_col = path_col
+        # 列式文件只读取了路径和quality列，其余列在首次用于筛选时再从source读取
+        self.source = source
+        self.columns = list(columns) if columns is not None else list(df.columns)
+        self.row_count = len(df)
+        self._paths = df[path_col].to_numpy()
+        # present（路径非空）、resolved、is_image、quality 只有 _resolved 为True的行有效
+        self.present = np.zeros(self.row_count, dtype=bool)
+        self.resolved = np.full(self.row_count, None, dtype=object)
+        self.is_image = np.zeros(self.row_count, dtype=bool)
+        self._resolved = np.zeros(self.row_count, dtype=bool)
+        self._unresolved = self.row_count
+        self._resolve_lock = threading.Lock()
+        # quality 同样在解析路径时按行转为字符串（缺失为None）
+        if "quality" in df.columns:
+            self._raw_quality = df["quality"].to_numpy()
+            self.quality = np.full(self.row_count, None, dtype=object)
+        else:
+            self._raw_quality = None
+            self.quality = None
+        # 列名 -> ColumnIndex，首次按该列筛选或统计时建立
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        # 内存占用按抽样估算，解析路径和建立索引时累加
+        self.nbytes = (
+            sum(estimate_nbytes(df[name]) for name in df.columns)
+            + self.resolved.nbytes
+            + self.is_image.nbytes
+            + self.present.nbytes
+            + self._resolved.nbytes
+            + (self.quality.nbytes if self.quality is not None else 0)
+        )
 
-    return sorted(image_files)
+    def resolve(self, rows=None):
+        """解析rows（升序行号数组，None表示全部行）中尚未解析的路径"""
+        if self._unresolved == 0:
+            return
+        with self._resolve_lock:
+            if rows is None:
+                todo = np.flatnonzero(~self._resolved)
+            else:
+                todo = rows[~self._resolved[rows]]
+            if len(todo) == 0:
+                return
+            present = pd.notna(self._paths[todo])
+            self.present[todo] = present
+            todo_present = todo[present]
+            resolved, is_image = resolve_csv_paths(self._paths[todo_present])
+            self.resolved[todo_present] = resolved
+            self.is_image[todo_present] = is_image
+            if self.quality is not None:
+                quality = pd.Series(self._raw_quality[todo])
+                self.quality[todo] = quality.astype(str).where(quality.notna(), None).to_numpy()
+            self._resolved[todo] = True
+            self._unresolved -= len(todo)
+            # 新建的字符串对象（指针数组已在载入时计入）
+            for array in (self.resolved, self.quality):
+                if array is not None:
+                    self.nbytes += estimate_nbytes(array[todo]) - array[todo].nbytes
+
+    def column_index(self, name):
+        with self._index_lock:
+            index = self._indexes.get(name)
+            if index is None:
+                if name in self.df.columns:
+                    column = self.df[name]
+                else:
+                    column = columnar_io.read_table(self.source, [name])[name]
+                index = ColumnIndex(column)
+                self._indexes[name] = index
+                self.nbytes += index.nbytes
+        return index
+
+    def select_rows(self, filters, exclude=None):
+        """满足所有筛选条件的行号（升序），没有筛选条件时返回None表示全部行"""
+        parts = [
+            self.column_index(k).rows_for(values)
+            for k, values in (filters or {}).items()
+            if k != exclude
+        ]
+        if not parts:
+            return None
+        parts.sort(key=len)
+        rows = parts[0]
+        for part in parts[1:]:
+            rows = intersect_sorted_rows(rows, part)
+        return rows
+
+    def select(self, filters):
+        """按筛选条件选出图片
+
+        Returns:
+            (candidates, qualities, invalid): 通过筛选且扩展名有效的绝对路径（保持CSV顺序）、
+            对应的quality（无则为None）、路径无效的条目数
+        """
+        rows = self.select_rows(filters)
+        self.resolve(rows)
+        if rows is None:
+            image_rows = self.is_image
+            invalid = int(self.present.sum()) - int(self.is_image.sum())
+        else:
+            image_rows = rows[self.is_image[rows]]
+            invalid = int(self.present[rows].sum()) - len(image_rows)
 
+        candidates = self.resolved[image_rows].tolist()
+        if self.quality is not None:
+            qualities = self.quality[image_rows].tolist()
+        else:
+            qualities = [None] * len(candidates)
+        return candidates, qualities, invalid
+
+    def facets(self, filters, columns, limit):
+        """统计各列在当前筛选下每个取值的行数
+
+        统计某一列时不应用该列自身的筛选条件，这样已选中的列仍会列出其他可选值。
+        """
+        result = {}
+        for name in columns:
+            index = self.column_index(name)
+            counts = index.value_counts(self.select_rows(filters, exclude=name))
+            result[name] = top_facet_values(zip(index.values, counts.tolist()), limit)
+        rows = self.select_rows(filters)
+        return result, self.row_count if rows is None else len(rows)
+
+
+class ColumnarManifest:
+    """未安装pandas时用csv模块解析的CSV清单，按列保存为字符串列表"""
+
+    def __init__(self, header, columns, path_col):
+        self.columns = list(header)
+        self.path_col = path_col
+        self._columns = columns
+        self.resolved = []
+        self.is_image = []
+        for value in columns[path_col]:
+            if value:
+                candidate = resolve_csv_path(value)
+                self.resolved.append(candidate)
+                self.is_image.append(is_image_file(candidate))
+            else:
+                self.resolved.append(None)
+                self.is_image.append(False)
+        self.row_count = len(self.resolved)
+        self.quality = columns.get("quality")
+        # 列名 -> {取值: 升序行号列表}
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        self.nbytes = sum(
+            sys.getsizeof(column) + sum(sys.getsizeof(v) for v in column)
+            for column in list(columns.values()) + [self.resolved]
+        )
 
-def save_to_csv(annotations):
-    """保存标注到CSV文件"""
-    try:
-        # 检查CSV文件是否存在，如果不存在则创建表头
-        file_exists = os.path.exists(CSV_FILE)
+    @classmethod
+    def from_file(cls, csv_path):
+        with open(csv_path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = {name: [] for name in header}
+            lists = [columns[name] for name in header]
+            for row in reader:
+                for i, column in enumerate(lists):
+                    column.append(row[i].strip() if i < len(row) else "")
+        path_col = "path" if "path" in header else ("image_path" if "image_path" in header else None)
+        if path_col is None:
+            return None
+        return cls(header, columns, path_col)
+
+    def column_index(self, name):
+        with self._index_lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = {}
+                for i, value in enumerate(self._columns[name]):
+                    index.setdefault(value, []).append(i)
+                self._indexes[name] = index
+                self.nbytes += sys.getsizeof(index) + sum(
+                    sys.getsizeof(rows) + 8 * len(rows) for rows in index.values()
+                )
+        return index
+
+    def select_rows(self, filters, exclude=None):
+        """与 FrameManifest.select_rows 相同，返回行号列表"""
+        rows = None
+        for k, values in (filters or {}).items():
+            if k == exclude:
+                continue
+            index = self.column_index(k)
+            matched = set()
+            for value in set(values):
+                matched.update(index.get(value, ()))
+            rows = matched if rows is None else rows & matched
+        return None if rows is None else sorted(rows)
+
+    def select(self, filters):
+        """与 FrameManifest.select 相同"""
+        rows = self.select_rows(filters)
+        if rows is None:
+            rows = range(self.row_count)
+
+        candidates = []
+        qualities = []
+        invalid = 0
+        for i in rows:
+            if self.is_image[i]:
+                candidates.append(self.resolved[i])
+                q = self.quality[i] if self.quality is not None else ""
+                qualities.append(q or None)
+            elif self.resolved[i] is not None:
+                invalid += 1
+        return candidates, qualities, invalid
+
+    def facets(self, filters, columns, limit):
+        """与 FrameManifest.facets 相同"""
+        result = {}
+        for name in columns:
+            index = self.column_index(name)
+            rows = self.select_rows(filters, exclude=name)
+            if rows is None:
+                pairs = [(value, len(r)) for value, r in index.items()]
+            else:
+                column = self._columns[name]
+                counts = {}
+                for i in rows:
+                    counts[column[i]] = counts.get(column[i], 0) + 1
+                pairs = list(counts.items())
+            result[name] = top_facet_values(pairs, limit)
+        rows = self.select_rows(filters)
+        return result, self.row_count if rows is None else len(rows)
+
+
+def select_csv_images(manifest, filters, validate="full"):
+    """/api/images_from_csv 的选图逻辑：按筛选条件从清单中选出图片，再检查文件是否存在
+
+    清单第一次被选中的行才解析路径，因此缓存未命中时也只解析通过筛选的行。
+    validate="lazy" 时不检查文件是否存在，缺失的文件在请求图片时才报告。
+
+    Returns:
+        (images, qualities, invalid): 存在的图片路径（保持CSV顺序）、{路径: quality}、
+        路径无效或文件不存在的条目数
+    """
+    candidates, candidate_qualities, invalid = manifest.select(filters)
+    if validate == "lazy":
+        exists = [True] * len(candidates)
+    else:
+        start = time.perf_counter()
+        exists = existence_checker.check(candidates)
+        existence_check_seconds.observe(time.perf_counter() - start)
+
+    images = []
+    qualities = {}
+    for candidate, q, ok in zip(candidates, candidate_qualities, exists):
+        if ok:
+            images.append(candidate)
+            if q is not None:
+                qualities[candidate] = q
+        else:
+            invalid += 1
+    return images, qualities, invalid
+
+
+def load_manifest(csv_path):
+    """解析CSV或Parquet/Feather/Arrow清单；缺少'path'或'image_path'列时返回None"""
+    if columnar_io.columnar_format(csv_path) is not None:
+        columnar_io.require_columnar()
+        columns = columnar_io.read_columns(csv_path)
+        candidate_cols = [col for col in ["path", "image_path"] if col in columns]
+        if not candidate_cols:
+            return None
+        # 列裁剪：只读取路径和quality列
+        projection = candidate_cols[:1] + (["quality"] if "quality" in columns else [])
+        df = columnar_io.read_table(csv_path, projection)
+        return FrameManifest(df, candidate_cols[0], source=csv_path, columns=columns)
+
+    if PANDAS_AVAILABLE:
+        df = pd.read_csv(csv_path)
+        candidate_cols = [col for col in ["path", "image_path"] if col in df.columns]
+        if not candidate_cols:
+            return None
+        return FrameManifest(df, candidate_cols[0])
+    return ColumnarManifest.from_file(csv_path)
+
+
+class ManifestCache:
+    """解析后的CSV清单缓存
+
+    以(mtime_ns, size)识别文件内容，文件变化后重新解析；按最近最少使用淘汰，
+    总内存不超过 max_bytes，超过上限的单个清单不缓存。
+    """
+
+    def __init__(self, max_bytes=MANIFEST_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # 绝对路径 -> ((mtime_ns, size), 清单)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, csv_path):
+        """返回CSV对应的清单，缺少路径列时返回None"""
+        csv_path = os.path.abspath(csv_path)
+        st = os.stat(csv_path)
+        identity = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(csv_path)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(csv_path)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        start = time.perf_counter()
+        manifest = load_manifest(csv_path)
+        manifest_parse_seconds.observe(time.perf_counter() - start)
+        if manifest is None:
+            return None
+
+        with self._lock:
+            old = self._entries.pop(csv_path, None)
+            if old is not None:
+                self._bytes -= old[1].nbytes
+            if manifest.nbytes <= self.max_bytes:
+                self._entries[csv_path] = (identity, manifest)
+                self._bytes += manifest.nbytes
+                self._shrink_locked()
+        return manifest
+
+    def _shrink_locked(self):
+        # 按列筛选后清单会增大，每次放入或使用后都重新核算
+        self._bytes = sum(m.nbytes for _, m in self._entries.values())
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, manifest) = self._entries.popitem(last=False)
+            self._bytes -= manifest.nbytes
+            self.stats["evictions"] += 1
+
+    def release(self):
+        """在清单使用后调用，重新核算内存占用"""
+        with self._lock:
+            self._shrink_locked()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+manifest_cache = ManifestCache()
+
+
+class PathExistenceChecker:
+    """批量检查文件是否存在
+
+    按所在目录分组，每个目录只做一次scandir（在线程池中并行），目录内容按TTL缓存；
+    待检查文件很少的目录直接逐个stat。列表中找不到的文件再单独stat确认一次，
+    保证在大小写不敏感等文件系统上与os.path.exists结果一致。
+    """
+
+    def __init__(self, ttl=EXISTENCE_CACHE_TTL, max_workers=SCAN_WORKERS):
+        self.ttl = ttl
+        self.max_workers = max_workers
+        # dir_path -> (过期时间, 目录中的文件名集合；目录无法读取时为None)
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "dirs_listed": 0, "dir_cache_hits": 0, "stats": 0}
+
+    def _list_names(self, dir_path):
+        try:
+            with os.scandir(dir_path) as it:
+                names = {entry.name for entry in it}
+        except OSError:
+            names = None
+        with self._lock:
+            self._dirs[dir_path] = (time.monotonic() + self.ttl, names)
+            self.stats["dirs_listed"] += 1
+        return names
+
+    def _cached_names(self, dir_path):
+        with self._lock:
+            entry = self._dirs.get(dir_path)
+            if entry is not None and entry[0] > time.monotonic():
+                self.stats["dir_cache_hits"] += 1
+                return True, entry[1]
+        return False, None
+
+    def check(self, paths):
+        """返回与paths一一对应的是否存在列表"""
+        groups = {}
+        for i, path in enumerate(paths):
+            dir_path, name = os.path.split(path)
+            groups.setdefault(dir_path, []).append((i, name))
+
+        result = [False] * len(paths)
+        to_list = []
+        to_stat = []
+        for dir_path, members in groups.items():
+            cached, names = self._cached_names(dir_path)
+            if cached:
+                for i, name in members:
+                    if names is not None and name in names:
+                        result[i] = True
+                    else:
+                        to_stat.append(i)
+            elif len(members) < EXISTENCE_SCANDIR_MIN_FILES:
+                to_stat.extend(i for i, _ in members)
+            else:
+                to_list.append(dir_path)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for dir_path, names in zip(to_list, pool.map(self._list_names, to_list)):
+                for i, name in groups[dir_path]:
+                    if names is not None and name in names:
+                        result[i] = True
+                    else:
+                        to_stat.append(i)
+
+            for i, exists in zip(
+                to_stat, pool.map(os.path.exists, [paths[i] for i in to_stat])
+            ):
+                result[i] = exists
+
+        with self._lock:
+            self.stats["checked"] += len(paths)
+            self.stats["stats"] += len(to_stat)
+        return result
+
+    def forget(self, path):
+        """文件被发现缺失或变化时，丢弃其所在目录的缓存"""
+        with self._lock:
+            self._dirs.pop(os.path.dirname(path), None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached_dirs"] = len(self._dirs)
+        return stats
+
+
+existence_checker = PathExistenceChecker()
+
+
+class MissingImageTracker:
+    """记录请求时才发现不存在的图片（validate=lazy 加载的列表不会预先检查）"""
+
+    def __init__(self, max_recent=50):
+        self._recent = OrderedDict()
+        self.max_recent = max_recent
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def report(self, image_path):
+        with self._lock:
+            if image_path not in self._recent:
+                self.count += 1
+            self._recent[image_path] = datetime.now().isoformat()
+            self._recent.move_to_end(image_path)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+        existence_checker.forget(image_path)
+
+    def get_stats(self):
+        with self._lock:
+            return {"count": self.count, "recent": list(self._recent)}
+
+
+missing_images = MissingImageTracker()
+
+
+class LazySingleton:
+    """首次调用时才创建的模块级单例
+
+    构造时需要读盘的对象（文件夹索引、预览图缓存）不在导入模块时创建：合并时以spawn方式启动的
+    工作进程会把 server.py 作为 __mp_main__ 重新执行一遍，这些对象在工作进程中不会被用到。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    @property
+    def created(self):
+        return self._instance is not None
+
+
+class FolderIndex:
+    """文件夹图片索引
+
+    按目录缓存 (mtime, 图片文件名, 子目录名)，并持久化到磁盘。重新扫描时每个目录只做一次
+    stat，mtime未变化的目录直接复用缓存的列表，只有发生变化的目录才会重新列出内容。
+
+    扫描在全局锁之外进行：同一文件夹同时只有一个扫描（其他请求等待该文件夹的锁后直接使用结果），
+    不同文件夹可以并行扫描；全局锁只用于换入扫描结果和读取统计，索引文件由快照在锁外写出。
+    """
+
+    def __init__(self, index_file, ttl=FOLDER_INDEX_TTL):
+        self.index_file = index_file
+        self.ttl = ttl
+        # dir_path -> {"mtime": int, "files": [图片文件名], "subdirs": [子目录名]}
+        # 条目只会被整体替换，不会原地修改
+        self._dirs = {}
+        # folder_path -> (检查时间, 排序后的图片路径列表)
+        self._results = {}
+        self._lock = threading.Lock()
+        # folder_path -> [该文件夹的扫描锁, 正在使用的请求数]
+        self._scan_locks = {}
+        # 保证索引文件按顺序写出
+        self._save_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "rescans": 0,
+            "dirs_listed": 0,
+            "dirs_reused": 0,
+            "last_scan_seconds": 0.0,
+            "total_scan_seconds": 0.0,
+        }
+        self._load()
 
-        with open(CSV_FILE, "a", newline="", encoding="utf-8") as csvfile:
-            fieldnames = ["image_path", "image_name", "quality", "timestamp"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self._dirs = json.load(f).get("dirs", {})
+        except (OSError, ValueError) as e:
+            logger.warning("读取文件夹索引失败，将重新扫描: %s", e)
+            self._dirs = {}
+
+    def _save(self):
+        with self._lock:
+            snapshot = dict(self._dirs)
+        index_dir = os.path.dirname(self.index_file)
+        with self._save_lock:
+            if index_dir:
+                os.makedirs(index_dir, exist_ok=True)
+            tmp_file = f"{self.index_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "dirs": snapshot}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+
+    def _refresh(self, folder_path):
+        """按目录mtime增量刷新索引，返回 (遍历到的目录 -> 条目, 是否有变化)
+
+        遍历在锁外进行，新列出的目录最后在锁内一次性写回索引
+        """
+        entries = {}
+        listed = []
+
+        def visit(dir_path):
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                return []
+
+            entry = self._dirs.get(dir_path)
+            if entry is None or entry["mtime"] != mtime:
+                files, subdirs = list_image_dir(dir_path)
+                # mtime精度可能只有秒级（如NFS），刚修改过的目录下次仍需重新列出
+                if time.time_ns() - mtime < FOLDER_MTIME_GRACE_NS:
+                    mtime = -1
+                entry = {"mtime": mtime, "files": files, "subdirs": subdirs}
+                listed.append(dir_path)
+            entries[dir_path] = entry
+            return entry["subdirs"]
+
+        visited = parallel_walk(folder_path, visit)
+
+        prefix = folder_path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for dir_path in listed:
+                self._dirs[dir_path] = entries[dir_path]
+            # 清理已被删除的子目录
+            stale = [
+                d
+                for d in self._dirs
+                if d not in entries and (d == folder_path or d.startswith(prefix))
+            ]
+            for d in stale:
+                del self._dirs[d]
+            self.stats["dirs_listed"] += len(listed)
+            self.stats["dirs_reused"] += len(visited) - len(listed)
+        return {d: entries[d] for d in visited if d in entries}, bool(listed) or bool(stale)
+
+    def _cached_result(self, folder_path):
+        """在锁内调用：返回未过期的缓存结果，否则返回None"""
+        cached = self._results.get(folder_path)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        return None
+
+    def get_image_files(self, folder_path):
+        """返回文件夹中所有图片的排序路径列表（调用方不应修改返回的列表）"""
+        with self._lock:
+            self.stats["requests"] += 1
+            image_files = self._cached_result(folder_path)
+            if image_files is not None:
+                self.stats["cache_hits"] += 1
+                return image_files
+            # 扫描锁按引用计数保留，最后一个使用者离开时删除，不会随文件夹数量增长
+            scan_entry = self._scan_locks.get(folder_path)
+            if scan_entry is None:
+                scan_entry = self._scan_locks[folder_path] = [threading.Lock(), 0]
+            scan_entry[1] += 1
 
-            if not file_exists:
-                writer.writeheader()
+        try:
+            with scan_entry[0]:
+                image_files, changed = self._scan(folder_path)
+        finally:
+            with self._lock:
+                scan_entry[1] -= 1
+                if scan_entry[1] == 0:
+                    del self._scan_locks[folder_path]
+
+        if changed:
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning("保存文件夹索引失败: %s", e)
+
+        return image_files
+
+    def _scan(self, folder_path):
+        """持有该文件夹的扫描锁时调用，返回 (排序后的图片路径列表, 索引是否有变化)"""
+        # 等待期间其他请求可能已经完成了同一文件夹的扫描
+        with self._lock:
+            image_files = self._cached_result(folder_path)
+            if image_files is not None:
+                self.stats["cache_hits"] += 1
+                return image_files, False
+
+        start = time.perf_counter()
+        visited, changed = self._refresh(folder_path)
+        # 每个目录的文件名已排序，合并各目录的有序结果即可得到全局有序列表
+        chunks = [
+            [os.path.join(dir_path, n) for n in entry["files"]]
+            for dir_path, entry in visited.items()
+            if entry["files"]
+        ]
+        image_files = list(heapq.merge(*chunks))
+        elapsed = time.perf_counter() - start
+        directory_scan_seconds.observe(elapsed)
+
+        with self._lock:
+            self.stats["rescans"] += 1
+            self.stats["last_scan_seconds"] = elapsed
+            self.stats["total_scan_seconds"] += elapsed
+            self._results[folder_path] = (time.monotonic(), image_files)
+        return image_files, changed
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["indexed_dirs"] = len(self._dirs)
+            stats["cached_folders"] = len(self._results)
+        requests = stats["requests"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / requests if requests else 0.0
+        return stats
+
+
+get_folder_index = LazySingleton(lambda: FolderIndex(FOLDER_INDEX_FILE))
 
-            # 写入新的标注数据
-            for image_path, annotation in annotations.items():
-                image_name = os.path.basename(image_path)
-                writer.writerow(
-                    {
-                        "image_path": image_path,
-                        "image_name": image_name,
-                        "quality": annotation["quality"],
-                        "timestamp": annotation["timestamp"],
-                    }
-                )
 
-        return True
-    except Exception as e:
-        print(f"保存CSV时出错: {e}")
-        return False
+def get_image_files(folder_path):
+    """获取文件夹中的所有图片文件"""
+    if not os.path.exists(folder_path):
+        return []
+
+    return get_folder_index().get_image_files(os.path.abspath(folder_path))
+
+
+class DedupIndex:
+    """会话CSV的去重视图
+
+    每写入一行就更新：按image_path保留时间戳最新的一行（时间戳相同时保留后写入的行），
+    并同步维护质量分布，因此生成去重快照只与唯一图片数相关，无需重新读取和解析CSV。
+    """
+
+    def __init__(self):
+        # image_path -> (时间戳排序键, 行号, 行数据)
+        self._latest = {}
+        self._quality_counts = {}
+        # 已写入的总行数，同时作为增量查询的偏移量
+        self.row_count = 0
+        # 上一次生成去重结果时的偏移量
+        self.last_run_offset = 0
+        self._lock = threading.Lock()
+
+    def load_csv(self, csv_file):
+        """从已有的CSV文件初始化索引（仅在启动时需要）"""
+        with open(csv_file, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self.add(row)
+
+    def add(self, row):
+        key = timestamp_sort_key(row["timestamp"])
+        with self._lock:
+            row_no = self.row_count
+            self.row_count += 1
+
+            image_path = row["image_path"]
+            previous = self._latest.get(image_path)
+            if previous is not None:
+                if key < previous[0]:
+                    return
+                old_quality = previous[2]["quality"]
+                self._quality_counts[old_quality] -= 1
+                if not self._quality_counts[old_quality]:
+                    del self._quality_counts[old_quality]
+
+            self._latest[image_path] = (key, row_no, row)
+            quality = row["quality"]
+            self._quality_counts[quality] = self._quality_counts.get(quality, 0) + 1
+
+    def snapshot(self, since=None):
+        """返回去重后的记录（按image_path排序）以及当前偏移量
+
+        Args:
+            since (int): 只返回最新一行位于该偏移量（含）之后的图片，None表示全部
+        """
+        with self._lock:
+            offset = self.row_count
+            entries = list(self._latest.items())
+            deduplicated_count = len(entries)
+            quality_counts = dict(self._quality_counts)
+
+        if since is not None:
+            entries = [item for item in entries if item[1][1] >= since]
+        entries.sort(key=lambda item: item[0])
+
+        return {
+            "records": [item[1][2] for item in entries],
+            "offset": offset,
+            "original_count": offset,
+            "deduplicated_count": deduplicated_count,
+            "quality_distribution": ", ".join(
+                [f"{k}: {v}" for k, v in quality_counts.items()]
+            ),
+        }
+
+
+class AnnotationStore:
+    """标注存储
+
+    内存中按图片路径维护最新标注。保存请求只更新内存状态并把变更放入待写队列，
+    由唯一的写入线程按批次追加写入预写日志（批量fsync）和CSV，请求线程不做文件IO，
+    并发保存的行不会交错。<预写日志>.lock 文件锁保证同一时间只有一个服务器进程写入。
+    """
+
+    def __init__(
+        self,
+        wal_file,
+        csv_file,
+        fsync_interval=WAL_FSYNC_INTERVAL,
+        fsync_records=WAL_FSYNC_RECORDS,
+    ):
+        self.wal_file = wal_file
+        self.csv_file = csv_file
+        self.fsync_interval = fsync_interval
+        self.fsync_records = fsync_records
+
+        # image_path -> {"quality", "timestamp"}
+        self._state = {}
+        # 每个客户端已确认的最大保存序号（client_id -> seq），用于忽略重复或乱序的提交
+        self._client_seqs = {}
+        # 尚未写入预写日志的行，以及尚未物化到CSV的变更行
+        self._wal_pending = []
+        self._csv_pending = []
+        self._csv_handle = None
+        self._unsynced = 0
+        # 会话CSV的去重视图，随每次写入同步更新
+        self.dedup_index = DedupIndex()
+        if os.path.exists(csv_file):
+            self.dedup_index.load_csv(csv_file)
+        # 会话CSV的旁路索引，供去重和过滤工具按偏移读取
+        self.csv_index = CsvIndex.open(csv_file) or CsvIndex.build(csv_file)
+        self._index_saved_at = time.monotonic()
+        # _lock 保护内存状态；_write_lock 串行化文件写入，写文件时不阻塞保存请求
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+
+        wal_dir = os.path.dirname(wal_file)
+        if wal_dir:
+            os.makedirs(wal_dir, exist_ok=True)
+        self._process_lock = self._acquire_process_lock()
+        replayed = self._replay()
+        if replayed > 2 * len(self._state) + 1000:
+            self._compact()
+        self._wal = open(wal_file, "a", encoding="utf-8")
+        # 预写日志和CSV最后一次成功写入后的大小，写入失败时截断到这里，避免留下半行
+        self._wal_size = os.path.getsize(wal_file)
+        self._csv_size = None
+        self._closed = False
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._writer_loop, name="annotation-writer", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _acquire_process_lock(self):
+        """独占 <预写日志>.lock；另一个进程已持有时抛出RuntimeError"""
+        if not FCNTL_AVAILABLE:
+            return None
+        handle = open(f"{self.wal_file}.lock", "w")
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            raise RuntimeError(
+                f"另一个服务器进程正在写入 {self.wal_file}，请使用单进程多线程模式运行"
+            ) from None
+        return handle
+
+    def _replay(self):
+        """回放预写日志，返回读取的记录数"""
+        if not os.path.exists(self.wal_file):
+            return 0
+
+        count = 0
+        with open(self.wal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 进程崩溃时最后一行可能只写了一半，跳过即可
+                    continue
+                self._state[record["image_path"]] = {
+                    "quality": record["quality"],
+                    "timestamp": record["timestamp"],
+                }
+                count += 1
+        return count
+
+    def _compact(self):
+        """用当前状态重写预写日志，去掉被覆盖的历史记录"""
+        tmp_file = f"{self.wal_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for image_path, entry in self._state.items():
+                f.write(self._wal_line(image_path, entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.wal_file)
+
+    @staticmethod
+    def _wal_line(image_path, entry):
+        record = {"image_path": image_path, **entry}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def get(self, image_path):
+        """返回图片的最新标注，没有则返回None"""
+        with self._lock:
+            entry = self._state.get(image_path)
+            return dict(entry) if entry else None
+
+    def labels(self, image_paths):
+        """返回 image_paths 中已有标注的图片及其最新的quality（image_path -> quality）"""
+        with self._lock:
+            state = self._state
+            return {p: state[p]["quality"] for p in image_paths if p in state}
+
+    def import_sessions(self, csv_files):
+        """把以前的会话CSV中每张图片的最新标注并入内存状态和预写日志
+
+        只有时间戳比已有标注新的条目才会写入；已导入的文件按大小和修改时间记录在
+        <预写日志>.sessions 中，下次启动时跳过。读取时使用CSV的旁路索引，只读取每张图片的最新一行。
+
+        Returns:
+            并入的条目数
+        """
+        sessions_file = f"{self.wal_file}.sessions"
+        try:
+            with open(sessions_file, "r", encoding="utf-8") as f:
+                imported = json.load(f)
+        except (OSError, ValueError):
+            imported = {}
+
+        merged = 0
+        changed = False
+        current = os.path.abspath(self.csv_file)
+        for csv_file in sorted(csv_files):
+            key = os.path.abspath(csv_file)
+            if key == current:
+                continue
+            try:
+                st = os.stat(csv_file)
+            except OSError:
+                continue
+            signature = [st.st_size, st.st_mtime_ns]
+            if imported.get(key) == signature:
+                continue
+
+            index = CsvIndex.open(csv_file) or CsvIndex.build(csv_file)
+            if index.columns is not None and "quality" in index.columns:
+                rows = index.read_rows(index.latest_offsets())
+                merged += self._merge_rows(index.columns, rows)
+            if index.dirty:
+                index.save()
+            imported[key] = signature
+            changed = True
+
+        if changed:
+            tmp_file = f"{sessions_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(imported, f, ensure_ascii=False)
+            os.replace(tmp_file, sessions_file)
+        if merged:
+            self.flush()
+        return merged
+
+    def _merge_rows(self, columns, rows):
+        """并入其他会话的行（只写预写日志，不写本次会话的CSV）"""
+        path_i = columns.index("image_path")
+        quality_i = columns.index("quality")
+        ts_i = columns.index("timestamp")
+        merged = 0
+        with self._lock:
+            for row in rows:
+                image_path, quality = row[path_i], row[quality_i]
+                if not image_path or not quality:
+                    continue
+                current = self._state.get(image_path)
+                if current is not None and timestamp_sort_key(
+                    current["timestamp"]
+                ) >= timestamp_sort_key(row[ts_i]):
+                    continue
+                entry = {"quality": quality, "timestamp": row[ts_i]}
+                self._state[image_path] = entry
+                self._wal_pending.append(self._wal_line(image_path, entry))
+                merged += 1
+        return merged
+
+    def snapshot(self):
+        """返回所有图片最新标注的副本"""
+        with self._lock:
+            return {k: dict(v) for k, v in self._state.items()}
+
+    def __len__(self):
+        return len(self._state)
+
+    def apply(self, annotations, client_id=None, seq=None):
+        """增量保存标注：只记录与当前状态不同的条目
+
+        Returns:
+            (written, duplicate): 写入的条目数、是否为已确认过的重复提交
+        """
+        with self._lock:
+            if client_id is not None and seq is not None:
+                if seq <= self._client_seqs.get(client_id, -1):
+                    return 0, True
+
+            written = 0
+            for image_path, annotation in annotations.items():
+                if not isinstance(annotation, dict) or "quality" not in annotation:
+                    continue
+                entry = {
+                    "quality": annotation["quality"],
+                    "timestamp": annotation.get("timestamp")
+                    or datetime.now().isoformat(),
+                }
+                if self._state.get(image_path) == entry:
+                    continue
+
+                self._wal_pending.append(self._wal_line(image_path, entry))
+                self._state[image_path] = entry
+                row = {
+                    "image_path": image_path,
+                    "image_name": os.path.basename(image_path),
+                    **entry,
+                }
+                self._csv_pending.append(row)
+                self.dedup_index.add(row)
+                written += 1
+
+            if client_id is not None and seq is not None:
+                self._client_seqs[client_id] = seq
+
+            self._unsynced += written
+            if self._unsynced >= self.fsync_records:
+                self._wake.set()
+
+            return written, False
+
+    def flush(self):
+        """立即把待写入的变更写入预写日志（fsync）并物化到CSV"""
+        with self._write_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._closed:
+            return
+        if self._wal.closed:
+            # 上次写入失败后没能重新打开
+            self._wal = open(self.wal_file, "a", encoding="utf-8")
+        with self._lock:
+            wal_lines, self._wal_pending = self._wal_pending, []
+            rows, self._csv_pending = self._csv_pending, []
+            self._unsynced = 0
+
+        if wal_lines:
+            try:
+                self._wal.writelines(wal_lines)
+                self._wal.flush()
+                os.fsync(self._wal.fileno())
+            except OSError:
+                # 写入失败（如磁盘已满）：整批放回队列前端，下次重试；已确认的保存不会丢失
+                self._requeue(wal_lines, rows)
+                self._wal = self._rollback(self._wal, self.wal_file, self._wal_size, "a")
+                raise
+            self._wal_size = os.fstat(self._wal.fileno()).st_size
+        if rows:
+            try:
+                self._write_csv_locked(rows)
+            except OSError:
+                # 预写日志已写入，只需重写CSV
+                self._requeue([], rows)
+                if self._csv_handle is not None:
+                    self._rollback(self._csv_handle, self.csv_file, self._csv_size, None)
+                    self._csv_handle = None
+                raise
+
+    def _requeue(self, wal_lines, rows):
+        with self._lock:
+            self._wal_pending[:0] = wal_lines
+            self._csv_pending[:0] = rows
+            self._unsynced += len(wal_lines)
+
+    @staticmethod
+    def _rollback(handle, path, size, reopen_mode):
+        """关闭写入失败的文件并截断到上次成功写入的位置，reopen_mode 不为None时重新打开"""
+        try:
+            handle.close()
+        except OSError:
+            pass
+        try:
+            if size is not None:
+                os.truncate(path, size)
+            if reopen_mode is not None:
+                return open(path, reopen_mode, encoding="utf-8")
+        except OSError:
+            pass
+        return handle
+
+    def _write_csv_locked(self, rows):
+        if self._csv_handle is None:
+            # 检查CSV文件是否存在，如果不存在则创建表头
+            file_exists = os.path.exists(self.csv_file) and os.path.getsize(self.csv_file) > 0
+            csv_dir = os.path.dirname(self.csv_file)
+            if csv_dir:
+                os.makedirs(csv_dir, exist_ok=True)
+            self._csv_handle = open(self.csv_file, "a", newline="", encoding="utf-8")
+            self._csv_size = os.fstat(self._csv_handle.fileno()).st_size
+            self._csv_writer = csv.DictWriter(
+                self._csv_handle, fieldnames=CSV_FIELDNAMES
+            )
+            if not file_exists:
+                self._csv_writer.writeheader()
+
+        self._csv_writer.writerows(rows)
+        self._csv_handle.flush()
+        self._csv_size = os.fstat(self._csv_handle.fileno()).st_size
+        self.csv_index.refresh()
+
+    def save_index(self, force=False):
+        """写出旁路索引文件（距上次写出不足 CSV_INDEX_SAVE_INTERVAL 秒时跳过，除非force）"""
+        with self._write_lock:
+            if not self.csv_index.dirty:
+                return
+            now = time.monotonic()
+            if not force and now - self._index_saved_at < CSV_INDEX_SAVE_INTERVAL:
+                return
+            self.csv_index.save()
+            self._index_saved_at = now
+
+    def get_index_stats(self):
+        with self._write_lock:
+            return self.csv_index.get_stats()
+
+    def _writer_loop(self):
+        """写入线程：每隔 fsync_interval 秒，或待写入条数达到 fsync_records 时写出一批"""
+        while not self._stop.is_set():
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.save_index()
+            except Exception as e:
+                logger.exception("同步标注日志时出错: %s", e)
+
+    def close(self):
+        """停止后台线程并同步所有未写入的数据"""
+        self._stop.set()
+        self._wake.set()
+        with self._write_lock:
+            if self._closed:
+                return
+            try:
+                self._flush_locked()
+            except OSError as e:
+                logger.error("关闭时写入标注失败，%d 条变更未写入: %s", len(self._wal_pending), e)
+            self._closed = True
+            self._wal.close()
+            if self._csv_handle is not None:
+                self._csv_handle.close()
+            if self.csv_index.dirty:
+                self.csv_index.save()
+        if self._process_lock is not None:
+            self._process_lock.close()
+
+
+_annotation_store = None
+_annotation_store_lock = threading.Lock()
+
+
+def session_csv_files():
+    """以前的会话CSV，不包括去重/合并生成的结果文件（其中的行都来自会话文件）"""
+    return [
+        p
+        for p in glob.glob(SESSION_CSV_PATTERN)
+        if not any(marker in os.path.basename(p) for marker in DERIVED_FILE_MARKERS)
+    ]
+
+
+def get_annotation_store():
+    """返回标注存储，首次调用时创建
+
+    创建时会建立 data/ 目录、取得预写日志的文件锁、回放日志并导入以前的会话，
+    因此不在导入模块时进行：基准测试等只导入本模块的脚本不会与正在运行的服务器争抢文件锁。
+    """
+    global _annotation_store
+    if _annotation_store is None:
+        with _annotation_store_lock:
+            if _annotation_store is None:
+                store = AnnotationStore(WAL_FILE, CSV_FILE)
+                try:
+                    store.import_sessions(session_csv_files())
+                except Exception as e:
+                    logger.exception("导入以前的会话标注时出错: %s", e)
+                _annotation_store = store
+    return _annotation_store
 
 
 def deduplicate_csv_file(input_file, output_file=None):
-    """对CSV文件进行去重处理"""
+    """对磁盘上的CSV文件进行流式去重（逐行读取，内存中只保留每张图片的最新一行）"""
     try:
         if not os.path.exists(input_file):
             return False, "输入文件不存在"
 
-        if PANDAS_AVAILABLE:
-            # 使用pandas进行去重
-            return deduplicate_with_pandas(input_file, output_file)
-        else:
-            # 使用标准库进行去重
-            return deduplicate_with_stdlib(input_file, output_file)
+        if output_file is None:
+            output_file = default_output_file(input_file)
+        result = stream_deduplicate(input_file, output_file)
+
+        quality_distribution = ", ".join(
+            [f"{k}: {v}" for k, v in result.pop("quality_counts").items()]
+        )
+        return True, {
+            "output_file": output_file,
+            "quality_distribution": quality_distribution,
+            **result,
+        }
 
     except Exception as e:
         return False, f"去重处理失败: {str(e)}"
 
 
-def deduplicate_with_pandas(input_file, output_file=None):
-    """使用pandas进行去重"""
-    try:
-        # 读取CSV文件
-        df = pd.read_csv(input_file)
-
-        # 检查必要的列是否存在
-        required_columns = ["image_path", "image_name", "quality", "timestamp"]
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            return False, f"CSV文件缺少必要的列: {missing_columns}"
-
-        original_count = len(df)
-
-        # 将timestamp转换为datetime以便排序
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-
-        # 按image_path分组，保留最新的记录
-        df_deduplicated = (
-            df.sort_values("timestamp")
-            .groupby("image_path")
-            .tail(1)
-            .reset_index(drop=True)
-        )
+def normalize_preview_width(width):
+    width = max(PREVIEW_MIN_WIDTH, min(PREVIEW_MAX_WIDTH, int(width)))
+    return -(-width // PREVIEW_WIDTH_STEP) * PREVIEW_WIDTH_STEP
+
+
+class PreviewCache:
+    """磁盘预览图缓存
+
+    键由源文件的路径、大小、mtime以及预览宽度和格式计算，源文件变化后自动失效；
+    文件按键的前两位分目录存放，总大小超过上限时按最近最少使用淘汰。
+    """
+
+    def __init__(self, cache_dir, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        # send_file会把相对路径解析到应用目录下，这里统一使用绝对路径
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        # key -> (文件路径, 大小)，顺序即LRU顺序
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+        self._load()
+
+    def _load(self):
+        """启动时登记已有的缓存文件，按访问时间恢复LRU顺序"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        found = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_atime, name.split(".")[0], path, st.st_size))
+        found.sort()
+        for _, key, path, size in found:
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(image_path, st, width, fmt):
+        identity = f"{image_path}\0{st.st_size}\0{st.st_mtime_ns}\0{width}\0{fmt}"
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def path_for(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def lookup(self, key):
+        """返回缓存的 (文件路径, 大小)，未命中返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            # 持久化访问时间，重启后仍能按LRU淘汰
+            os.utime(entry[0])
+        except OSError:
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    self._total_bytes -= entry[1]
+            return None
+        return entry
+
+    def add(self, key, path, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                self.stats["evictions"] += 1
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def get_preview(self, image_path, width, fmt):
+        """返回预览文件路径；应直接使用原图时返回None"""
+        st = os.stat(image_path)
+        key = self.make_key(image_path, st, width, fmt)
+        entry = self.lookup(key)
+        if entry is not None:
+            self._count("hits")
+            return entry[0] if entry[1] else None
+
+        self._count("misses")
+        output_path = self.prepare_path(key, fmt)
+        size = render_preview(image_path, output_path, width, fmt)
+        self.store_rendered(key, output_path, size)
+        return output_path if size else None
+
+    def record_error(self):
+        """记录一次预览生成失败（调用方回退为原图）"""
+        self._count("errors")
+
+    def _count(self, name):
+        # 计数与 get_stats 共用同一把锁，并发请求下不会丢失更新
+        with self._lock:
+            self.stats[name] += 1
+
+    def prepare_path(self, key, fmt):
+        """返回预览文件路径并确保所在目录存在"""
+        output_path = self.path_for(key, fmt)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return output_path
+
+    def store_rendered(self, key, output_path, size):
+        """登记 render_preview 生成的结果"""
+        if size == 0:
+            # 用空文件记录"直接使用原图"，避免每次都重新打开原图判断
+            open(output_path, "wb").close()
+        self.add(key, output_path, size)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["total_bytes"] = self._total_bytes
+        return stats
+
+
+get_preview_cache = LazySingleton(lambda: PreviewCache(PREVIEW_CACHE_DIR))
+
+
+def preview_format(accept_header):
+    """根据浏览器的Accept头选择预览格式"""
+    if WEBP_AVAILABLE and "image/webp" in (accept_header or ""):
+        return "webp"
+    return "jpeg"
+
+
+class PreviewPrefetcher:
+    """后台预生成预览图
+
+    每个客户端同一时间只有一个任务：加载新列表时取消该客户端之前的任务；
+    只保留最近加载列表的 max_jobs 个客户端的任务，更早的任务被取消并丢弃。
+    任务按列表顺序为前K张图片生成预览，提交到线程池，同时在途的图片数受限，
+    避免一次性把整个列表塞进线程池队列。
+
+    使用线程而不是进程：在多线程的服务器中fork可能死锁，子进程还会继承预写日志和文件锁，
+    服务器被强制结束后残留的子进程会让服务器无法重新启动。
+    """
+
+    def __init__(
+        self,
+        cache,
+        ahead=PREFETCH_AHEAD,
+        workers=PREFETCH_WORKERS,
+        in_flight=PREFETCH_IN_FLIGHT,
+        width=DEFAULT_PREVIEW_WIDTH,
+        max_jobs=PREFETCH_JOB_HISTORY,
+    ):
+        self.cache = cache
+        self.ahead = ahead
+        self.workers = workers
+        self.in_flight = in_flight
+        self.width = normalize_preview_width(width)
+        self.fmt = "webp" if WEBP_AVAILABLE else "jpeg"
+        self.max_jobs = max_jobs
+        self._executor = None
+        # client_id -> 任务状态，顺序即LRU顺序
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="preview-prefetch"
+            )
+        return self._executor
+
+    def start(self, images, client_id=None):
+        """为新加载的列表启动预生成任务，并取消同一客户端之前的任务"""
+        if not PIL_AVAILABLE or self.ahead <= 0 or not images:
+            return None
+
+        targets = images[: self.ahead]
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "state": "running",
+            "total": len(targets),
+            "generated": 0,
+            "cached": 0,
+            "passthrough": 0,
+            "failed": 0,
+            "started_at": datetime.now().isoformat(),
+            "elapsed_seconds": 0.0,
+            "cancel": threading.Event(),
+        }
+        with self._lock:
+            previous = self._jobs.pop(client_id, None)
+            if previous is not None:
+                previous["cancel"].set()
+            self._jobs[client_id] = job
+            while len(self._jobs) > self.max_jobs:
+                _, stale = self._jobs.popitem(last=False)
+                stale["cancel"].set()
+
+        threading.Thread(
+            target=self._run, args=(job, targets), name="preview-prefetch", daemon=True
+        ).start()
+        return job["job_id"]
+
+    def _collect(self, job, futures, done):
+        for future in done:
+            key, output_path = futures.pop(future)
+            if future.cancelled():
+                continue
+            try:
+                size = future.result()
+            except Exception:
+                job["failed"] += 1
+                continue
+            self.cache.store_rendered(key, output_path, size)
+            job["generated" if size else "passthrough"] += 1
+
+    def _run(self, job, targets):
+        start = time.perf_counter()
+        executor = self._get_executor()
+        futures = {}
+        try:
+            for image_path in targets:
+                if job["cancel"].is_set():
+                    break
+                try:
+                    st = os.stat(image_path)
+                except OSError:
+                    job["failed"] += 1
+                    continue
+                if os.path.splitext(image_path)[1].lower() == ".gif":
+                    job["passthrough"] += 1
+                    continue
+
+                key = self.cache.make_key(image_path, st, self.width, self.fmt)
+                if self.cache.lookup(key) is not None:
+                    job["cached"] += 1
+                    continue
+
+                while len(futures) >= self.in_flight:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    self._collect(job, futures, done)
+
+                output_path = self.cache.prepare_path(key, self.fmt)
+                try:
+                    future = executor.submit(
+                        render_preview, image_path, output_path, self.width, self.fmt
+                    )
+                except RuntimeError:
+                    # 解释器退出时线程池不再接受任务，按取消处理
+                    job["cancel"].set()
+                    break
+                futures[future] = (key, output_path)
+
+            if job["cancel"].is_set():
+                for future in futures:
+                    future.cancel()
+            self._collect(job, futures, wait(futures).done)
+        except Exception as e:
+            logger.warning("预生成预览图失败: %s", e)
+            job["failed"] += 1
+        finally:
+            job["state"] = "cancelled" if job["cancel"].is_set() else "done"
+            job["elapsed_seconds"] = time.perf_counter() - start
+
+    def get_status(self, client_id=None):
+        """返回任务进度；client_id为None时返回所有客户端的任务"""
+        with self._lock:
+            if client_id is not None:
+                jobs = {client_id: self._jobs.get(client_id)}
+            else:
+                jobs = dict(self._jobs)
+
+        result = {}
+        for cid, job in jobs.items():
+            if job is None:
+                continue
+            status = {k: v for k, v in job.items() if k != "cancel"}
+            finished = (
+                status["generated"]
+                + status["cached"]
+                + status["passthrough"]
+                + status["failed"]
+            )
+            status["progress"] = finished / status["total"] if status["total"] else 1.0
+            result[cid or ""] = status
+        return result
+
+
+get_preview_prefetcher = LazySingleton(lambda: PreviewPrefetcher(get_preview_cache()))
+
+
+class ImageListRegistry:
+    """最近加载的图片列表，供分页接口按游标取后续页（LRU淘汰）"""
+
+    def __init__(self, max_lists=IMAGE_LIST_CACHE_SIZE):
+        self.max_lists = max_lists
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, images, qualities=None):
+        list_id = uuid.uuid4().hex
+        with self._lock:
+            self._lists[list_id] = {"images": images, "qualities": qualities or {}}
+            while len(self._lists) > self.max_lists:
+                self._lists.popitem(last=False)
+        return list_id
+
+    def get(self, list_id):
+        with self._lock:
+            entry = self._lists.get(list_id)
+            if entry is not None:
+                self._lists.move_to_end(list_id)
+            return entry
+
+
+image_lists = ImageListRegistry()
+
+
+class WorkQueue:
+    """一个图片列表的任务队列（由 WorkQueueRegistry 加锁调用）
+
+    列表按 LEASE_SIZE 切分为分片，分片以租约的形式分配给标注者，每个客户端同时只持有一个租约。
+    租约过期或被释放时，分片中未完成的图片回到队列前端，优先分配给下一个领取任务的人。
+    """
+
+    def __init__(self, queue_id, source):
+        self.queue_id = queue_id
+        self.source = source
+        self.images = []
+        self.qualities = {}
+        # 图片路径 -> 下标；下标 -> 是否已完成
+        self._positions = {}
+        self._done = bytearray()
+        self._done_count = 0
+        # 分片 -> 图片下标列表；等待分配的分片
+        self._shards = []
+        self._pending = deque()
+        # lease_id -> {"shard", "client_id", "annotator", "expires"}
+        self._leases = {}
+        self._client_leases = {}
+        # 标注者 -> 在本队列中完成的图片数
+        self._completed = {}
+
+    def extend(self, images, qualities=None, labeled=()):
+        """加入尚未在队列中的图片（重新加载同一来源时可能有新增文件），已标注的直接记为完成"""
+        fresh = []
+        for path in images:
+            if path in self._positions:
+                continue
+            position = len(self.images)
+            self._positions[path] = position
+            self.images.append(path)
+            self._done.append(0)
+            if path in labeled:
+                self._done[position] = 1
+                self._done_count += 1
+            else:
+                fresh.append(position)
+        if qualities:
+            self.qualities.update(qualities)
+        for start in range(0, len(fresh), LEASE_SIZE):
+            self._pending.append(len(self._shards))
+            self._shards.append(fresh[start : start + LEASE_SIZE])
+        return len(fresh)
+
+    def _remaining(self, shard):
+        return [p for p in self._shards[shard] if not self._done[p]]
+
+    def _drop(self, lease_id, requeue):
+        lease = self._leases.pop(lease_id)
+        if self._client_leases.get(lease["client_id"]) == lease_id:
+            del self._client_leases[lease["client_id"]]
+        if requeue and self._remaining(lease["shard"]):
+            self._pending.appendleft(lease["shard"])
+
+    def expire(self, now):
+        # 倒序放回队列前端，使最早分配的分片最先重新分配
+        for lease_id, lease in reversed(list(self._leases.items())):
+            if lease["expires"] <= now:
+                self._drop(lease_id, requeue=True)
+
+    def acquire(self, client_id, annotator, now):
+        """返回客户端当前的租约（仍有未完成图片时续期），否则分配下一个分片；没有剩余任务时返回None"""
+        self.expire(now)
+        lease_id = self._client_leases.get(client_id)
+        if lease_id is not None:
+            lease = self._leases[lease_id]
+            if self._remaining(lease["shard"]):
+                lease["expires"] = now + LEASE_TTL
+                lease["annotator"] = annotator
+                return lease_id
+            self._drop(lease_id, requeue=False)
+
+        while self._pending:
+            shard = self._pending.popleft()
+            if not self._remaining(shard):
+                continue
+            lease_id = uuid.uuid4().hex
+            self._leases[lease_id] = {
+                "shard": shard,
+                "client_id": client_id,
+                "annotator": annotator,
+                "expires": now + LEASE_TTL,
+            }
+            self._client_leases[client_id] = lease_id
+            return lease_id
+        return None
+
+    def renew(self, lease_id, client_id, now):
+        lease = self._leases.get(lease_id)
+        if lease is None or lease["client_id"] != client_id or lease["expires"] <= now:
+            return False
+        lease["expires"] = now + LEASE_TTL
+        return True
 
-        # 按原始顺序排序（按image_path）
-        df_deduplicated = df_deduplicated.sort_values("image_path").reset_index(
-            drop=True
-        )
+    def release(self, lease_id, client_id):
+        lease = self._leases.get(lease_id)
+        if lease is None or lease["client_id"] != client_id:
+            return False
+        self._drop(lease_id, requeue=True)
+        return True
 
-        deduplicated_count = len(df_deduplicated)
+    def mark_done(self, image_paths, client_id, annotator, now):
+        """记录已完成的图片；保存标注同时为该客户端的租约续期，分片全部完成时结束租约"""
+        completed = 0
+        for path in image_paths:
+            position = self._positions.get(path)
+            if position is None or self._done[position]:
+                continue
+            self._done[position] = 1
+            completed += 1
+        if completed:
+            self._done_count += completed
+            self._completed[annotator] = self._completed.get(annotator, 0) + completed
+
+        lease_id = self._client_leases.get(client_id)
+        if lease_id is not None:
+            lease = self._leases[lease_id]
+            if not self._remaining(lease["shard"]):
+                self._drop(lease_id, requeue=False)
+            elif lease["expires"] > now:
+                lease["expires"] = now + LEASE_TTL
+        return completed
+
+    def lease_payload(self, lease_id, now):
+        """租约中尚未完成的图片及其有效期"""
+        if lease_id is None:
+            return {"lease_id": None, "images": [], "qualities": {}, "count": 0}
+        lease = self._leases[lease_id]
+        images = [self.images[p] for p in self._remaining(lease["shard"])]
+        return {
+            "lease_id": lease_id,
+            "images": images,
+            "qualities": {p: self.qualities[p] for p in images if p in self.qualities},
+            "count": len(images),
+            "expires_in": round(lease["expires"] - now, 1),
+        }
 
-        # 生成输出文件名
-        if output_file is None:
-            base_name = os.path.splitext(input_file)[0]
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"{base_name}_deduplicated_{timestamp}.csv"
+    def get_stats(self, now):
+        self.expire(now)
+        leased = 0
+        annotators = {name: {"completed": n, "leased": 0} for name, n in self._completed.items()}
+        for lease in self._leases.values():
+            remaining = len(self._remaining(lease["shard"]))
+            leased += remaining
+            entry = annotators.setdefault(lease["annotator"], {"completed": 0, "leased": 0})
+            entry["leased"] += remaining
+        return {
+            "queue_id": self.queue_id,
+            "total": len(self.images),
+            "done": self._done_count,
+            "leased": leased,
+            "pending": len(self.images) - self._done_count - leased,
+            "active_leases": len(self._leases),
+            "annotators": annotators,
+        }
 
-        # 保存去重后的数据
-        df_deduplicated.to_csv(output_file, index=False)
 
-        # 计算质量分布
-        quality_counts = df_deduplicated["quality"].value_counts()
-        quality_distribution = ", ".join(
-            [f"{k}: {v}" for k, v in quality_counts.items()]
+class WorkQueueRegistry:
+    """分配模式下的任务队列和标注者会话
+
+    同一来源（文件夹，或CSV路径+筛选条件+排序）的多次加载共用一个队列，
+    各标注者领取互不重叠的租约；已完成的图片只记录在内存中，服务器重启后由已保存的标注恢复。
+    """
+
+    def __init__(self, max_queues=WORK_QUEUE_CACHE_SIZE):
+        self.max_queues = max_queues
+        self._queues = OrderedDict()
+        self._sources = {}
+        # client_id -> {"annotator", "last_seen"}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def open(self, source, images, qualities=None, labeled=()):
+        """返回来源对应的队列ID，不存在时创建"""
+        with self._lock:
+            queue_id = self._sources.get(source)
+            if queue_id is None:
+                queue_id = uuid.uuid4().hex
+                self._sources[source] = queue_id
+                self._queues[queue_id] = WorkQueue(queue_id, source)
+                while len(self._queues) > self.max_queues:
+                    _, evicted = self._queues.popitem(last=False)
+                    del self._sources[evicted.source]
+            self._queues.move_to_end(queue_id)
+            self._queues[queue_id].extend(images, qualities, labeled)
+            return queue_id
+
+    def _touch(self, client_id, annotator, now):
+        if annotator:
+            self._sessions[client_id] = {"annotator": annotator, "last_seen": now}
+        elif client_id in self._sessions:
+            self._sessions[client_id]["last_seen"] = now
+        # 超过租约有效期没有活动的会话不再持有租约，可以丢弃
+        if len(self._sessions) > 1024:
+            for cid, session in list(self._sessions.items()):
+                if now - session["last_seen"] > LEASE_TTL:
+                    del self._sessions[cid]
+
+    def acquire(self, queue_id, client_id, annotator):
+        """为客户端领取（或重新取得）租约；队列不存在时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(queue_id)
+            if queue is None:
+                return None
+            self._touch(client_id, annotator, now)
+            lease_id = queue.acquire(client_id, annotator, now)
+            result = queue.lease_payload(lease_id, now)
+            stats = queue.get_stats(now)
+            return {
+                **result,
+                "queue_id": queue_id,
+                "finished": lease_id is None,
+                "total": stats["total"],
+                "done": stats["done"],
+                "pending": stats["pending"],
+            }
+
+    def renew(self, queue_id, lease_id, client_id):
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(queue_id)
+            if queue is None or not queue.renew(lease_id, client_id, now):
+                return False
+            self._touch(client_id, None, now)
+            return True
+
+    def release(self, queue_id, lease_id, client_id):
+        with self._lock:
+            queue = self._queues.get(queue_id)
+            return queue is not None and queue.release(lease_id, client_id)
+
+    def mark_done(self, image_paths, client_id):
+        """保存标注后调用：在所有队列中把这些图片记为完成"""
+        if not self._queues:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(client_id)
+            annotator = session["annotator"] if session else (client_id or "")
+            if session:
+                session["last_seen"] = now
+            return sum(
+                queue.mark_done(image_paths, client_id, annotator, now)
+                for queue in self._queues.values()
+            )
+
+    def get_stats(self, queue_id=None):
+        now = time.monotonic()
+        with self._lock:
+            if queue_id is not None:
+                queue = self._queues.get(queue_id)
+                return queue.get_stats(now) if queue else None
+            return {
+                "queues": [queue.get_stats(now) for queue in self._queues.values()],
+                "sessions": len(self._sessions),
+            }
+
+
+work_queues = WorkQueueRegistry()
+
+
+def encode_cursor(list_id, offset):
+    raw = f"{list_id}:{offset}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (list_id, offset)，无效时抛出ValueError"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    list_id, offset = base64.urlsafe_b64decode(padded).decode("ascii").split(":")
+    return list_id, int(offset)
+
+
+def parse_page_limit(value):
+    """解析分页大小，None表示不分页"""
+    if value is None or value == "":
+        return None
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit必须为正整数")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def image_page(list_id, entry, offset, limit):
+    """从已注册的列表中取一页"""
+    images = entry["images"]
+    page = images[offset : offset + limit]
+    end = offset + len(page)
+    qualities = entry["qualities"]
+    return {
+        "success": True,
+        "images": page,
+        "qualities": {p: qualities[p] for p in page if p in qualities},
+        "count": len(images),
+        "list_id": list_id,
+        "offset": offset,
+        "next_cursor": encode_cursor(list_id, end) if end < len(images) else None,
+    }
+
+
+def stream_image_list(list_id, images, qualities, extra):
+    """以NDJSON流式返回列表：首行为元信息，之后每行一张图片"""
+    yield json.dumps(
+        {"type": "meta", "count": len(images), "list_id": list_id, **extra},
+        ensure_ascii=False,
+    ) + "\n"
+    for path in images:
+        item = {"type": "image", "path": path}
+        if path in qualities:
+            item["quality"] = qualities[path]
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def image_list_response(data, images, qualities=None, **extra):
+    """按请求参数返回图片列表
+
+    - 未指定 limit/stream：一次返回完整列表（兼容旧客户端）
+    - limit/offset：返回一页，并给出 next_cursor 供 /api/images/page 获取后续页
+    - stream="ndjson"：以 application/x-ndjson 流式返回
+    """
+    stream = (data.get("stream") or "").strip().lower()
+    try:
+        limit = parse_page_limit(data.get("limit"))
+        offset = max(0, int(data.get("offset") or 0))
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"无效的分页参数: {e}"})
+
+    if stream == "ndjson":
+        list_id = image_lists.register(images, qualities)
+        return Response(
+            stream_with_context(
+                stream_image_list(list_id, images, qualities or {}, extra)
+            ),
+            mimetype="application/x-ndjson",
         )
 
-        return True, {
-            "output_file": output_file,
-            "original_count": original_count,
-            "deduplicated_count": deduplicated_count,
-            "removed_count": original_count - deduplicated_count,
-            "quality_distribution": quality_distribution,
-        }
+    if limit is None:
+        result = {"success": True, "images": images, "count": len(images), **extra}
+        if qualities is not None:
+            result["qualities"] = qualities
+        return jsonify(result)
 
-    except Exception as e:
-        return False, f"pandas去重失败: {str(e)}"
+    list_id = image_lists.register(images, qualities)
+    return jsonify(
+        {**image_page(list_id, image_lists.get(list_id), offset, limit), **extra}
+    )
 
 
-def deduplicate_with_stdlib(input_file, output_file=None):
-    """使用标准库进行去重"""
-    try:
-        # 读取CSV文件
-        records = []
-        with open(input_file, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                records.append(row)
+def apply_skip_labeled(data, images, qualities=None):
+    """按请求的 skip_labeled 参数处理以前标注过的图片（查询内存中的标注状态，不读取CSV）
 
-        original_count = len(records)
+    - "exclude"（或 true）：从列表中去掉已标注的图片
+    - "flag"：保留全部图片，已标注图片的最新quality放入 qualities 返回
+    - 未指定：不处理
 
-        # 按图片路径分组，保留最新的记录
-        image_groups = {}
-        for record in records:
-            image_path = record["image_path"]
-            timestamp = datetime.fromisoformat(
-                record["timestamp"].replace("Z", "+00:00")
-            )
+    Returns:
+        (images, qualities, extra)，extra 为附加到响应中的统计
+    """
+    mode = str(data.get("skip_labeled") or "").strip().lower()
+    if mode in ("", "false", "0", "none"):
+        return images, qualities, {}
+    if mode not in ("exclude", "true", "1", "flag"):
+        raise ValueError(f"无效的skip_labeled: {mode}（可选 exclude 或 flag）")
 
-            if (
-                image_path not in image_groups
-                or timestamp > image_groups[image_path]["timestamp"]
-            ):
-                image_groups[image_path] = {"record": record, "timestamp": timestamp}
+    labels = get_annotation_store().labels(images)
+    if mode == "flag":
+        return images, {**(qualities or {}), **labels}, {"labeled": len(labels)}
 
-        # 提取去重后的记录
-        deduplicated_records = [group["record"] for group in image_groups.values()]
-        deduplicated_records.sort(key=lambda x: x["image_path"])
+    images = [p for p in images if p not in labels]
+    if qualities:
+        qualities = {p: q for p, q in qualities.items() if p not in labels}
+    return images, qualities, {"labeled": len(labels)}
 
-        deduplicated_count = len(deduplicated_records)
 
-        # 生成输出文件名
-        if output_file is None:
-            base_name = os.path.splitext(input_file)[0]
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"{base_name}_deduplicated_{timestamp}.csv"
+def work_lease_response(data, source, images, qualities=None, **extra):
+    """分配模式：把列表加入来源对应的任务队列，只返回分配给该客户端的租约中的图片"""
+    client_id = str(data.get("client_id") or "")
+    if not client_id:
+        return jsonify({"success": False, "error": "分配模式需要client_id"})
+    annotator = str(data.get("annotator") or "").strip() or client_id
 
-        # 保存去重后的数据
-        with open(output_file, "w", newline="", encoding="utf-8") as f:
-            if deduplicated_records:
-                fieldnames = deduplicated_records[0].keys()
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(deduplicated_records)
+    queue_id = work_queues.open(
+        source, images, qualities, labeled=get_annotation_store().labels(images)
+    )
+    result = work_queues.acquire(queue_id, client_id, annotator)
+    get_preview_prefetcher().start(result["images"], client_id)
+    return jsonify({"success": True, **result, **extra})
 
-        # 计算质量分布
-        quality_counts = {}
-        for record in deduplicated_records:
-            quality = record["quality"]
-            quality_counts[quality] = quality_counts.get(quality, 0) + 1
 
-        quality_distribution = ", ".join(
-            [f"{k}: {v}" for k, v in quality_counts.items()]
-        )
+# 接口出错时大多返回200和 {"success": false, ...}：先在响应体中查找该片段，命中后再解析JSON确认
+_FAILED_JSON = re.compile(rb'"success":\s*false')
 
-        return True, {
-            "output_file": output_file,
-            "original_count": original_count,
-            "deduplicated_count": deduplicated_count,
-            "removed_count": original_count - deduplicated_count,
-            "quality_distribution": quality_distribution,
-        }
 
-    except Exception as e:
-        return False, f"标准库去重失败: {str(e)}"
+def is_failed_response(response):
+    """状态码不小于400，或（非流式的）JSON响应顶层 success 为 false"""
+    if response.status_code >= 400:
+        return True
+    if not response.is_json or response.is_streamed or response.direct_passthrough:
+        return False
+    if not _FAILED_JSON.search(response.get_data()):
+        return False
+    data = response.get_json(silent=True)
+    return isinstance(data, dict) and data.get("success") is False
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板（而不是具体路径）记录请求数、耗时、错误数和响应字节数
+
+    耗时截止到响应生成：图片文件和流式列表的响应体由WSGI服务器随后发送（可能走sendfile），不计入。
+    """
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    status = response.status_code
+    request_count.inc(route, request.method, str(status))
+    if is_failed_response(response):
+        request_errors.inc(route)
+    length = response.content_length
+    if length and request.method != "HEAD":
+        response_bytes.inc(route, amount=length)
+
+    start = g.get("request_start")
+    if start is not None:
+        request_latency.observe(time.perf_counter() - start, route)
+    return response
+
+
+def _cache_stats():
+    return {
+        "preview": get_preview_cache().get_stats(),
+        "manifest": manifest_cache.get_stats(),
+        "folder_index": get_folder_index().get_stats(),
+        "existence": existence_checker.get_stats(),
+    }
+
+
+def _cache_hits():
+    stats = _cache_stats()
+    return {
+        ("preview",): stats["preview"]["hits"],
+        ("manifest",): stats["manifest"]["hits"],
+        ("folder_index",): stats["folder_index"]["cache_hits"],
+        ("existence_dir",): stats["existence"]["dir_cache_hits"],
+    }
+
+
+def _cache_misses():
+    stats = _cache_stats()
+    folder = stats["folder_index"]
+    return {
+        ("preview",): stats["preview"]["misses"],
+        ("manifest",): stats["manifest"]["misses"],
+        ("folder_index",): folder["requests"] - folder["cache_hits"],
+        ("existence_dir",): stats["existence"]["dirs_listed"],
+    }
+
+
+metrics.collected(
+    "annotation_cache_hits_total", "各缓存的命中次数", _cache_hits, ("cache",), "counter"
+)
+metrics.collected(
+    "annotation_cache_misses_total", "各缓存的未命中次数", _cache_misses, ("cache",), "counter"
+)
+metrics.collected(
+    "annotation_preview_cache_bytes", "预览图缓存占用的磁盘空间",
+    lambda: get_preview_cache().get_stats()["total_bytes"],
+)
+metrics.collected(
+    "annotation_manifest_cache_bytes", "清单缓存估算的内存占用",
+    lambda: manifest_cache.get_stats()["bytes"],
+)
+metrics.collected(
+    "annotation_preview_errors_total", "生成预览图失败的次数",
+    lambda: get_preview_cache().get_stats()["errors"], type="counter",
+)
+metrics.collected(
+    "annotation_missing_images_total", "请求时才发现不存在的图片数",
+    lambda: missing_images.count, type="counter",
+)
+metrics.collected("annotation_labeled_images", "已有标注的图片数", lambda: len(_annotation_store) if _annotation_store is not None else 0)
 
 
 @app.route("/")
@@ -255,148 +2469,78 @@ def get_images():
             return jsonify({"success": False, "error": "指定路径不是文件夹"})
 
         image_files = get_image_files(folder_path)
+        image_files, qualities, extra = apply_skip_labeled(data, image_files)
+        if data.get("assign"):
+            return work_lease_response(
+                data, ("folder", folder_path), image_files, qualities, **extra
+            )
+        get_preview_prefetcher().start(image_files, data.get("client_id"))
 
-        return jsonify(
-            {"success": True, "images": image_files, "count": len(image_files)}
-        )
+        return image_list_response(data, image_files, qualities, **extra)
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
 
+def manifest_filters(manifest, filters):
+    """计算可用的过滤条件（仅对存在于CSV中的列应用），所有值转为字符串进行一致性比较"""
+    applicable_filters = {}
+    for k, v in (filters.items() if isinstance(filters, dict) else []):
+        if k in manifest.columns:
+            values = [str(x).strip() for x in (v if isinstance(v, list) else [v]) if str(x).strip() != ""]
+            if values:
+                applicable_filters[k] = values
+    return applicable_filters
+
+
+def open_manifest(csv_path):
+    """检查清单路径并从缓存取得解析结果，返回 (manifest, 错误响应)"""
+    if not csv_path:
+        return None, jsonify({"success": False, "error": "CSV文件路径不能为空"})
+
+    if not os.path.exists(csv_path):
+        return None, jsonify({"success": False, "error": "CSV文件不存在"})
+
+    if not os.path.isfile(csv_path) or not columnar_io.is_table_file(csv_path):
+        return None, jsonify({"success": False, "error": "指定路径不是CSV、Parquet、Feather或Arrow文件"})
+
+    # 解析结果按文件缓存，更换筛选条件时只需对索引求交
+    try:
+        manifest = manifest_cache.get(csv_path)
+    except Exception as e:
+        return None, jsonify({"success": False, "error": f"读取CSV失败: {e}"})
+    if manifest is None:
+        return None, jsonify({
+            "success": False,
+            "error": "CSV缺少'path'或'image_path'列"
+        })
+    return manifest, None
+
+
 @app.route("/api/images_from_csv", methods=["POST"])
 def get_images_from_csv():
-    """从CSV文件读取图片路径列表。CSV需包含列名 'path' 或 'image_path'，可选 'quality' 列"""
+    """从CSV文件读取图片路径列表。CSV需包含列名 'path' 或 'image_path'，可选 'quality' 列
+
+    也可以是 .parquet / .feather / .arrow 文件（需要安装pyarrow），列要求相同。
+
+    validate="lazy" 时不检查文件是否存在，缺失的文件在请求时返回404并记录到 /api/status。
+    """
     try:
         data = request.get_json()
         csv_path = data.get("csv_path", "").strip()
         filters = data.get("filters", {}) or {}
         order = (data.get("order") or "original").strip().lower()
+        validate = (data.get("validate") or "full").strip().lower()
 
-        if not csv_path:
-            return jsonify({"success": False, "error": "CSV文件路径不能为空"})
-
-        if not os.path.exists(csv_path):
-            return jsonify({"success": False, "error": "CSV文件不存在"})
-
-        if not os.path.isfile(csv_path) or not csv_path.lower().endswith(".csv"):
-            return jsonify({"success": False, "error": "指定路径不是CSV文件"})
+        manifest, error = open_manifest(csv_path)
+        if error is not None:
+            return error
 
-        image_paths = []
-        # 暂存从CSV读到的quality（键为原始/清洗后的字符串）；稍后会转成绝对路径键
-        raw_quality_map = {}
-
-        # 优先使用pandas读取，兼容列名 'path' 或 'image_path'
-        if PANDAS_AVAILABLE:
-            try:
-                df = pd.read_csv(csv_path)
-                candidate_cols = [col for col in ["path", "image_path"] if col in df.columns]
-                if not candidate_cols:
-                    return jsonify({
-                        "success": False,
-                        "error": "CSV缺少'path'或'image_path'列"
-                    })
-                path_col = candidate_cols[0]
-
-                # 计算可用的过滤条件（仅对存在于CSV中的列应用）
-                applicable_filters = {}
-                for k, v in (filters.items() if isinstance(filters, dict) else []):
-                    if k in df.columns:
-                        # 将所有值转为字符串进行一致性比较
-                        values = [str(x).strip() for x in (v if isinstance(v, list) else [v]) if str(x).strip() != ""]
-                        if values:
-                            applicable_filters[k] = values
-
-                # 应用过滤
-                if applicable_filters:
-                    mask = pd.Series([True] * len(df))
-                    for k, values in applicable_filters.items():
-                        mask = mask & df[k].astype(str).isin(values)
-                    df = df[mask]
-
-                image_paths = df[path_col].dropna().astype(str).tolist()
-                # 如果包含quality列，则记录下来
-                if "quality" in df.columns:
-                    for _, row in df.iterrows():
-                        raw_path = row.get(path_col)
-                        if pd.isna(raw_path):
-                            continue
-                        p = str(raw_path).strip().strip('"').strip("'")
-                        q = row.get("quality")
-                        if not pd.isna(q):
-                            raw_quality_map[p] = str(q)
-            except Exception as e:
-                return jsonify({"success": False, "error": f"读取CSV失败: {e}"})
-        else:
-            try:
-                with open(csv_path, "r", encoding="utf-8") as f:
-                    reader = csv.DictReader(f)
-                    header = reader.fieldnames or []
-                    path_col = "path" if "path" in header else ("image_path" if "image_path" in header else None)
-                    if path_col is None:
-                        return jsonify({
-                            "success": False,
-                            "error": "CSV缺少'path'或'image_path'列"
-                        })
-
-                    # 计算可用过滤条件
-                    applicable_filters = {}
-                    if isinstance(filters, dict):
-                        for k, v in filters.items():
-                            if k in header:
-                                values = [str(x).strip() for x in (v if isinstance(v, list) else [v]) if str(x).strip() != ""]
-                                if values:
-                                    applicable_filters[k] = set(values)
-
-                    for row in reader:
-                        # 如有过滤条件，则校验
-                        passes = True
-                        if applicable_filters:
-                            for k, values in applicable_filters.items():
-                                rv = (row.get(k) or "").strip()
-                                if rv not in values:
-                                    passes = False
-                                    break
-                        if not passes:
-                            continue
-
-                        value = (row.get(path_col) or "").strip()
-                        if value:
-                            image_paths.append(value)
-                            if "quality" in header:
-                                q = (row.get("quality") or "").strip()
-                                if q:
-                                    # 存原始和去引号两种形式，方便匹配
-                                    raw_quality_map[value] = q
-                                    cleaned = value.strip().strip('"').strip("'")
-                                    raw_quality_map[cleaned] = q
-            except Exception as e:
-                return jsonify({"success": False, "error": f"读取CSV失败: {e}"})
-
-        # 过滤有效的图片路径（支持相对路径，按项目根目录解析）
-        valid_images = []
-        invalid_entries = 0
-        for p in image_paths:
-            # 支持可能包含多余空白或引号的情况
-            candidate = p.strip().strip('"').strip("'")
-            # 若为相对路径，则相对项目根目录解析
-            if not os.path.isabs(candidate):
-                candidate = os.path.normpath(os.path.join(PROJECT_ROOT, candidate))
-            if os.path.exists(candidate) and is_image_file(candidate):
-                valid_images.append(candidate)
-            else:
-                invalid_entries += 1
-
-        # 将raw_quality_map的键统一解析为绝对路径，便于与valid_images匹配
-        qualities = {}
-        for raw_key, q in raw_quality_map.items():
-            k = (raw_key or "").strip().strip('"').strip("'")
-            if not os.path.isabs(k):
-                k = os.path.normpath(os.path.join(PROJECT_ROOT, k))
-            qualities[k] = q
-
-        # 仅保留有效图片的quality
-        qualities = {vp: qualities[vp] for vp in valid_images if vp in qualities}
+        applicable_filters = manifest_filters(manifest, filters)
+        valid_images, qualities, invalid_entries = select_csv_images(
+            manifest, applicable_filters, validate
+        )
+        manifest_cache.release()
 
         # 排序逻辑：original 保留 CSV 原顺序；filename 按文件名字典序
         images_out = list(valid_images)
@@ -404,17 +2548,100 @@ def get_images_from_csv():
             images_out.sort(key=lambda p: os.path.basename(p))
         # 默认 original：不排序
 
-        return jsonify({
-            "success": True,
-            "images": images_out,
-            "count": len(images_out),
-            "invalid": invalid_entries,
-            "qualities": qualities
-        })
+        images_out, qualities, extra = apply_skip_labeled(data, images_out, qualities)
+
+        if data.get("assign"):
+            source = (
+                "csv",
+                os.path.abspath(csv_path),
+                json.dumps(applicable_filters, sort_keys=True, ensure_ascii=False),
+                order,
+            )
+            return work_lease_response(
+                data,
+                source,
+                images_out,
+                qualities,
+                invalid=invalid_entries,
+                validated=validate != "lazy",
+                **extra,
+            )
+
+        get_preview_prefetcher().start(images_out, data.get("client_id"))
+
+        return image_list_response(
+            data,
+            images_out,
+            qualities,
+            invalid=invalid_entries,
+            validated=validate != "lazy",
+            **extra,
+        )
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route("/api/facets", methods=["POST"])
+def get_csv_facets():
+    """统计清单各列在当前筛选下每个取值的行数，用于交互式筛选
+
+    请求参数：csv_path、filters（同 /api/images_from_csv）、columns（默认路径列以外的所有列）、
+    limit（每列最多返回的取值数，默认50）。统计某一列时不应用该列自身的筛选条件。
+    """
+    try:
+        data = request.get_json()
+        manifest, error = open_manifest(data.get("csv_path", "").strip())
+        if error is not None:
+            return error
+
+        columns = data.get("columns")
+        if not isinstance(columns, list):
+            columns = [c for c in manifest.columns if c != manifest.path_col]
+        columns = [c for c in columns if c in manifest.columns]
+        try:
+            limit = max(1, int(data.get("limit") or 50))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "无效的limit"})
+
+        applicable_filters = manifest_filters(manifest, data.get("filters", {}) or {})
+        facets, matched = manifest.facets(applicable_filters, columns, limit)
+        manifest_cache.release()
+
+        return jsonify(
+            {
+                "success": True,
+                "total_rows": manifest.row_count,
+                "matched_rows": matched,
+                "filters": applicable_filters,
+                "facets": facets,
+            }
+        )
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+
+@app.route("/api/images/page")
+def get_image_page():
+    """按游标获取已加载图片列表的后续页"""
+    try:
+        cursor = request.args.get("cursor", "")
+        try:
+            list_id, offset = decode_cursor(cursor)
+            limit = parse_page_limit(request.args.get("limit")) or MAX_PAGE_SIZE
+        except (TypeError, ValueError, UnicodeDecodeError):
+            return jsonify({"success": False, "error": "无效的分页游标"}), 400
+
+        entry = image_lists.get(list_id)
+        if entry is None:
+            return jsonify({"success": False, "error": "图片列表已过期，请重新加载"}), 410
+
+        return jsonify(image_page(list_id, entry, offset, limit))
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+
 @app.route("/api/image/")
 def serve_image():
     """提供图片文件"""
@@ -431,60 +2658,147 @@ def serve_image():
         image_path = unquote(image_path)
 
         # 安全检查：确保路径是绝对路径且存在
-        print(f"检查路径: {image_path}")
-        print(f"是否为绝对路径: {os.path.isabs(image_path)}")
-        print(f"路径是否存在: {os.path.exists(image_path)}")
-
         if not os.path.isabs(image_path):
             return jsonify({"error": f"无效的图片路径: {image_path}"}), 400
 
         if not os.path.exists(image_path):
-            return jsonify({"error": f"图片文件不存在: {image_path}"}), 404
+            missing_images.report(image_path)
+            return (
+                jsonify({"error": f"图片文件不存在: {image_path}", "missing": True}),
+                404,
+            )
 
         if not is_image_file(image_path):
             return jsonify({"error": "不是有效的图片文件"}), 400
 
-            # 获取文件的MIME类型
+        # 获取文件的MIME类型
         mime_type, _ = mimetypes.guess_type(image_path)
         if not mime_type:
             mime_type = "application/octet-stream"
 
-        # 使用更直接的方法读取和返回文件
+        # 预览模式：w=<宽度> 时返回缩小并重新编码的预览图
+        download_name = os.path.basename(image_path)
+        preview_path = None
+        width = request.args.get("w")
+        if width and PIL_AVAILABLE and mime_type != "image/gif":
+            try:
+                width = normalize_preview_width(width)
+            except ValueError:
+                return jsonify({"error": f"无效的预览宽度: {width}"}), 400
+            fmt = preview_format(request.headers.get("Accept"))
+            try:
+                preview_path = get_preview_cache().get_preview(image_path, width, fmt)
+            except Exception as e:
+                # 无法解码的图片直接返回原图
+                get_preview_cache().record_error()
+                logger.warning("生成预览图失败，返回原图: %s: %s", image_path, e)
+            if preview_path is not None:
+                image_path = preview_path
+                mime_type = f"image/{fmt}"
+
+        # 直接从磁盘流式发送（WSGI服务器支持时走sendfile），支持Range请求，
+        # 并根据文件stat信息生成ETag/Last-Modified，重复访问时返回304
         try:
-            with open(image_path, "rb") as f:
-                file_data = f.read()
-
-            response = Response(file_data, mimetype=mime_type)
-            response.headers["Content-Disposition"] = (
-                f'inline; filename="{os.path.basename(image_path)}"'
+            response = send_file(
+                image_path,
+                mimetype=mime_type,
+                download_name=download_name,
+                conditional=True,
+                etag=True,
+                max_age=IMAGE_CACHE_MAX_AGE,
             )
-            response.headers["Cache-Control"] = "no-cache"
-            return response
-        except Exception as e:
-            print(f"读取文件失败: {e}")
+        except RequestedRangeNotSatisfiable as e:
+            return e
+        except OSError as e:
+            logger.error("读取文件失败: %s", e)
             return jsonify({"error": f"读取文件失败: {e}"}), 500
 
+        # 图片是本地数据，只允许浏览器缓存，不允许共享缓存
+        response.cache_control.public = False
+        response.cache_control.private = True
+        if width:
+            response.vary.add("Accept")
+        return response
+
     except Exception as e:
-        print(f"图片加载错误: {e}")
+        logger.exception("图片加载错误: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+def invalid_annotation_entries(annotations):
+    """返回缺少图片路径或标注内容（含quality的字典）的条目路径"""
+    return [
+        image_path
+        for image_path, annotation in annotations.items()
+        if not str(image_path).strip()
+        or not isinstance(annotation, dict)
+        or "quality" not in annotation
+    ]
+
+
+def rejected_response(rejected):
+    return jsonify(
+        {
+            "success": False,
+            "error": f"{len(rejected)} 条标注缺少图片路径或quality，本次保存未写入",
+            "rejected": rejected,
+        }
+    )
+
+
 @app.route("/api/save", methods=["POST"])
 def save_annotations():
-    """保存标注到CSV文件"""
+    """保存标注到CSV文件
+
+    增量模式：{"client_id": str, "seq": int, "changes": {image_path: {quality, timestamp}}}
+    兼容模式：{"annotations": {...}}，提交完整标注字典，服务器与已保存状态比对后只写入变化
+
+    有条目缺少图片路径或quality时整个请求不写入，返回 success=false 和 rejected 列表。
+    """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
+
+        if "changes" in data:
+            changes = data.get("changes") or {}
+            client_id = str(data.get("client_id") or "") or None
+            seq = data.get("seq")
+            if seq is not None:
+                try:
+                    seq = int(seq)
+                except (TypeError, ValueError):
+                    return jsonify({"success": False, "error": "无效的序号"})
+
+            if not isinstance(changes, dict):
+                return jsonify({"success": False, "error": "无效的标注数据"})
+            rejected = invalid_annotation_entries(changes)
+            if rejected:
+                return rejected_response(rejected)
+
+            written, duplicate = get_annotation_store().apply(changes, client_id, seq)
+            work_queues.mark_done(list(changes), client_id)
+            return jsonify(
+                {
+                    "success": True,
+                    "ack_seq": seq,
+                    "written": written,
+                    "duplicate": duplicate,
+                    "message": "标注已保存",
+                }
+            )
+
         annotations = data.get("annotations", {})
 
         if not annotations:
             return jsonify({"success": False, "error": "没有标注数据"})
+        if not isinstance(annotations, dict):
+            return jsonify({"success": False, "error": "无效的标注数据"})
+        rejected = invalid_annotation_entries(annotations)
+        if rejected:
+            return rejected_response(rejected)
 
-        success = save_to_csv(annotations)
+        written, _ = get_annotation_store().apply(annotations)
 
-        if success:
-            return jsonify({"success": True, "message": "标注已保存"})
-        else:
-            return jsonify({"success": False, "error": "保存失败"})
+        return jsonify({"success": True, "written": written, "message": "标注已保存"})
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
@@ -493,34 +2807,287 @@ def save_annotations():
 @app.route("/api/status")
 def get_status():
     """获取服务器状态"""
-    return jsonify({"status": "running", "timestamp": datetime.now().isoformat()})
+    return jsonify(
+        {
+            "status": "running",
+            "timestamp": datetime.now().isoformat(),
+            "folder_index": get_folder_index().get_stats(),
+            "preview_cache": get_preview_cache().get_stats(),
+            "existence_checks": existence_checker.get_stats(),
+            "manifest_cache": manifest_cache.get_stats(),
+            "missing_images": missing_images.get_stats(),
+            "csv_index": get_annotation_store().get_index_stats(),
+        }
+    )
+
+
+@app.route("/api/work/lease", methods=["POST"])
+def work_lease():
+    """分配模式：完成当前租约后领取下一个租约
+
+    请求：{"queue_id", "client_id", "annotator"}；队列由 /api/images 或 /api/images_from_csv
+    以 assign=true 加载时创建。返回租约中未完成的图片，finished=true 表示没有剩余任务。
+    """
+    try:
+        data = request.get_json() or {}
+        client_id = str(data.get("client_id") or "")
+        if not client_id:
+            return jsonify({"success": False, "error": "client_id不能为空"})
+        annotator = str(data.get("annotator") or "").strip() or client_id
+
+        result = work_queues.acquire(data.get("queue_id"), client_id, annotator)
+        if result is None:
+            return jsonify({"success": False, "error": "任务队列已过期，请重新加载"}), 410
+        get_preview_prefetcher().start(result["images"], client_id)
+        return jsonify({"success": True, **result})
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+
+@app.route("/api/work/renew", methods=["POST"])
+def work_renew():
+    """为租约续期：{"queue_id", "lease_id", "client_id"}；租约已过期或已被重新分配时返回410"""
+    data = request.get_json() or {}
+    renewed = work_queues.renew(
+        data.get("queue_id"), data.get("lease_id"), str(data.get("client_id") or "")
+    )
+    if not renewed:
+        return jsonify({"success": False, "error": "租约已失效，请重新领取"}), 410
+    return jsonify({"success": True, "expires_in": LEASE_TTL})
+
+
+@app.route("/api/work/release", methods=["POST"])
+def work_release():
+    """归还租约：未完成的图片立即回到队列，可分配给其他标注者"""
+    data = request.get_json() or {}
+    released = work_queues.release(
+        data.get("queue_id"), data.get("lease_id"), str(data.get("client_id") or "")
+    )
+    return jsonify({"success": True, "released": released})
+
+
+@app.route("/api/work/status")
+def work_status():
+    """任务队列进度：total/done/leased/pending 以及每个标注者完成和持有的图片数"""
+    queue_id = request.args.get("queue_id")
+    stats = work_queues.get_stats(queue_id)
+    if stats is None:
+        return jsonify({"success": False, "error": "任务队列不存在"}), 404
+    return jsonify({"success": True, **stats})
+
+
+@app.route("/api/metrics")
+def get_metrics():
+    """Prometheus文本格式的指标：各路由的请求数、延迟直方图、响应字节数，以及缓存命中和扫描/解析耗时"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/api/prefetch/status")
+def get_prefetch_status():
+    """获取后台预生成预览图任务的进度，可用 client_id 参数只查看某个客户端"""
+    return jsonify(
+        {
+            "success": True,
+            "enabled": PIL_AVAILABLE and PREFETCH_AHEAD > 0,
+            "jobs": get_preview_prefetcher().get_status(request.args.get("client_id")),
+        }
+    )
+
+
+def export_columnar(records, output_file):
+    """把去重后的标注写为列式文件，额外保存字典编码的 image_dir 列"""
+    df = pd.DataFrame(records, columns=CSV_FIELDNAMES)
+    df.insert(1, "image_dir", [os.path.dirname(p) for p in df["image_path"]])
+    columnar_io.write_table(df, output_file)
 
 
 @app.route("/api/deduplicate", methods=["POST"])
 def api_deduplicate():
-    """API端点：对CSV文件进行去重"""
+    """API端点：对CSV文件进行去重
+
+    去重结果直接来自内存中的去重索引，不再重新读取CSV。
+    带查询参数 since=<偏移量>（或 since=last 表示上一次运行的位置）时，只返回该偏移量之后
+    有新写入的图片的最新记录，不生成文件；返回的 offset 可作为下一次的 since。
+    format=parquet/feather/arrow（查询参数或JSON）时导出为列式文件，默认csv。
+    JSON中带 input_file 时改为对该CSV文件做流式去重（适用于大于内存的文件）。
+    """
     try:
-        # 检查CSV文件是否存在
-        if not os.path.exists(CSV_FILE):
+        index = get_annotation_store().dedup_index
+        since = request.args.get("since")
+        body = request.get_json(silent=True) or {}
+        export_format = (
+            request.args.get("format") or body.get("format") or "csv"
+        ).strip().lower()
+        if export_format != "csv":
+            if f".{export_format}" not in columnar_io.COLUMNAR_FORMATS:
+                return jsonify({"success": False, "error": f"不支持的导出格式: {export_format}"})
+            try:
+                columnar_io.require_columnar()
+            except ImportError as e:
+                return jsonify({"success": False, "error": str(e)})
+
+        # 指定 input_file 时对磁盘上的CSV（如合并后的大日志）做流式去重
+        input_file = body.get("input_file")
+        if input_file:
+            if export_format != "csv":
+                return jsonify({"success": False, "error": "流式去重只支持输出CSV"})
+            success, result = deduplicate_csv_file(input_file)
+            if not success:
+                return jsonify({"success": False, "error": result})
+            return jsonify({"success": True, **result})
+
+        if since is not None:
+            if since == "last":
+                since = index.last_run_offset
+            else:
+                try:
+                    since = int(since)
+                except ValueError:
+                    return jsonify({"success": False, "error": "无效的偏移量"})
+
+            result = index.snapshot(since=since)
+            index.last_run_offset = result["offset"]
+            return jsonify(
+                {
+                    "success": True,
+                    "since": since,
+                    "changed_count": len(result["records"]),
+                    **result,
+                }
+            )
+
+        if index.row_count == 0:
             return jsonify({"success": False, "error": "没有找到标注文件"})
 
-        # 执行去重
-        success, result = deduplicate_csv_file(CSV_FILE)
+        # 先把内存中尚未物化的标注写入CSV，保证会话CSV与去重结果一致
+        get_annotation_store().flush()
 
-        if success:
-            return jsonify({"success": True, **result})
+        result = index.snapshot()
+        records = result.pop("records")
+        index.last_run_offset = result["offset"]
+
+        base_name = os.path.splitext(CSV_FILE)[0]
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = f"{base_name}_deduplicated_{timestamp}.{export_format}"
+        if export_format == "csv":
+            with open(output_file, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
+                writer.writeheader()
+                writer.writerows(records)
         else:
-            return jsonify({"success": False, "error": result})
+            export_columnar(records, output_file)
+
+        return jsonify(
+            {
+                "success": True,
+                "output_file": output_file,
+                "removed_count": result["original_count"]
+                - result["deduplicated_count"],
+                **result,
+            }
+        )
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+
+@app.route("/api/merge", methods=["POST"])
+def api_merge():
+    """API端点：合并多个会话CSV并去重
+
+    JSON参数 source 为目录或通配符（默认为 data 目录下的所有会话CSV），output_file 可选。
+    每个文件并行去重后做k路归并，输出增加 source_file 列记录每行来自哪个文件。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        source = (data.get("source") or os.path.dirname(CSV_FILE) or ".").strip()
+        input_files = expand_inputs(source)
+        if not input_files:
+            return jsonify({"success": False, "error": f"没有找到要合并的CSV文件: {source}"})
+
+        # 先把本次会话尚未物化的标注写入CSV，并写出旁路索引供各文件去重时使用
+        store = get_annotation_store()
+        store.flush()
+        store.save_index(force=True)
+
+        output_file = data.get("output_file")
+        if not output_file:
+            directory = source if os.path.isdir(source) else os.path.dirname(input_files[0])
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_file = os.path.join(directory, f"annotations_merged_{timestamp}.csv")
+
+        result = merge_deduplicate(input_files, output_file)
+        quality_distribution = ", ".join(
+            [f"{k}: {v}" for k, v in result.pop("quality_counts").items()]
+        )
+        return jsonify(
+            {
+                "success": True,
+                "output_file": output_file,
+                "quality_distribution": quality_distribution,
+                **result,
+            }
+        )
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图片标注工具服务器")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"监听地址 (默认: {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"端口 (默认: {SERVER_PORT})")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=SERVER_THREADS,
+        help=f"waitress处理请求的线程数 (默认: {SERVER_THREADS})",
+    )
+    parser.add_argument(
+        "--server",
+        choices=["auto", "waitress", "werkzeug"],
+        default="auto",
+        help="WSGI服务器：auto 表示已安装waitress时使用waitress，否则使用Werkzeug多线程模式",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Flask调试模式（仅用于开发，不启用自动重载）"
+    )
+    args = parser.parse_args()
+    configure_logging()
+    # 启动时就打开标注存储：回放预写日志，另一个进程正在使用时立即退出
+    try:
+        get_annotation_store()
+    except RuntimeError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    use_waitress = not args.debug and (
+        args.server == "waitress" or (args.server == "auto" and WAITRESS_AVAILABLE)
+    )
+    if use_waitress and not WAITRESS_AVAILABLE:
+        print("错误: 未安装waitress，请运行 pip install waitress 或使用 --server werkzeug")
+        sys.exit(1)
+
     print("图片标注工具服务器启动中...")
-    print("请在浏览器中访问: http://localhost:5000")
+    print(f"请在浏览器中访问: http://localhost:{args.port}")
     print("支持的图片格式:", ", ".join(SUPPORTED_FORMATS))
     print("标注结果将保存到:", CSV_FILE)
+    print("标注预写日志:", WAL_FILE)
+    if use_waitress:
+        print(f"WSGI服务器: waitress ({args.threads} 个线程)")
+    else:
+        print("WSGI服务器: Werkzeug (多线程)")
     print("\n按 Ctrl+C 停止服务器")
 
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    if use_waitress:
+        waitress_serve(app, host=args.host, port=args.port, threads=args.threads)
+    else:
+        # 自动重载会在另一个进程中再加载一次整个应用，因此始终关闭
+        app.run(
+            debug=args.debug,
+            host=args.host,
+            port=args.port,
+            threaded=True,
+            use_reloader=False,
+        )
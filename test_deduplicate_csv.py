@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试去重规则
+同一图片保留时间戳最新的一行；时间戳相同时保留后出现的行（合并时为文件列表中靠后的文件），
+无法解析的时间戳不会覆盖可解析的时间戳。流式（内存中/分区到磁盘/旁路索引）、pandas和合并
+几种实现的结果必须一致。
+"""
+
+import csv
+
+import pytest
+
+from csv_index import CsvIndex
+from deduplicate_csv import deduplicate_annotations, merge_deduplicate, stream_deduplicate
+
+HEADER = ["image_path", "image_name", "quality", "timestamp"]
+ROWS = [
+    # a: 时间戳相同，后出现的 bad 保留
+    ["/img/a.jpg", "a.jpg", "good", "2025-08-18T02:03:32.457000"],
+    ["/img/a.jpg", "a.jpg", "bad", "2025-08-18T02:03:32.457000"],
+    # b: 时间戳更新的行保留，即使它先出现
+    ["/img/b.jpg", "b.jpg", "bad", "2025-08-18T03:00:00"],
+    ["/img/b.jpg", "b.jpg", "good", "2025-08-18T01:00:00"],
+    # c: 无法解析的时间戳不覆盖可解析的
+    ["/img/c.jpg", "c.jpg", "bad", "2025-08-18T01:00:00"],
+    ["/img/c.jpg", "c.jpg", "good", "not a timestamp"],
+]
+EXPECTED = {"/img/a.jpg": "bad", "/img/b.jpg": "bad", "/img/c.jpg": "bad"}
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return str(path)
+
+
+def read_qualities(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return {row["image_path"]: row["quality"] for row in csv.DictReader(f)}
+
+
+@pytest.mark.parametrize("mode", ["memory", "spill", "index"])
+def test_stream_deduplicate_keeps_later_row_on_tie(tmp_path, mode):
+    input_file = write_csv(tmp_path / "in.csv", ROWS)
+    if mode == "index":
+        CsvIndex.build(input_file).save()
+        assert CsvIndex.open(input_file).is_complete()
+    budget = 1 if mode == "spill" else 1024 * 1024
+    output_file = str(tmp_path / "out.csv")
+
+    result = stream_deduplicate(input_file, output_file, memory_budget=budget)
+
+    assert read_qualities(output_file) == EXPECTED
+    assert result["spilled"] == (mode == "spill")
+
+
+def test_pandas_deduplicate_keeps_later_row_on_tie(tmp_path):
+    pytest.importorskip("pandas")
+    input_file = write_csv(tmp_path / "in.csv", ROWS)
+    output_file = str(tmp_path / "out.csv")
+
+    assert deduplicate_annotations(input_file, output_file)
+    assert read_qualities(output_file) == EXPECTED
+
+
+def test_merge_keeps_later_file_on_tie(tmp_path):
+    first = write_csv(tmp_path / "annotations_1.csv", ROWS[:1])
+    second = write_csv(tmp_path / "annotations_2.csv", ROWS[1:2])
+    output_file = str(tmp_path / "merged.csv")
+
+    merge_deduplicate([first, second], output_file)
+    assert read_qualities(output_file) == {"/img/a.jpg": "bad"}
+
+    merge_deduplicate([second, first], output_file)
+    assert read_qualities(output_file) == {"/img/a.jpg": "good"}
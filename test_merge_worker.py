@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试合并工作进程不加载服务器状态
+python server.py 运行时，merge_deduplicate 以spawn方式启动的工作进程会把 server.py 作为
+__mp_main__ 重新执行；文件夹索引、预览图缓存和标注存储都不应在工作进程中创建。
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 在独立的解释器中运行：把 server.py 设为主模块（与 python server.py 相同），
+# 再用合并时的启动方式创建一个工作进程，让它报告自己的状态
+PARENT_SCRIPT = """
+import json, sys
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+sys.path.insert(0, {repo!r})
+import __main__
+__main__.__file__ = {server!r}
+from deduplicate_csv import MERGE_START_METHOD
+from test_merge_worker import probe_worker_state
+with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context(MERGE_START_METHOD)) as pool:
+    print(json.dumps(pool.submit(probe_worker_state).result()))
+"""
+
+
+def probe_worker_state():
+    """在工作进程中调用：返回重新执行的 server.py 创建了哪些服务器状态"""
+    main = sys.modules["__mp_main__"]
+    return {
+        "main_file": main.__file__,
+        "folder_index": main.get_folder_index.created,
+        "preview_cache": main.get_preview_cache.created,
+        "preview_prefetcher": main.get_preview_prefetcher.created,
+        "annotation_store": main._annotation_store is not None,
+        "data_dir": os.path.exists("data"),
+    }
+
+
+def test_merge_worker_loads_no_server_state(tmp_path):
+    """工作进程重新执行 server.py 时不创建任何服务器状态，也不在工作目录下生成data目录"""
+    script = PARENT_SCRIPT.format(repo=REPO_DIR, server=os.path.join(REPO_DIR, "server.py"))
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    state = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert state.pop("main_file") == os.path.join(REPO_DIR, "server.py")
+    assert state == {
+        "folder_index": False,
+        "preview_cache": False,
+        "preview_prefetcher": False,
+        "annotation_store": False,
+        "data_dir": False,
+    }
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+时间戳解析工具
+供服务器、去重和过滤工具共用：先从样本中识别整列的时间格式，再用固定格式向量化解析整列，
+无法解析的行单独报告而不是中断处理
+"""
+
+import re
+from datetime import datetime, timezone
+
+try:
+    import pandas as pd
+
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+
+# 支持的时间格式，按常见程度排列
+TIMESTAMP_FORMATS = [
+    "%Y-%m-%dT%H:%M:%S.%f",  # 2025-08-18T02:03:32.457000 (服务器写入的格式)
+    "%Y-%m-%dT%H:%M:%S",  # 2025-08-18T02:03:32
+    "%Y-%m-%d %H:%M:%S.%f%z",  # 2025-08-18 02:03:32.457000+00:00
+    "%Y-%m-%d %H:%M:%S%z",  # 2025-08-18 02:03:32+00:00
+    "%Y-%m-%d %H:%M:%S.%f",  # 2025-08-18 02:03:32.457000
+    "%Y-%m-%d %H:%M:%S",  # 2025-08-18 02:03:32
+    "%Y-%m-%d",  # 2025-08-18
+    "%Y/%m/%d %H:%M:%S",  # 2025/08/18 02:03:32
+    "%Y/%m/%d",  # 2025/08/18
+]
+
+# pandas的ISO 8601解析：同一列中秒的小数位数、T/空格分隔和时区可以不同
+ISO8601 = "ISO8601"
+
+ISO8601_PATTERN = re.compile(
+    r"^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}:?\d{2})?$"
+)
+TIMEZONE_PATTERN = re.compile(r"(?:Z|[+-]\d{2}:?\d{2})\s*$")
+
+# 识别格式时使用的样本行数
+SAMPLE_SIZE = 1000
+# 报告中最多列出的无法解析的行
+MAX_REPORTED_ROWS = 10
+
+
+def parse_timestamp(timestamp_str):
+    """
+    解析单个时间戳字符串，支持 TIMESTAMP_FORMATS 中的格式和ISO 8601
+    """
+    text = timestamp_str.strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"无法解析时间戳格式: {timestamp_str}") from None
+
+
+def timestamp_sort_key(value):
+    """时间戳的排序键（Unix时间，不带时区的按UTC处理）
+
+    无法解析的时间戳返回 -inf，排在所有可解析的时间戳之前。
+    """
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            dt = parse_timestamp(str(value))
+        except ValueError:
+            return float("-inf")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _sample(values, size):
+    """取开头和结尾各一半的非空样本（日志可能在中途更换过格式）"""
+    values = [v for v in values if isinstance(v, str) and v.strip()]
+    if len(values) <= size:
+        return values
+    half = size // 2
+    return values[:half] + values[-half:]
+
+
+def detect_format(values, sample_size=SAMPLE_SIZE):
+    """从样本中识别时间格式
+
+    符合ISO 8601的样本不少于任何一种strptime格式能解析的样本时返回 ISO8601；
+    否则返回能解析最多样本的格式，一个都无法解析时返回None。
+    """
+    if PANDAS_AVAILABLE and isinstance(values, pd.Series):
+        head = values.head(sample_size // 2).tolist()
+        tail = values.tail(sample_size // 2).tolist() if len(values) > sample_size // 2 else []
+        sample = _sample(head + tail, sample_size)
+    else:
+        sample = _sample(list(values), sample_size)
+    if not sample:
+        return None
+
+    sample = [v.strip() for v in sample]
+    iso_count = sum(1 for v in sample if ISO8601_PATTERN.match(v))
+    if iso_count == len(sample):
+        return ISO8601
+
+    best, best_count = None, 0
+    for fmt in TIMESTAMP_FORMATS:
+        count = 0
+        for value in sample:
+            try:
+                datetime.strptime(value, fmt)
+                count += 1
+            except ValueError:
+                pass
+        if count > best_count:
+            best, best_count = fmt, count
+    # 混有少量异常值的ISO列仍按ISO 8601解析（比固定格式更快，也兼容省略微秒的值）
+    if iso_count and iso_count >= best_count:
+        return ISO8601
+    return best
+
+
+def has_timezone(values, sample_size=SAMPLE_SIZE):
+    """样本中是否有带时区的时间戳"""
+    if PANDAS_AVAILABLE and isinstance(values, pd.Series):
+        values = values.head(sample_size).tolist() + values.tail(sample_size).tolist()
+    return any(
+        isinstance(v, str) and TIMEZONE_PATTERN.search(v.strip()) for v in values
+    )
+
+
+def _to_datetime(values, fmt, utc):
+    """按固定格式解析；utc为True时带时区和不带时区的行分开解析，不带时区的按UTC处理
+
+    （pandas在同一次解析中遇到不带时区的值时，可能沿用前一行的时区偏移）
+    """
+    if not utc:
+        return pd.to_datetime(values, format=fmt, errors="coerce")
+
+    aware = values.astype(str).str.contains(TIMEZONE_PATTERN.pattern, regex=True).to_numpy()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns, UTC]")
+    if aware.any():
+        parsed.iloc[aware] = pd.to_datetime(
+            values[aware], format=fmt, errors="coerce", utc=True
+        ).array
+    if not aware.all():
+        naive = pd.to_datetime(values[~aware], format=fmt, errors="coerce")
+        parsed.iloc[~aware] = naive.dt.tz_localize("UTC").array
+    return parsed
+
+
+def parse_column(values, fmt=None):
+    """向量化解析一列时间戳
+
+    Args:
+        values (pd.Series): 时间戳字符串列
+        fmt (str): 时间格式，None表示从样本中识别
+
+    Returns:
+        (parsed, report): 解析后的datetime64列（无法解析的为NaT；样本中有带时区的值时统一转换为UTC），
+        以及报告 {"format", "unparseable", "examples": [(行索引, 原始值), ...]}
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, {"format": None, "unparseable": 0, "examples": []}
+
+    fmt = fmt or detect_format(values)
+    utc = has_timezone(values)
+    if fmt is None:
+        dtype = "datetime64[ns, UTC]" if utc else "datetime64[ns]"
+        parsed = pd.Series(pd.NaT, index=values.index, dtype=dtype)
+    else:
+        parsed = _to_datetime(values, fmt, utc)
+
+    # 只对失败的少数行去掉首尾空白，逐个推断格式再试一次；空白行不算无法解析
+    failed = (parsed.isna() & values.notna()).to_numpy()
+    unparseable = values.iloc[:0]
+    if failed.any():
+        positions = failed.nonzero()[0]
+        text = values.iloc[positions].astype(str).str.strip()
+        positions = positions[(text != "").to_numpy()]
+        text = text[text != ""]
+        retried = _to_datetime(text, "mixed", utc)
+        parsed.iloc[positions] = retried.array
+        unparseable = values.iloc[positions[retried.isna().to_numpy()]]
+
+    report = {
+        "format": fmt,
+        "unparseable": int(len(unparseable)),
+        "examples": list(unparseable.head(MAX_REPORTED_ROWS).items()),
+    }
+    return parsed, report
+
+
+def comparable(dt, parsed):
+    """把单个时间点转换为可与 parse_column 结果比较的 pd.Timestamp"""
+    ts = pd.Timestamp(dt)
+    column_tz = getattr(parsed.dtype, "tz", None)
+    if column_tz is not None and ts.tzinfo is None:
+        return ts.tz_localize("UTC")
+    if column_tz is None and ts.tzinfo is not None:
+        return ts.tz_convert("UTC").tz_localize(None)
+    return ts
+
+
+def format_report(report, column="timestamp"):
+    """把 parse_column 的报告格式化为提示文本，全部解析成功时返回空字符串"""
+    if not report["unparseable"]:
+        return ""
+    lines = [f"警告: 列 '{column}' 中有 {report['unparseable']} 行时间戳无法解析，已跳过"]
+    for index, value in report["examples"]:
+        lines.append(f"  第 {index} 行: {value!r}")
+    if report["unparseable"] > len(report["examples"]):
+        lines.append("  ...")
+    return "\n".join(lines)